@@ -1,13 +1,41 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from contextlib import asynccontextmanager, nullcontext
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
 import shutil
 import os
 import tempfile
-from graph.run_pipeline import run_full_pipeline
+import uuid
+from datetime import date
+from typing import Any, Dict, Optional
 from pydantic import BaseModel
-from nodes.rag_node import rag_retrieve_and_answer, store_report_state
+from nodes.rag_node import ReportExpired, get_chat_usage, rag_retrieve_and_answer, store_report_state
+from utils.namespace_registry import touch as touch_namespace
+from utils.token_budget import usage_summary
+from utils.memory import PeakMemory
+from utils.metrics import HTTP_IN_FLIGHT, HTTP_REQUEST_DURATION, REQUEST_PEAK_MEMORY, render_metrics
+from utils import warmup
+
+# The analysis graph (PyMuPDF, LangGraph, every node) is imported on first use
+# or by the background warm-up, never at import time.
+warmup.record_import_time("api", time.perf_counter() - _IMPORT_STARTED)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if os.getenv("WARMUP_ON_STARTUP", "1") == "1":
+        warmup.start_warmup()
+    # Deletes namespaces left over from earlier processes, too
+    from nodes.rag_node import delete_namespace
+    from utils.namespace_registry import start_collector
 
-app = FastAPI()
+    start_collector(delete_namespace)
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow CORS for React Frontend (usually runs on port 5173 or 3000)
 # In production, replace ["*"] with your actual frontend domain
@@ -19,57 +47,208 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _route_path(request: Request) -> str:
+    """Route template (e.g. /chat) for metric labels, so raw URLs can't blow up cardinality."""
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+# Requests that decode and OCR documents; their peak RSS is sampled and reported
+MEMORY_TRACKED_PATHS = {"/analyze", "/runs/{run_id}/resume", "/runs/{run_id}"}
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    path = _route_path(request)
+    start = time.perf_counter()
+    status = 500
+    tracker = PeakMemory() if path in MEMORY_TRACKED_PATHS else nullcontext()
+    with HTTP_IN_FLIGHT.labels(path=path).track_inprogress(), tracker as memory:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            HTTP_REQUEST_DURATION.labels(
+                method=request.method, path=path, status=str(status)
+            ).observe(time.perf_counter() - start)
+    if memory is not None:
+        REQUEST_PEAK_MEMORY.labels(path=path).observe(memory.peak_bytes)
+        response.headers["X-Peak-RSS-MB"] = f"{memory.peak_bytes / 2**20:.0f}"
+        response.headers["X-Peak-RSS-Delta-MB"] = f"{memory.delta_bytes / 2**20:.0f}"
+    return response
+
+# Uploads larger than this are written to a temp file instead of being held in memory
+UPLOAD_SPILL_BYTES = int(os.getenv("UPLOAD_SPILL_BYTES", str(25 * 1024 * 1024)))
+
+def _upload_size(file: UploadFile) -> int:
+    if file.size is not None:
+        return file.size
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    return size
+
 class ChatRequest(BaseModel):
     question: str
     collection_name: str
     session_id: str = None  # Added session_id, optional
+    include_usage: bool = False  # Token usage of this session's chat calls so far
+
+class RunCorrection(BaseModel):
+    # Merged into the extracted patient info, e.g. {"Gender": "Female", "Age": "42"}
+    patient_info: Optional[Dict[str, str]] = None
+    # Parameter name -> corrected value, or {"value": ..., "unit": ...}
+    params: Optional[Dict[str, Any]] = None
+    session_id: str = None
+    # Seconds the re-run may take (ANALYSIS_DEADLINE_S by default)
+    deadline_s: Optional[float] = None
+
+def _check_deadline(deadline_s: Optional[float]) -> None:
+    if deadline_s is not None and deadline_s <= 0:
+        raise HTTPException(status_code=400, detail="deadline_s must be a positive number of seconds")
+
+def _analysis_response(result, include_usage: bool = False) -> dict:
+    # Convert result to a JSON-serializable format
+    response = {
+        "run_id": result.run_id,
+        "analysis_path": result.analysis_path or "full",
+        "risk_score": result.risk_assessment.get("score") if result.risk_assessment else 0,
+        "risk_rationale": result.risk_assessment.get("rationale") if result.risk_assessment else "",
+        "param_interpretation": result.param_interpretation,
+        "synthesis_report": result.synthesis_report,
+        "recommendations": result.recommendations,
+        "patterns": result.patterns,
+        "context_analysis": result.context_analysis,
+        "rag_collection_name": result.rag_collection_name,
+        # True when stages in skipped_nodes were left out to answer within the deadline
+        "partial": result.partial,
+        "skipped_nodes": result.skipped_nodes,
+        "errors": result.errors
+    }
+    if include_usage:
+        # Token and latency totals for every LLM call of the run, plus the per-call records
+        response["usage"] = {**usage_summary(result.llm_usage), "per_call": result.llm_usage}
+    return response
 
 @app.post("/analyze")
-async def analyze_report(file: UploadFile = File(...), session_id: str = Form(None)):
+def analyze_report(file: UploadFile = File(...), session_id: str = Form(None),
+                         patient_id: str = Form(None), report_date: str = Form(None),
+                         force_full_analysis: bool = Form(False), include_usage: bool = Form(False),
+                         token_budget: int = Form(None), deadline_s: float = Form(None)):
+    if report_date:
+        try:
+            date.fromisoformat(report_date)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="report_date must be YYYY-MM-DD")
+    if token_budget is not None and token_budget <= 0:
+        raise HTTPException(status_code=400, detail="token_budget must be a positive number of tokens")
+    _check_deadline(deadline_s)
+    tmp_path = None
+    # Returned on failure too, so the client can resume the run
+    run_id = uuid.uuid4().hex
     try:
-        # Create a temp file to store the upload
-        suffix = os.path.splitext(file.filename)[1]
-        if not suffix:
-            suffix = ".tmp"
-            
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            shutil.copyfileobj(file.file, tmp)
-            tmp_path = tmp.name
-        
-        # Run the existing pipeline
-        # run_full_pipeline returns a GraphState object (pydantic model or similar)
-        result = run_full_pipeline(tmp_path)
+        from graph.run_pipeline import run_full_pipeline
+
+        # Small uploads are processed straight from memory; only large ones spill to disk
+        if _upload_size(file) > UPLOAD_SPILL_BYTES:
+            suffix = os.path.splitext(file.filename or "")[1] or ".tmp"
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                shutil.copyfileobj(file.file, tmp)
+                tmp_path = tmp.name
+            result = run_full_pipeline(file_path=tmp_path, file_name=file.filename, run_id=run_id,
+                                       patient_id=patient_id, report_date=report_date,
+                                       force_full_analysis=force_full_analysis, token_budget=token_budget,
+                                       deadline_s=deadline_s)
+        else:
+            data = file.file.read()
+            result = run_full_pipeline(file_bytes=data, file_name=file.filename, run_id=run_id,
+                                       patient_id=patient_id, report_date=report_date,
+                                       force_full_analysis=force_full_analysis, token_budget=token_budget,
+                                       deadline_s=deadline_s)
         
         # Store result in memory for RAG context if session_id provided
         if session_id:
             store_report_state(session_id, result)
-        
-        # Clean up temp file
-        try:
-            os.remove(tmp_path)
-        except OSError:
-            pass # Best effort cleanup
-
-        # Convert result to a JSON-serializable format
-        # Assuming result has attributes corresponding to your graph state
-        response_data = {
-            "risk_score": result.risk_assessment.get("score") if result.risk_assessment else 0,
-            "risk_rationale": result.risk_assessment.get("rationale") if result.risk_assessment else "",
-            "param_interpretation": result.param_interpretation,
-            "synthesis_report": result.synthesis_report,
-            "recommendations": result.recommendations,
-            "patterns": result.patterns,
-            "context_analysis": result.context_analysis,
-            "rag_collection_name": result.rag_collection_name,
-            "errors": result.errors
-        }
-        
-        return response_data
+            touch_namespace(result.rag_collection_name, session_id=session_id)
+
+        return _analysis_response(result, include_usage)
 
     except Exception as e:
         import traceback
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail={"error": str(e), "run_id": run_id})
+    finally:
+        if tmp_path:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass # Best effort cleanup
+
+@app.post("/runs/{run_id}/resume")
+def resume_run(run_id: str, session_id: str = None, deadline_s: float = None, file: UploadFile = File(None)):
+    """
+    Re-runs a failed analysis from the failing node, reusing every checkpointed
+    step before it. A run that failed reading its upload needs the file again
+    (multipart `file`); without it the response is 409.
+    """
+    _check_deadline(deadline_s)
+    try:
+        from graph.run_pipeline import resume_pipeline
+
+        result = resume_pipeline(run_id, deadline_s=deadline_s,
+                                 file_bytes=file.file.read() if file else None,
+                                 file_name=file.filename if file else None)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail={"error": str(e), "run_id": run_id})
+
+    if session_id:
+        store_report_state(session_id, result)
+        touch_namespace(result.rag_collection_name, session_id=session_id)
+    return _analysis_response(result)
+
+@app.patch("/runs/{run_id}")
+def correct_run(run_id: str, correction: RunCorrection):
+    """Applies patient-info or value corrections and recomputes from validate_standardize onward."""
+    _check_deadline(correction.deadline_s)
+    try:
+        from graph.run_pipeline import rerun_with_corrections
+
+        result = rerun_with_corrections(run_id, correction.patient_info, correction.params,
+                                        deadline_s=correction.deadline_s)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail={"error": str(e), "run_id": run_id})
+
+    if correction.session_id:
+        store_report_state(correction.session_id, result)
+        touch_namespace(result.rag_collection_name, session_id=correction.session_id)
+    return _analysis_response(result)
+
+@app.get("/patients/{patient_id}/trends")
+def patient_trends(patient_id: str, params: str = None):
+    """
+    Time series and deltas of validated values across a patient's reports.
+    `params` is an optional comma-separated list of parameter names.
+    """
+    from utils.longitudinal_store import get_trends
+
+    names = [p.strip() for p in params.split(",") if p.strip()] if params else None
+    trends = get_trends(patient_id, names)
+    if not trends:
+        raise HTTPException(status_code=404, detail=f"No history for patient '{patient_id}'")
+    return {"patient_id": patient_id, "trends": trends}
 
 @app.post("/chat")
 def chat_with_report(request: ChatRequest):
@@ -78,10 +257,30 @@ def chat_with_report(request: ChatRequest):
              raise HTTPException(status_code=400, detail="Collection name is required")
              
         answer = rag_retrieve_and_answer(request.question, request.collection_name, request.session_id)
+        if request.include_usage:
+            return {"answer": answer, "usage": get_chat_usage(request.session_id)}
         return {"answer": answer}
+    except ReportExpired as e:
+        raise HTTPException(status_code=410, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/")
 def health_check():
     return {"status": "ok", "message": "Health AI API is running"}
+
+@app.get("/healthz")
+def liveness():
+    """Liveness probe: the process is up and serving HTTP. Never touches heavy dependencies."""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+def readiness():
+    """Readiness probe: 200 once the required subsystems are warm, 503 until then."""
+    ready, details = warmup.readiness()
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, **details})
+
+@app.get("/metrics")
+def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
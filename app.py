@@ -1,11 +1,11 @@
 import streamlit as st
-import tempfile
 import pandas as pd
 import matplotlib.pyplot as plt
 import uuid
+import hashlib
 import fitz  # PyMuPDF
 from PIL import Image
-from io import StringIO
+from io import BytesIO, StringIO
 
 from graph.run_pipeline import run_full_pipeline
 from graph.rag_pipeline import run_rag_pipeline
@@ -20,6 +20,51 @@ st.set_page_config(
     layout="wide"
 )
 
+# Preview width in pixels; larger images are downscaled once and cached
+PREVIEW_WIDTH = 1024
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# The leading underscore keeps Streamlit from hashing the raw bytes; the content hash is the key
+@st.cache_data(max_entries=32, show_spinner=False)
+def render_preview(file_hash: str, _data: bytes, is_pdf: bool) -> bytes:
+    """Preview of the first page (PDF) or the downscaled image, rendered once per content."""
+    if is_pdf:
+        with fitz.open(stream=_data, filetype="pdf") as doc:
+            if len(doc) == 0:
+                return b""
+            return doc.load_page(0).get_pixmap().tobytes("png")
+
+    img = Image.open(BytesIO(_data))
+    img.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH * 4))
+    out = BytesIO()
+    img.convert("RGB").save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+class IncompleteAnalysis(Exception):
+    """Carries a run with errors or skipped stages out of the cached call, so it is not cached."""
+
+    def __init__(self, result):
+        super().__init__("analysis incomplete")
+        self.result = result
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def analyze_report(file_hash: str, _data: bytes, _file_name: str):
+    """
+    Runs the pipeline once per distinct upload content, whatever the file is
+    called. Only complete runs are cached; re-uploading retries the others.
+    """
+    result = run_full_pipeline(file_bytes=_data, file_name=_file_name)
+    if result.errors or result.partial:
+        raise IncompleteAnalysis(result)
+    return result
+
+
 # Centered Title
 st.markdown("<h1 style='text-align: center; font-weight: bold;'>🩸 Instant CBC Analysis</h1>", unsafe_allow_html=True)
 
@@ -33,41 +78,31 @@ with st.sidebar:
     )
     
     if uploaded:
+        upload_bytes = uploaded.getvalue()
+        upload_hash = content_hash(upload_bytes)
+
         st.divider()
         st.markdown("**📄 File Preview**")
         try:
-            # Check file type
-            if uploaded.type == "application/pdf":
-                # Create a temporary file to read with fitz if simple bytes usage fails or just use bytes
-                # fitz.open(stream=..., filetype="pdf") works with bytes
-                doc = fitz.open(stream=uploaded.read(), filetype="pdf")
-                uploaded.seek(0) # Reset pointer for later use
-                
-                if len(doc) > 0:
-                    page = doc.load_page(0)  # number of page
-                    pix = page.get_pixmap()
-                    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                    st.image(img, caption="Page 1 Preview", use_container_width=True)
-            else:
-                st.image(uploaded, caption="Uploaded Image", use_container_width=True)
+            is_pdf = uploaded.type == "application/pdf"
+            preview = render_preview(upload_hash, upload_bytes, is_pdf)
+            if preview:
+                st.image(preview, caption="Page 1 Preview" if is_pdf else "Uploaded Image", use_container_width=True)
         except Exception as e:
             st.error(f"Could not detail preview: {e}")
 
 # Main Logic
 if uploaded:
-    # Save temp file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded.name.split('.')[-1]}") as tmp:
-        tmp.write(uploaded.read())
-        uploaded.seek(0)
-        file_path = tmp.name
-
     # Check if we need to re-run analysis
-    # Condition: No result in session OR new file uploaded (name changed)
-    if "analysis_result" not in st.session_state or st.session_state.get("last_uploaded_file") != uploaded.name:
+    # Condition: No result in session OR different file content (the name is irrelevant)
+    if "analysis_result" not in st.session_state or st.session_state.get("last_upload_hash") != upload_hash:
         with st.status("Processing report… please wait", expanded=False) as status:
-            result = run_full_pipeline(file_path)
+            try:
+                result = analyze_report(upload_hash, upload_bytes, uploaded.name)
+            except IncompleteAnalysis as e:
+                result = e.result
             st.session_state.analysis_result = result
-            st.session_state.last_uploaded_file = uploaded.name
+            st.session_state.last_upload_hash = upload_hash
             st.session_state.messages = [] # Clear chat history for new report
             status.update(label="Processing complete", state="complete")
     
@@ -0,0 +1,150 @@
+"""
+Compares the embedding backends (EMBEDDING_BACKEND=torch / onnx) on load
+time, resident memory, throughput and agreement with the reference vectors.
+
+    python -m benchmarks.embedding_backends                        # torch vs onnx (int8)
+    python -m benchmarks.embedding_backends --backends onnx --reference ref.npy
+    python -m benchmarks.embedding_backends --backends torch --save-reference ref.npy
+
+Each backend runs in a fresh interpreter so import cost and memory are
+measured in isolation. The texts are report pages and single report lines
+from benchmarks.synthetic_reports, i.e. the shapes that get indexed and
+queried. The ONNX vectors are checked against the torch vectors from the
+same run, or against a reference saved earlier with --save-reference (for
+images without torch). Exits non-zero when the minimum cosine similarity
+falls below --min-cosine.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+
+def sample_texts(count: int, seed: int) -> List[str]:
+    import fitz  # PyMuPDF
+
+    from benchmarks.synthetic_reports import generate_reports
+
+    texts: List[str] = []
+    for report in generate_reports(max(1, count // 20), seed=seed, with_images=False):
+        with fitz.open(stream=report.pdf_bytes, filetype="pdf") as doc:
+            page_text = "".join(page.get_text() for page in doc)
+        texts.append(page_text)
+        texts += [line.strip() for line in page_text.splitlines() if len(line.strip()) > 3]
+    return texts[:count]
+
+
+def _worker(backend: str, texts_path: str, vectors_path: str, repeat: int) -> dict:
+    """Runs inside a fresh interpreter: load one backend, embed the texts, report numbers."""
+    import numpy as np
+
+    from nodes.rag_node import EMBEDDING_MODEL_NAME
+    from utils.memory import current_rss_bytes
+
+    texts = json.loads(Path(texts_path).read_text())
+    rss_before = current_rss_bytes()
+    start = time.perf_counter()
+    if backend == "onnx":
+        from utils.onnx_embeddings import OnnxEmbeddings
+
+        model = OnnxEmbeddings(EMBEDDING_MODEL_NAME)
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME, encode_kwargs={"batch_size": 32})
+    model.embed_query("warm-up")
+    load_s = time.perf_counter() - start
+    rss_loaded = current_rss_bytes()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        vectors = model.embed_documents(texts)
+    elapsed = time.perf_counter() - start
+    np.save(vectors_path, np.asarray(vectors, dtype=np.float32))
+    return {
+        "backend": backend,
+        "load_s": round(load_s, 3),
+        "rss_loaded_mb": round((rss_loaded - rss_before) / 2**20, 1),
+        "rss_peak_mb": round((current_rss_bytes() - rss_before) / 2**20, 1),
+        "vectors_per_s": round(len(texts) * repeat / elapsed, 1),
+    }
+
+
+def run_backend(backend: str, texts_path: str, vectors_path: str, repeat: int) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.embedding_backends", "--worker", backend,
+         "--texts-file", texts_path, "--vectors-file", vectors_path, "--repeat", str(repeat)],
+        capture_output=True, text=True,
+    )
+    if out.returncode != 0:
+        raise RuntimeError(f"{backend} backend failed:\n{out.stderr.strip()}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="torch,onnx", help="comma-separated, e.g. torch,onnx")
+    parser.add_argument("--texts", type=int, default=400, help="number of texts to embed")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--min-cosine", type=float, default=0.98,
+                        help="fail when any ONNX vector is less similar than this to its reference")
+    parser.add_argument("--reference", type=Path, help="reference vectors (.npy) saved with --save-reference")
+    parser.add_argument("--save-reference", type=Path, help="save the torch vectors here")
+    parser.add_argument("--json", type=Path, help="write results to this file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--texts-file", help=argparse.SUPPRESS)
+    parser.add_argument("--vectors-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(_worker(args.worker, args.texts_file, args.vectors_file, args.repeat)))
+        return 0
+
+    import numpy as np
+
+    from utils.onnx_embeddings import cosine_agreement
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        texts_path = str(Path(tmp) / "texts.json")
+        Path(texts_path).write_text(json.dumps(sample_texts(args.texts, args.seed)))
+        vectors = {}
+        for backend in backends:
+            vectors_path = str(Path(tmp) / f"{backend}.npy")
+            result = run_backend(backend, texts_path, vectors_path, args.repeat)
+            vectors[backend] = np.load(vectors_path)
+            results.append(result)
+
+    reference = vectors.get("torch")
+    if reference is not None and args.save_reference:
+        np.save(args.save_reference, reference)
+    if reference is None and args.reference:
+        reference = np.load(args.reference)
+
+    print(f"{'backend':<8} {'load s':>8} {'RSS MB':>8} {'peak MB':>8} {'vec/s':>9} {'min cos':>8}")
+    failed = False
+    for result in results:
+        agreement = None
+        if result["backend"] != "torch" and reference is not None:
+            agreement = cosine_agreement(vectors[result["backend"]], reference)
+            result["cosine"] = agreement
+            failed |= agreement["min"] < args.min_cosine
+        print(f"{result['backend']:<8} {result['load_s']:>8} {result['rss_loaded_mb']:>8} {result['rss_peak_mb']:>8} "
+              f"{result['vectors_per_s']:>9} {format(agreement['min'], '.4f') if agreement else '-':>8}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+    if failed:
+        print(f"FAIL: ONNX vectors deviate from the reference (min cosine < {args.min_cosine})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
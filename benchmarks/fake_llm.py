@@ -0,0 +1,151 @@
+"""
+Deterministic stand-in for the Groq chat model.
+
+`fake_completion()` recognises each node's prompt and answers in the shape
+the node's parser expects, reading values straight out of the prompt so
+extraction accuracy still reflects the quality of the OCR/native text.
+`FakeChatModel` wraps it as a LangChain chat model so it can be dropped in
+via `utils.llm_utils.set_llm_override()`.
+"""
+import json
+import re
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from utils.token_utils import estimate_tokens
+
+# ExtractionOutput field -> label variants seen on real reports (longest first wins)
+FIELD_ALIASES = {
+    "Hemoglobin": ["Haemoglobin", "Hemoglobin", "Hb"],
+    "RBC": ["Total RBC Count", "RBC Count", "RBC"],
+    "PCV": ["Packed Cell Volume", "Hematocrit", "PCV", "HCT"],
+    "MCV": ["MCV"],
+    "MCH": ["MCH"],
+    "MCHC": ["MCHC"],
+    "RDW": ["RDW-CV", "RDW"],
+    "WBC": ["Total WBC Count", "Total Leukocyte Count", "WBC Count", "TLC", "WBC"],
+    "Neutrophils": ["Neutrophils"],
+    "Lymphocytes": ["Lymphocytes"],
+    "Eosinophils": ["Eosinophils"],
+    "Monocytes": ["Monocytes"],
+    "Basophils": ["Basophils"],
+    "Platelets": ["Platelet Count", "Platelets", "PLT"],
+    "ESR": ["ESR"],
+    "MPV": ["MPV"],
+    "PDW": ["PDW"],
+    "PCT": ["Plateletcrit", "PCT"],
+}
+
+NUMBER_RE = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+def _find_value(text: str, aliases: List[str]) -> Optional[float]:
+    for alias in sorted(aliases, key=len, reverse=True):
+        # Label at the start of a line, then the first number within the next cells
+        pattern = re.compile(rf"(?im)^\s*{re.escape(alias)}\b(?:\s*\([^)]*\))?(.{{0,120}})", re.S)
+        match = pattern.search(text)
+        if not match:
+            continue
+        number = NUMBER_RE.search(match.group(1))
+        if number:
+            try:
+                return float(number.group(0).replace(",", ""))
+            except ValueError:
+                return None
+    return None
+
+
+def _extraction_answer(prompt: str) -> dict:
+    # The report text follows the rules, in the human message
+    body = prompt.split("REPORT TEXT:")[-1]
+    result = {field: _find_value(body, aliases) for field, aliases in FIELD_ALIASES.items()}
+
+    name = re.search(r"Patient Name\s*:\s*([A-Za-z .]+?)(?:\s{2,}|\n|Age)", body)
+    age = re.search(r"Age\s*:\s*(\d+)", body)
+    gender = re.search(r"(?:Gender|Sex)\s*:\s*(Male|Female)", body, re.I)
+    result["PatientName"] = name.group(1).strip() if name else None
+    result["Age"] = age.group(1) if age else None
+    result["Gender"] = gender.group(1).title() if gender else None
+    return result
+
+
+def _abnormal_lines(prompt: str) -> List[str]:
+    return re.findall(r"^\s*([A-Za-z ]+): [\d.]+ .*?\((LOW|HIGH)\)", prompt, re.M)
+
+
+def _patterns_answer(prompt: str) -> dict:
+    abnormal = _abnormal_lines(prompt)
+    flags = {name.strip(): status for name, status in abnormal}
+    patterns = []
+    if flags.get("Hemoglobin") == "LOW":
+        mcv = flags.get("MCV")
+        patterns.append("Microcytic Anemia" if mcv == "LOW" else "Macrocytic Anemia" if mcv == "HIGH" else "Normocytic Anemia")
+    if flags.get("Total WBC count") == "HIGH":
+        patterns.append("Leukocytosis")
+    if flags.get("Total WBC count") == "LOW":
+        patterns.append("Leukopenia")
+    if flags.get("Platelet Count") == "LOW":
+        patterns.append("Thrombocytopenia")
+    if not patterns:
+        patterns = ["No abnormal hematologic patterns detected."] if not flags else [f"Isolated {s.lower()} {n}" for n, s in flags.items()]
+    return {
+        "patterns": patterns,
+        "risk_score": min(10, 1 + 2 * len(flags)),
+        "risk_rationale": [f"{n} is {s}" for n, s in flags.items()] or ["All parameters within reference range."],
+    }
+
+
+def fake_completion(prompt: str) -> str:
+    """Returns a deterministic answer for any of the pipeline's prompts."""
+    if "medical data extraction engine" in prompt:
+        return json.dumps(_extraction_answer(prompt))
+    if "pattern recognition system" in prompt:
+        return json.dumps(_patterns_answer(prompt))
+    if "User Context:" in prompt:
+        return json.dumps({
+            "analysis": "Findings were interpreted against adult reference ranges for the stated age and gender.",
+            "adjusted_concerns": "No additional context-specific concerns.",
+        })
+    if "senior medical consultant" in prompt:
+        findings = prompt.split("1. ABNORMAL FINDINGS (Validated Data):")[-1].split("2. DETECTED PATTERNS:")[0].strip()
+        return (
+            "**Summary**\n\nYour blood count was reviewed. "
+            f"Values outside the reference range: {findings or 'none'}.\n\n"
+            "Sincerely,\n\n**J. Likith Sagar**\nSenior Medical Consultant"
+        )
+    if "actionable health" in prompt:
+        return json.dumps({"recommendations": [
+            "Discuss these results with your doctor.",
+            "Maintain a balanced diet rich in iron and folate.",
+            "Repeat the CBC if advised by your physician.",
+        ]})
+    return "### Answer\n- This is a deterministic answer from the fake LLM."
+
+
+class FakeChatModel(BaseChatModel):
+    """LangChain chat model backed by fake_completion(), with optional simulated latency."""
+
+    model_name: str = "fake-cbc-llm"
+    latency_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-cbc-llm"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        prompt = "\n".join(m.content for m in messages if isinstance(m.content, str))
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        text = fake_completion(prompt)
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        message = AIMessage(content=text, usage_metadata={
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -0,0 +1,227 @@
+"""
+Offline per-stage benchmark for the CBC analysis pipeline.
+
+    python -m benchmarks.run_benchmarks                     # run and compare with baselines.json
+    python -m benchmarks.run_benchmarks --update-baseline   # record new baselines
+    python -m benchmarks.run_benchmarks --reports 20 --repeat 5 --json out.json
+
+Every node in nodes/ is timed in isolation on states produced by the
+preceding stages, then the whole analysis graph is run end to end. LLM calls
+go to benchmarks.fake_llm, so no network access or API keys are needed.
+Exits non-zero when a stage regresses beyond the configured tolerances.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.synthetic_reports import generate_reports
+from graph.graph_builder import build_graph
+from graph.graph_state import ReportState
+from nodes.extract_parameters import extract_parameters_node
+from nodes.ingest_and_ocr import ingest_and_ocr_node
+from nodes.model1_interpretation import model1_interpretation_node
+from nodes.model2_patterns import model2_patterns_node
+from nodes.model3_context import model3_context_node
+from nodes.recommendations import recommendations_node
+from nodes.synthesis import synthesis_node
+from nodes.validate_standardize import validate_standardize_node
+from utils.llm_utils import set_llm_override
+from utils.ocr_utils import _ensure_tesseract_installed
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines.json"
+
+# Node stages in graph order, after ingestion
+NODE_STAGES = [
+    ("extract_parameters", extract_parameters_node),
+    ("validate_standardize", validate_standardize_node),
+    ("model1_interpretation", model1_interpretation_node),
+    ("model2_patterns", model2_patterns_node),
+    ("model3_context", model3_context_node),
+    ("synthesis", synthesis_node),
+    ("recommendations", recommendations_node),
+]
+
+# Below this absolute difference a latency change is treated as timer/scheduler noise
+LATENCY_NOISE_FLOOR_MS = 5.0
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def measure(fn: Callable[[Any], Any], inputs: List[Any], repeat: int) -> Dict[str, Any]:
+    """Runs fn over all inputs `repeat` times; returns latency percentiles, throughput and peak memory."""
+    latencies = []
+    outputs = []
+    if inputs:
+        fn(inputs[0])  # warm-up: lazy imports, parser/schema construction
+    tracemalloc.start()
+    wall_start = time.perf_counter()
+    for r in range(repeat):
+        for item in inputs:
+            start = time.perf_counter()
+            out = fn(item)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if r == 0:
+                outputs.append(out)
+    wall = time.perf_counter() - wall_start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "runs": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "throughput_per_s": round(len(latencies) / wall, 2) if wall else 0.0,
+        "peak_mem_kb": round(peak / 1024, 1),
+        "_outputs": outputs,
+    }
+
+
+def extraction_accuracy(states: List[ReportState], reports) -> float:
+    """Share of ground-truth parameters extracted with the right value (1% relative tolerance)."""
+    correct = total = 0
+    for state, report in zip(states, reports):
+        for key, truth in report.values.items():
+            total += 1
+            got = (state.extracted_params.get(key) or {}).get("value")
+            if got is not None and abs(got - truth) <= max(0.01 * abs(truth), 1e-6):
+                correct += 1
+    return round(correct / total, 4) if total else 0.0
+
+
+def _apply(node: Callable) -> Callable[[ReportState], ReportState]:
+    def run(state: ReportState) -> ReportState:
+        return state.model_copy(update=node(state))
+    return run
+
+
+def run_suite(report_count: int, repeat: int, seed: int, with_ocr: bool) -> Dict[str, Dict[str, Any]]:
+    set_llm_override(FakeChatModel())
+    workdir = Path(tempfile.mkdtemp(prefix="cbc-bench-"))
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        reports = generate_reports(report_count, seed=seed, with_images=with_ocr)
+        pdf_states, image_states = [], []
+        for report in reports:
+            pdf_path = workdir / f"{report.report_id}.pdf"
+            pdf_path.write_bytes(report.pdf_bytes)
+            pdf_states.append(ReportState(raw_file_path=str(pdf_path)))
+            if with_ocr:
+                img_path = workdir / f"{report.report_id}.jpg"
+                img_path.write_bytes(report.image_bytes)
+                image_states.append(ReportState(raw_file_path=str(img_path)))
+
+        # Ingestion: native PDF text and OCR of scanned images
+        ingest = measure(_apply(ingest_and_ocr_node), pdf_states, repeat)
+        states = ingest.pop("_outputs")
+        results["ingest_pdf_text"] = ingest
+
+        if with_ocr:
+            ocr = measure(_apply(ingest_and_ocr_node), image_states, 1)
+            ocr_states = ocr.pop("_outputs")
+            extracted = [_apply(extract_parameters_node)(s) for s in ocr_states]
+            ocr["accuracy"] = extraction_accuracy(extracted, reports)
+            results["ingest_image_ocr"] = ocr
+
+        # Each node in isolation, fed with the previous node's outputs
+        for name, node in NODE_STAGES:
+            stage = measure(_apply(node), states, repeat)
+            states = stage.pop("_outputs")
+            if name == "extract_parameters":
+                stage["accuracy"] = extraction_accuracy(states, reports)
+            results[name] = stage
+
+        # Whole analysis graph end to end (RAG indexing needs Pinecone and is not included)
+        graph_app = build_graph()
+        end_to_end = measure(lambda s: ReportState(**graph_app.invoke(s)), pdf_states, repeat)
+        end_to_end["accuracy"] = extraction_accuracy(end_to_end.pop("_outputs"), reports)
+        results["graph_end_to_end"] = end_to_end
+    finally:
+        set_llm_override(None)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baselines: Dict[str, Dict[str, Any]],
+            latency_tolerance: float, accuracy_tolerance: float) -> List[str]:
+    """Returns a list of human-readable regressions against the stored baselines."""
+    regressions = []
+    for stage, base in baselines.items():
+        current = results.get(stage)
+        if not current:
+            continue
+        limit = base["p50_ms"] * (1 + latency_tolerance)
+        if current["p50_ms"] > limit and current["p50_ms"] - base["p50_ms"] > LATENCY_NOISE_FLOOR_MS:
+            regressions.append(f"{stage}: p50 {current['p50_ms']}ms > baseline {base['p50_ms']}ms (+{latency_tolerance:.0%})")
+        if "accuracy" in base and current.get("accuracy", 0) < base["accuracy"] - accuracy_tolerance:
+            regressions.append(f"{stage}: accuracy {current.get('accuracy')} < baseline {base['accuracy']}")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, Any]]) -> None:
+    header = f"{'stage':<24}{'runs':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'peak KB':>10}{'acc':>8}"
+    print(header)
+    print("-" * len(header))
+    for stage, r in results.items():
+        acc = f"{r['accuracy']:.3f}" if "accuracy" in r else "-"
+        print(f"{stage:<24}{r['runs']:>6}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+              f"{r['throughput_per_s']:>10.1f}{r['peak_mem_kb']:>10.1f}{acc:>8}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=10, help="number of synthetic reports")
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes over the reports per stage")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-ocr", action="store_true", help="skip the scanned-image OCR stage")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--latency-tolerance", type=float, default=float(os.getenv("BENCH_LATENCY_TOLERANCE", "0.5")),
+                        help="allowed relative p50 slowdown before failing (default 0.5 = +50%%)")
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.02)
+    parser.add_argument("--json", type=Path, help="write raw results to this file")
+    args = parser.parse_args(argv)
+
+    with_ocr = not args.no_ocr
+    if with_ocr and not _ensure_tesseract_installed():
+        print("Tesseract not found; skipping the image OCR stage.", file=sys.stderr)
+        with_ocr = False
+
+    results = run_suite(args.reports, args.repeat, args.seed, with_ocr)
+    print_table(results)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Baselines written to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baselines at {args.baseline}; run with --update-baseline first.")
+        return 0
+
+    regressions = compare(results, json.loads(args.baseline.read_text()),
+                          args.latency_tolerance, args.accuracy_tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Synthetic CBC reports with known ground truth.
+
+Reports are laid out like a typical Indian/US lab PDF (header, patient block,
+a four-column results table, footer notes). Each report can be produced as a
+native-text PDF or as a "scanned" image rendered from that PDF with skew,
+blur, sensor noise and JPEG artefacts.
+"""
+import io
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image, ImageFilter
+
+# canonical key (as in extracted_params) -> (printed label, unit, ref low, ref high, decimals, generation range)
+CBC_SPEC: Dict[str, Tuple[str, str, float, float, int, Tuple[float, float]]] = {
+    "Hemoglobin": ("Haemoglobin", "g/dL", 13.0, 17.0, 1, (8.0, 18.5)),
+    "Total RBC count": ("Total RBC Count", "mill/cumm", 4.5, 5.5, 2, (3.2, 6.2)),
+    "Packed Cell Volume": ("Packed Cell Volume (PCV)", "%", 40, 50, 1, (28.0, 55.0)),
+    "MCV": ("MCV", "fL", 83, 101, 1, (65.0, 110.0)),
+    "MCH": ("MCH", "pg", 27, 32, 1, (20.0, 36.0)),
+    "MCHC": ("MCHC", "g/dL", 31.5, 34.5, 1, (29.0, 36.0)),
+    "RDW": ("RDW", "%", 11.6, 14.0, 1, (11.0, 18.0)),
+    "Total WBC count": ("Total WBC Count", "cumm", 4000, 10000, 0, (2500, 16000)),
+    "Neutrophils": ("Neutrophils", "%", 40, 80, 0, (30, 85)),
+    "Lymphocytes": ("Lymphocytes", "%", 20, 40, 0, (10, 50)),
+    "Eosinophils": ("Eosinophils", "%", 1, 6, 0, (0, 9)),
+    "Monocytes": ("Monocytes", "%", 2, 10, 0, (1, 12)),
+    "Basophils": ("Basophils", "%", 0, 2, 0, (0, 2)),
+    "Platelet Count": ("Platelet Count", "cumm", 150000, 410000, 0, (60000, 520000)),
+    "ESR": ("ESR", "mm/hr", 0, 15, 0, (2, 45)),
+    "MPV": ("MPV", "fL", 7.5, 11.5, 1, (6.5, 13.0)),
+}
+
+FIRST_NAMES = ["Asha", "Ravi", "Meera", "John", "Priya", "Arjun", "Sara", "Kiran"]
+LAST_NAMES = ["Kumar", "Sharma", "Reddy", "Smith", "Rao", "Patel", "Das", "Iyer"]
+
+FOOTER = [
+    "Method: Automated cell counter (impedance + flow cytometry). Smear examined where flagged.",
+    "Note: Results relate only to the sample received. Please correlate clinically.",
+    "This is an electronically authenticated report. ** End of Report **",
+]
+
+
+@dataclass
+class SyntheticReport:
+    report_id: str
+    values: Dict[str, float]
+    patient: Dict[str, str]
+    pdf_bytes: bytes = b""
+    image_bytes: bytes = b""
+    meta: Dict[str, float] = field(default_factory=dict)
+
+
+def _format_value(key: str, value: float) -> str:
+    decimals = CBC_SPEC[key][4]
+    if decimals == 0:
+        return str(int(round(value)))
+    return f"{value:.{decimals}f}"
+
+
+def generate_values(rng: random.Random, abnormal_ratio: float = 0.25) -> Dict[str, float]:
+    """Picks a value per parameter; roughly `abnormal_ratio` of them fall outside the reference range."""
+    values = {}
+    for key, (_, _, low, high, decimals, (gen_low, gen_high)) in CBC_SPEC.items():
+        if rng.random() < abnormal_ratio:
+            value = rng.uniform(gen_low, gen_high)
+        else:
+            value = rng.uniform(low, high)
+        value = round(value, decimals)
+        values[key] = float(int(value)) if decimals == 0 else value
+    return values
+
+
+def render_pdf(values: Dict[str, float], patient: Dict[str, str]) -> bytes:
+    """Lays out a one-page lab report; each table cell is a separate text object like real lab PDFs."""
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)  # A4 in points
+
+    page.insert_text((50, 50), "CITY DIAGNOSTICS LABORATORY", fontsize=14, fontname="hebo")
+    page.insert_text((50, 66), "NABL Accredited | 24x7 Lab Services | Ph: 040-1234-5678", fontsize=8)
+
+    page.insert_text((50, 100), f"Patient Name : {patient['Name']}", fontsize=10)
+    page.insert_text((330, 100), f"Age : {patient['Age']} Years", fontsize=10)
+    page.insert_text((50, 115), f"Gender : {patient['Gender']}", fontsize=10)
+    page.insert_text((330, 115), "Sample : EDTA Whole Blood", fontsize=10)
+
+    page.insert_text((50, 145), "COMPLETE BLOOD COUNT (CBC)", fontsize=12, fontname="hebo")
+    columns = (50, 250, 340, 430)
+    for x, header in zip(columns, ("Test Name", "Result", "Unit", "Reference Range")):
+        page.insert_text((x, 165), header, fontsize=10, fontname="hebo")
+
+    y = 185
+    for key, value in values.items():
+        label, unit, low, high, _, _ = CBC_SPEC[key]
+        cells = (label, _format_value(key, value), unit, f"{low:g} - {high:g}")
+        for x, cell in zip(columns, cells):
+            page.insert_text((x, y), cell, fontsize=10)
+        y += 17
+
+    y += 20
+    for line in FOOTER:
+        page.insert_text((50, y), line, fontsize=8)
+        y += 12
+
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def scan_image(pdf_bytes: bytes, rng: random.Random, dpi: int = 150) -> Tuple[bytes, Dict[str, float]]:
+    """Renders the PDF and degrades it to look like a phone photo / office scan."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    pix = doc.load_page(0).get_pixmap(dpi=dpi)
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    doc.close()
+
+    skew = rng.uniform(-1.5, 1.5)
+    img = img.rotate(skew, resample=Image.BICUBIC, expand=True, fillcolor=(255, 255, 255))
+    img = img.filter(ImageFilter.GaussianBlur(radius=rng.uniform(0.3, 0.8)))
+
+    arr = np.asarray(img, dtype=np.int16)
+    noise = np.random.default_rng(rng.randrange(2**32)).normal(0, 8, arr.shape)
+    arr = np.clip(arr + noise, 0, 255).astype(np.uint8)
+    img = Image.fromarray(arr)
+
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=rng.randint(55, 80))
+    return buf.getvalue(), {"skew_deg": round(skew, 2), "dpi": dpi}
+
+
+def generate_reports(count: int, seed: int = 42, with_images: bool = True) -> List[SyntheticReport]:
+    rng = random.Random(seed)
+    reports = []
+    for i in range(count):
+        patient = {
+            "Name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "Age": str(rng.randint(18, 80)),
+            "Gender": rng.choice(["Male", "Female"]),
+        }
+        values = generate_values(rng)
+        report = SyntheticReport(report_id=f"synthetic-{seed}-{i:03d}", values=values, patient=patient)
+        report.pdf_bytes = render_pdf(values, patient)
+        if with_images:
+            report.image_bytes, report.meta = scan_image(report.pdf_bytes, rng)
+        reports.append(report)
+    return reports
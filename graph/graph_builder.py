@@ -4,32 +4,49 @@ from graph.graph_state import ReportState
 from nodes.ingest_and_ocr import ingest_and_ocr_node
 from nodes.extract_parameters import extract_parameters_node
 from nodes.validate_standardize import validate_standardize_node
+from nodes.record_history import record_history_node
 from nodes.model1_interpretation import model1_interpretation_node
 from nodes.model2_patterns import model2_patterns_node
 from nodes.model3_context import model3_context_node
 from nodes.synthesis import synthesis_node
 from nodes.recommendations import recommendations_node
+from nodes.fast_path import normal_report_node, should_take_fast_path
+from utils.metrics import ANALYSIS_PATH, timed_node
 
-def build_graph():
+def route_after_interpretation(state):
+    """All-normal reports get the templated summary instead of the four LLM stages."""
+    path = "fast" if should_take_fast_path(state) else "full"
+    ANALYSIS_PATH.labels(path=path).inc()
+    return path
+
+def build_graph(checkpointer=None):
     workflow = StateGraph(ReportState)
 
-    workflow.add_node("ingest_and_ocr", ingest_and_ocr_node)
-    workflow.add_node("extract_parameters", extract_parameters_node)
-    workflow.add_node("validate_standardize", validate_standardize_node)
-    workflow.add_node("model1_interpretation", model1_interpretation_node)
-    workflow.add_node("model2_patterns", model2_patterns_node)
-    workflow.add_node("model3_context", model3_context_node)
-    workflow.add_node("synthesis", synthesis_node)
-    workflow.add_node("recommendations", recommendations_node)
+    workflow.add_node("ingest_and_ocr", timed_node("ingest_and_ocr", ingest_and_ocr_node))
+    workflow.add_node("extract_parameters", timed_node("extract_parameters", extract_parameters_node))
+    workflow.add_node("validate_standardize", timed_node("validate_standardize", validate_standardize_node))
+    workflow.add_node("record_history", timed_node("record_history", record_history_node))
+    workflow.add_node("model1_interpretation", timed_node("model1_interpretation", model1_interpretation_node))
+    workflow.add_node("normal_report", timed_node("normal_report", normal_report_node))
+    workflow.add_node("model2_patterns", timed_node("model2_patterns", model2_patterns_node))
+    workflow.add_node("model3_context", timed_node("model3_context", model3_context_node))
+    workflow.add_node("synthesis", timed_node("synthesis", synthesis_node))
+    workflow.add_node("recommendations", timed_node("recommendations", recommendations_node))
 
     workflow.set_entry_point("ingest_and_ocr")
     workflow.add_edge("ingest_and_ocr", "extract_parameters")
     workflow.add_edge("extract_parameters", "validate_standardize")
-    workflow.add_edge("validate_standardize", "model1_interpretation")
-    workflow.add_edge("model1_interpretation", "model2_patterns")
+    workflow.add_edge("validate_standardize", "record_history")
+    workflow.add_edge("record_history", "model1_interpretation")
+    workflow.add_conditional_edges(
+        "model1_interpretation",
+        route_after_interpretation,
+        {"fast": "normal_report", "full": "model2_patterns"},
+    )
+    workflow.add_edge("normal_report", END)
     workflow.add_edge("model2_patterns", "model3_context")
     workflow.add_edge("model3_context", "synthesis")
     workflow.add_edge("synthesis", "recommendations")
     workflow.add_edge("recommendations", END)
 
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
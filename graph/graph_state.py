@@ -2,8 +2,28 @@ from pydantic import BaseModel
 from typing import Dict, Any, Optional, List
 
 class ReportState(BaseModel):
+    # Checkpoint thread id; used to resume or patch a run
+    run_id: Optional[str] = None
+    # Run the LLM stages even when every parameter is normal
+    force_full_analysis: bool = False
+    # "fast" when the templated all-normal path produced the report, "full" otherwise
+    analysis_path: Optional[str] = None
+    # Max prompt + completion tokens for all LLM calls of this run (None: LLM_REQUEST_TOKEN_BUDGET)
+    token_budget: Optional[int] = None
+    # Wall-clock deadline of the request (epoch seconds); None = no deadline
+    deadline: Optional[float] = None
+    # True when stages were skipped to meet the deadline; skipped_nodes lists them
+    partial: bool = False
+    skipped_nodes: List[str] = []
+    # Caller-supplied patient key and report date (YYYY-MM-DD) for the longitudinal store
+    patient_id: Optional[str] = None
+    report_date: Optional[str] = None
+    # In-memory uploads are not part of the state (it is checkpointed); see utils/upload_store.py
     raw_file_path: Optional[str] = None
+    raw_file_name: Optional[str] = None
     raw_text: Optional[str] = None
+    # Result rows rebuilt from native-PDF word coordinates: label, value, unit, reference, flag, page
+    structured_rows: List[Dict[str, Any]] = []
     extracted_params: Dict[str, Dict[str, Any]] = {}
     validated_params: Dict[str, Dict[str, Any]] = {}
     param_interpretation: Dict[str, Dict[str, Any]] = {}
@@ -24,5 +44,11 @@ class ReportState(BaseModel):
     
     # RAG Context
     rag_collection_name: Optional[str] = None
+    # Compact summary used by chat prompts, built once after analysis
+    report_digest: Optional[str] = None
     
-    errors: List[str] = []
\ No newline at end of file
+    errors: List[str] = []
+    # One entry per LLM call: node, model, prompt_tokens, completion_tokens, latency_s, estimated
+    llm_usage: List[Dict[str, Any]] = []
+    # Nodes whose call failed softly (error recorded, output missing); resume restarts from the first
+    failed_nodes: List[str] = []
\ No newline at end of file
@@ -1,34 +1,222 @@
+import os
+import uuid
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
 from graph.graph_builder import build_graph
 from graph.rag_graph_builder import build_rag_graph
 from graph.graph_state import ReportState
+from nodes.rag_node import RAG_CHUNKING
+from utils.checkpointing import get_checkpointer, record_run, run_config
+from utils.deadline import request_deadline
+from utils import namespace_registry, upload_store
+from utils.report_digest import build_report_digest
+from utils.metrics import PIPELINE_DURATION
 from dotenv import load_dotenv
 
 # Ensure env vars are loaded for Qdrant Cloud
 load_dotenv()
 
-def run_full_pipeline(file_path):
-    # 1. Run Analysis Graph
-    graph_app = build_graph()
-    initial_state = ReportState(raw_file_path=file_path)
-    final_state = graph_app.invoke(initial_state)
+# Corrections to patient info or values replay the graph from here
+CORRECTION_ENTRY_NODE = "validate_standardize"
+
+@lru_cache(maxsize=None)
+def get_analysis_graph():
+    """Compiled analysis graph, built once per process."""
+    return build_graph(checkpointer=get_checkpointer())
 
+@lru_cache(maxsize=None)
+def get_rag_graph():
+    """Compiled RAG indexing graph, built once per process."""
+    return build_rag_graph()
+
+def _index_and_finish(graph_app, config, final_state, reindex: bool = True, collection_name: Optional[str] = None):
+    """
+    Builds the chat digest, indexes the report for RAG and records both on the
+    run. With reindex=False an existing `collection_name` is reused.
+    """
     # LangGraph may return a plain dict; normalize to ReportState
     if isinstance(final_state, dict):
         final_state = ReportState(**final_state)
+    # The namespace may have been garbage-collected since the run was indexed
+    if not reindex and collection_name and namespace_registry.is_live(collection_name):
+        final_state.rag_collection_name = collection_name
+        namespace_registry.touch(collection_name)
+    elif not reindex:
+        reindex = True
+
+    # Chat turns reuse this instead of serialising the whole state every time
+    final_state.report_digest = build_report_digest(final_state)
+
+    if reindex or not final_state.rag_collection_name:
+        # 2. Run RAG Indexing Graph using the state from the first graph
+        # We pass the final_state which contains the raw_text needed for indexing
+        print("--- STARTING RAG INDEXING GRAPH ---")
+        rag_app = get_rag_graph()
+        rag_state = rag_app.invoke(final_state)
 
-    # 2. Run RAG Indexing Graph using the state from the first graph
-    # We pass the final_state which contains the raw_text needed for indexing
-    print("--- STARTING RAG INDEXING GRAPH ---")
-    rag_app = build_rag_graph()
-    # Invoke RAG graph with the state from the previous graph
-    rag_state = rag_app.invoke(final_state)
-    
-    # Merge RAG results back if needed (though we mostly care about the side effect of indexing)
-    if isinstance(rag_state, dict):
-        if "rag_collection_name" in rag_state:
-            final_state.rag_collection_name = rag_state["rag_collection_name"]
-        if "errors" in rag_state and rag_state["errors"]:
-            if not final_state.errors: final_state.errors = []
-            final_state.errors.extend(rag_state["errors"])
+        # Merge RAG results back if needed (though we mostly care about the side effect of indexing)
+        if isinstance(rag_state, dict):
+            if "rag_collection_name" in rag_state:
+                final_state.rag_collection_name = rag_state["rag_collection_name"]
+            if "errors" in rag_state and rag_state["errors"]:
+                if not final_state.errors: final_state.errors = []
+                final_state.errors.extend(rag_state["errors"])
+            if rag_state.get("partial"):
+                final_state.partial = True
+                final_state.skipped_nodes = rag_state["skipped_nodes"]
+
+    # Keep the namespace on the run so a later patch can reuse it instead of re-indexing
+    if graph_app.checkpointer is not None:
+        graph_app.update_state(config, {
+            "rag_collection_name": final_state.rag_collection_name,
+            "report_digest": final_state.report_digest,
+            "partial": final_state.partial,
+            "skipped_nodes": final_state.skipped_nodes,
+        }, as_node="recommendations")
 
     return final_state
+
+@PIPELINE_DURATION.time()
+def run_full_pipeline(file_path=None, file_bytes=None, file_name=None, run_id=None,
+                      patient_id=None, report_date=None, force_full_analysis=False, token_budget=None,
+                      deadline_s=None):
+    """
+    Runs analysis + RAG indexing for a report given either a path on disk or
+    the raw file bytes (with the original file name, used to detect PDFs).
+    Each node's output is checkpointed under `run_id` (generated if omitted).
+    With `patient_id`, validated values are added to the patient's history.
+    All-normal reports take a templated fast path unless `force_full_analysis`.
+    `token_budget` caps prompt + completion tokens over all LLM calls of the run.
+    `deadline_s` overrides ANALYSIS_DEADLINE_S; late stages are skipped to meet it.
+    """
+    run_id = run_id or uuid.uuid4().hex
+    config = run_config(run_id)
+
+    # 1. Run Analysis Graph
+    graph_app = get_analysis_graph()
+    initial_state = ReportState(
+        run_id=run_id, raw_file_path=file_path, raw_file_name=file_name,
+        patient_id=patient_id, report_date=report_date, force_full_analysis=force_full_analysis,
+        token_budget=token_budget, deadline=request_deadline(deadline_s),
+    )
+    # The upload stays in memory for this run only; it is never checkpointed
+    if file_bytes is not None:
+        upload_store.put(run_id, file_bytes)
+    record_run(run_id)
+    try:
+        final_state = graph_app.invoke(initial_state, config)
+    finally:
+        upload_store.discard(run_id)
+    return _index_and_finish(graph_app, config, final_state)
+
+def _run_history(run_id: str):
+    graph_app = get_analysis_graph()
+    if graph_app.checkpointer is None:
+        raise LookupError("Checkpointing is disabled (CHECKPOINTER=none)")
+    latest = graph_app.get_state(run_config(run_id))
+    if not latest.values:
+        raise LookupError(f"Unknown run '{run_id}'")
+    record_run(run_id)
+    return graph_app, latest
+
+def _checkpoint_before(graph_app, run_id: str, node: str):
+    """Most recent checkpoint whose next step is `node`."""
+    for snapshot in graph_app.get_state_history(run_config(run_id)):
+        if snapshot.next == (node,):
+            return snapshot
+    raise LookupError(f"Run '{run_id}' has no checkpoint before '{node}'")
+
+@PIPELINE_DURATION.time()
+def _invoke_with_upload(graph_app, run_id: str, config, file_bytes=None):
+    """Continues the run from `config`, with a re-uploaded file available to ingest_and_ocr."""
+    if file_bytes is None:
+        return graph_app.invoke(None, config)
+    upload_store.put(run_id, file_bytes)
+    try:
+        return graph_app.invoke(None, config)
+    finally:
+        upload_store.discard(run_id)
+
+def _check_upload_available(run_id: str, values: Dict[str, Any], file_bytes=None) -> None:
+    """
+    Uploads are not checkpointed, so re-running ingest_and_ocr needs the file
+    again unless it was read from a path that still exists.
+    """
+    path = values.get("raw_file_path")
+    if file_bytes is None and not (path and os.path.exists(path)):
+        raise ValueError(f"Run '{run_id}' failed while reading the upload; re-upload required to resume it")
+
+def resume_pipeline(run_id: str, deadline_s=None, file_bytes=None, file_name=None):
+    """
+    Re-runs a failed run from its failing node. Earlier nodes are not
+    re-executed; their checkpointed outputs are reused. Stages skipped for
+    the deadline count as failed. The resumed run gets a fresh deadline.
+    A run that failed in ingest_and_ocr needs the file again (`file_bytes`).
+    """
+    graph_app, latest = _run_history(run_id)
+    update = {"deadline": request_deadline(deadline_s)}
+    if file_name:
+        update["raw_file_name"] = file_name
+
+    if latest.next:
+        # The graph raised mid-run; continue from the pending node
+        if latest.next[0] == "ingest_and_ocr":
+            _check_upload_available(run_id, latest.values, file_bytes)
+        print(f"--- RESUMING RUN {run_id} AT {latest.next[0]} ---")
+        final_state = _invoke_with_upload(graph_app, run_id, graph_app.update_state(latest.config, update), file_bytes)
+        return _index_and_finish(graph_app, run_config(run_id), final_state)
+
+    failed = latest.values.get("failed_nodes") or []
+    if failed:
+        if failed[0] == "ingest_and_ocr":
+            _check_upload_available(run_id, latest.values, file_bytes)
+        snapshot = _checkpoint_before(graph_app, run_id, failed[0])
+        print(f"--- RESUMING RUN {run_id} FROM {failed[0]} ---")
+        final_state = _invoke_with_upload(graph_app, run_id, graph_app.update_state(snapshot.config, update),
+                                          file_bytes)
+        # Plain text chunks only depend on raw_text, so keep them unless OCR was what failed.
+        # Structured chunks are rebuilt; unchanged ones resolve to the same namespace by content hash.
+        return _index_and_finish(graph_app, run_config(run_id), final_state,
+                                 reindex=failed[0] == "ingest_and_ocr" or RAG_CHUNKING == "structured",
+                                 collection_name=latest.values.get("rag_collection_name"))
+
+    if not latest.values.get("rag_collection_name"):
+        return _index_and_finish(graph_app, run_config(run_id), {**latest.values, **update})
+
+    raise ValueError(f"Run '{run_id}' completed without failures; nothing to resume")
+
+@PIPELINE_DURATION.time()
+def rerun_with_corrections(run_id: str, patient_info: Optional[Dict[str, str]] = None,
+                           param_values: Optional[Dict[str, Any]] = None, deadline_s=None):
+    """
+    Applies corrections to patient info and/or extracted parameter values and
+    re-runs the analysis from validate_standardize onward, reusing OCR and
+    extraction from the original run.
+
+    `param_values` maps a parameter name to a new value, or to a dict with
+    "value" and/or "unit".
+    """
+    graph_app, latest = _run_history(run_id)
+    snapshot = _checkpoint_before(graph_app, run_id, CORRECTION_ENTRY_NODE)
+    values = snapshot.values
+
+    update: Dict[str, Any] = {}
+    if patient_info:
+        update["patient_info"] = {**(values.get("patient_info") or {}), **patient_info}
+    if param_values:
+        extracted = {name: dict(info) for name, info in (values.get("extracted_params") or {}).items()}
+        for name, change in param_values.items():
+            change = change if isinstance(change, dict) else {"value": change}
+            extracted[name] = {**extracted.get(name, {}), **change}
+        update["extracted_params"] = extracted
+    if not update:
+        raise ValueError("No corrections given")
+    update["deadline"] = request_deadline(deadline_s)
+
+    print(f"--- RE-RUNNING {run_id} FROM {CORRECTION_ENTRY_NODE} WITH CORRECTIONS: {sorted(update)} ---")
+    config = graph_app.update_state(snapshot.config, update, as_node="extract_parameters")
+    final_state = graph_app.invoke(None, config)
+    # Structured namespaces hold the parameter values, so they must reflect the corrections
+    return _index_and_finish(graph_app, run_config(run_id), final_state, reindex=RAG_CHUNKING == "structured",
+                             collection_name=latest.values.get("rag_collection_name"))
@@ -0,0 +1 @@
+"""Load-testing tools: mock LLM server, local vector store and the load generator."""
@@ -0,0 +1,46 @@
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class FaultProfile:
+    """
+    Latency and error injection for a simulated dependency.
+
+    Latency is log-normal around `median_ms`; `sigma` controls the tail
+    (0 = constant, 0.5 gives p99 ~3.2x the median). `error_rate` is the
+    probability that a call fails instead of answering.
+    """
+    median_ms: float = 0.0
+    sigma: float = 0.0
+    error_rate: float = 0.0
+    seed: int = 0
+    _rng: random.Random = field(default=None, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        self._rng = random.Random(self.seed)
+
+    def sample_delay(self) -> float:
+        """Delay in seconds for one call."""
+        if self.median_ms <= 0:
+            return 0.0
+        with self._lock:
+            z = self._rng.gauss(0, 1)
+        return self.median_ms * math.exp(self.sigma * z) / 1000
+
+    def should_fail(self) -> bool:
+        if self.error_rate <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+    def apply(self) -> bool:
+        """Sleeps for a sampled delay and returns True if this call should fail."""
+        delay = self.sample_delay()
+        if delay:
+            time.sleep(delay)
+        return self.should_fail()
@@ -0,0 +1,92 @@
+"""
+In-process stand-in for the Pinecone index.
+
+Each namespace is an InMemoryVectorStore; adds and searches are delayed and
+failed according to a FaultProfile so the store can mimic a remote service.
+Install it with nodes.rag_node.set_vector_store_factory(LocalVectorStoreFactory(...)).
+"""
+import threading
+from typing import Any, Dict, List
+
+from langchain_core.documents import Document
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from loadtest.faults import FaultProfile
+
+
+class VectorStoreUnavailable(RuntimeError):
+    pass
+
+
+def _matches(metadata: Dict[str, Any], metadata_filter: Dict[str, Any]) -> bool:
+    """Evaluates the subset of Pinecone's metadata filter language used by the app."""
+    for key, condition in metadata_filter.items():
+        if key == "$or":
+            if not any(_matches(metadata, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(_matches(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if op == "$eq" and value != operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class FaultyInMemoryVectorStore(InMemoryVectorStore):
+    """InMemoryVectorStore with injected latency and errors on add and search."""
+
+    def __init__(self, embedding, profile: FaultProfile):
+        super().__init__(embedding=embedding)
+        self.profile = profile
+
+    def _maybe_fail(self, operation: str) -> None:
+        if self.profile.apply():
+            raise VectorStoreUnavailable(f"Local vector store {operation} failed (injected)")
+
+    def add_documents(self, documents: List[Document], **kwargs: Any) -> List[str]:
+        self._maybe_fail("upsert")
+        return super().add_documents(documents, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        self._maybe_fail("query")
+        metadata_filter = kwargs.pop("filter", None)
+        if isinstance(metadata_filter, dict):
+            kwargs["filter"] = lambda doc: _matches(doc.metadata, metadata_filter)
+        elif metadata_filter is not None:
+            kwargs["filter"] = metadata_filter
+        return super().similarity_search(query, k=k, **kwargs)
+
+    def delete(self, ids: List[str] = None, delete_all: bool = None, **kwargs: Any) -> None:
+        # Pinecone-style namespace wipe, as used by the namespace collector
+        if delete_all:
+            self.store.clear()
+            return
+        super().delete(ids, **kwargs)
+
+
+class LocalVectorStoreFactory:
+    """Callable (embeddings, namespace) -> vector store, keeping one store per namespace."""
+
+    def __init__(self, profile: FaultProfile = None):
+        self.profile = profile or FaultProfile()
+        self._stores: Dict[str, FaultyInMemoryVectorStore] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, embeddings, namespace: str) -> FaultyInMemoryVectorStore:
+        with self._lock:
+            store = self._stores.get(namespace)
+            if store is None:
+                store = FaultyInMemoryVectorStore(embeddings, self.profile)
+                self._stores[namespace] = store
+            return store
+
+    def namespaces(self) -> List[str]:
+        with self._lock:
+            return list(self._stores)
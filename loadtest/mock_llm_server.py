@@ -0,0 +1,127 @@
+"""
+Local mock of the Groq chat-completions API.
+
+Serves POST /openai/v1/chat/completions with the same JSON shape as the
+provider, answering through benchmarks.fake_llm so every pipeline node gets a
+parseable reply. Point the app at it with GROQ_API_BASE=http://host:port.
+
+    python -m loadtest.mock_llm_server --port 8090 --latency-ms 800 --sigma 0.4 --error-rate 0.02
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fake_llm import fake_completion
+from loadtest.faults import FaultProfile
+from utils.token_utils import estimate_tokens
+
+COMPLETIONS_PATH = "/openai/v1/chat/completions"
+
+
+def _completion_body(model: str, content: str, prompt_tokens: int) -> dict:
+    completion_tokens = estimate_tokens(content)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "logprobs": None,
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+        "system_fingerprint": None,
+        "x_groq": {"id": f"req_{uuid.uuid4().hex}"},
+    }
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    profile = FaultProfile()
+    # Failures are returned as rate limits, like the provider does under load
+    error_status = 429
+    retry_after_s = 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/openai/v1/models":
+            return self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if self.path != COMPLETIONS_PATH:
+            return self._send_json(404, {"error": {"message": "not found"}})
+
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        prompt = "\n".join(
+            m.get("content") or "" for m in payload.get("messages", []) if isinstance(m.get("content"), str)
+        )
+
+        if self.profile.apply():
+            return self._send_json(
+                self.error_status,
+                {"error": {"message": "Rate limit reached (mock)", "type": "tokens", "code": "rate_limit_exceeded"}},
+                {"retry-after": str(self.retry_after_s)},
+            )
+
+        body = _completion_body(payload.get("model", "mock"), fake_completion(prompt), estimate_tokens(prompt))
+        self._send_json(200, body)
+
+
+def start_mock_llm_server(host: str = "127.0.0.1", port: int = 0, profile: FaultProfile = None,
+                          error_status: int = 429):
+    """Starts the server in a daemon thread; returns (server, base_url)."""
+    handler = type("ConfiguredMockLLMHandler", (MockLLMHandler,), {
+        "profile": profile or FaultProfile(),
+        "error_status": error_status,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=500, help="median response latency")
+    parser.add_argument("--sigma", type=float, default=0.4, help="log-normal spread of latency")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    args = parser.parse_args(argv)
+
+    server, url = start_mock_llm_server(
+        args.host, args.port, FaultProfile(args.latency_ms, args.sigma, args.error_rate), args.error_status
+    )
+    print(f"Mock LLM listening on {url} (set GROQ_API_BASE={url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Concurrent load test for the /analyze and /chat endpoints.
+
+By default everything runs locally: api.app is served by uvicorn in this
+process, LLM calls go to loadtest.mock_llm_server and Pinecone is replaced by
+loadtest.local_vector_store, each with configurable latency and error rates.
+
+    python -m loadtest.run_loadtest --concurrency 1,2,4,8,16 --duration 30 --chat-ratio 0.7
+    python -m loadtest.run_loadtest --llm-latency-ms 1200 --llm-error-rate 0.05 --json results.json
+    python -m loadtest.run_loadtest --target http://staging:8000   # existing deployment, no stubs
+
+For each concurrency level the tool reports throughput, p50/p95/p99 latency
+and error rates per endpoint, which is enough to find the knee of the curve
+for a single worker.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import httpx
+
+from benchmarks.run_benchmarks import percentile
+from benchmarks.synthetic_reports import generate_reports
+from loadtest.faults import FaultProfile
+
+CHAT_QUESTIONS = [
+    "What does my hemoglobin level mean?",
+    "Is my platelet count normal?",
+    "Which of my results are outside the reference range?",
+    "Explain my white blood cell count.",
+    "What should I ask my doctor about these results?",
+]
+
+
+def start_local_stack(args) -> str:
+    """Starts the mock LLM, installs the local vector store and serves api.app; returns its base URL."""
+    from loadtest.mock_llm_server import start_mock_llm_server
+
+    _, llm_url = start_mock_llm_server(profile=FaultProfile(
+        args.llm_latency_ms, args.llm_sigma, args.llm_error_rate, seed=args.seed
+    ))
+    os.environ["GROQ_API_BASE"] = llm_url
+    os.environ.setdefault("GROQ_API_KEY", "mock-key")
+
+    import uvicorn
+    from api import app
+    from loadtest.local_vector_store import LocalVectorStoreFactory
+    from nodes import rag_node
+
+    rag_node.set_vector_store_factory(LocalVectorStoreFactory(FaultProfile(
+        args.vector_latency_ms, args.vector_sigma, args.vector_error_rate, seed=args.seed + 1
+    )))
+    if not args.real_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        rag_node.set_embeddings_override(DeterministicFakeEmbedding(size=384))
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    print(f"Local stack ready: api=http://127.0.0.1:{args.port} llm={llm_url}")
+    return f"http://127.0.0.1:{args.port}"
+
+
+async def _analyze(client: httpx.AsyncClient, pdf: bytes, session_id: str) -> Tuple[bool, bool, dict]:
+    response = await client.post(
+        "/analyze",
+        files={"file": ("report.pdf", pdf, "application/pdf")},
+        data={"session_id": session_id},
+    )
+    if response.status_code != 200:
+        return False, False, {}
+    body = response.json()
+    return True, bool(body.get("errors")), body
+
+
+async def _chat(client: httpx.AsyncClient, question: str, collection: str, session_id: str) -> Tuple[bool, bool]:
+    response = await client.post(
+        "/chat", json={"question": question, "collection_name": collection, "session_id": session_id}
+    )
+    if response.status_code != 200:
+        return False, False
+    # The chat endpoint reports backend failures inside a 200 answer
+    return not response.json().get("answer", "").startswith("Error responding to chat"), False
+
+
+async def run_level(base_url: str, concurrency: int, duration: float, chat_ratio: float,
+                    pdfs: List[bytes], collection: str, seed: int) -> Dict[str, Dict[str, float]]:
+    samples: Dict[str, List[Tuple[float, bool, bool]]] = defaultdict(list)
+    deadline = time.perf_counter() + duration
+
+    async def worker(worker_id: int, client: httpx.AsyncClient):
+        rng = random.Random(seed * 1000 + worker_id)
+        session_id = f"load-{uuid.uuid4().hex[:8]}"
+        while time.perf_counter() < deadline:
+            op = "chat" if rng.random() < chat_ratio else "analyze"
+            start = time.perf_counter()
+            try:
+                if op == "chat":
+                    ok, degraded = await _chat(client, rng.choice(CHAT_QUESTIONS), collection, session_id)
+                else:
+                    ok, degraded, _ = await _analyze(client, rng.choice(pdfs), session_id)
+            except httpx.HTTPError:
+                ok, degraded = False, False
+            samples[op].append((time.perf_counter() - start, ok, degraded))
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        await asyncio.gather(*(worker(i, client) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    summary = {}
+    for op, rows in samples.items():
+        latencies = [r[0] * 1000 for r in rows]
+        errors = sum(1 for r in rows if not r[1])
+        summary[op] = {
+            "requests": len(rows),
+            "throughput_rps": round(len(rows) / elapsed, 3),
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+            "error_rate": round(errors / len(rows), 4),
+            "degraded_rate": round(sum(1 for r in rows if r[2]) / len(rows), 4),
+        }
+    return summary
+
+
+def print_results(results: Dict[int, Dict[str, Dict[str, float]]]) -> None:
+    header = f"{'conc':>5} {'endpoint':<9}{'reqs':>7}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'err %':>8}{'degr %':>8}"
+    print(header)
+    print("-" * len(header))
+    for concurrency, ops in results.items():
+        for op, r in sorted(ops.items()):
+            print(f"{concurrency:>5} {op:<9}{r['requests']:>7}{r['throughput_rps']:>9.2f}{r['p50_ms']:>10.0f}"
+                  f"{r['p95_ms']:>10.0f}{r['p99_ms']:>10.0f}{r['error_rate'] * 100:>8.1f}{r['degraded_rate'] * 100:>8.1f}")
+
+
+async def main_async(args) -> Dict[int, Dict[str, Dict[str, float]]]:
+    base_url = args.target or start_local_stack(args)
+    pdfs = [r.pdf_bytes for r in generate_reports(args.reports, seed=args.seed, with_images=False)]
+
+    # One analysis up front gives the chat workload a namespace to query
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        ok, _, body = await _analyze(client, pdfs[0], "load-seed")
+    collection = body.get("rag_collection_name") if ok else None
+    if not collection:
+        print("Seed analysis did not return a collection name; chat requests will fail.", file=sys.stderr)
+        collection = "missing"
+
+    results = {}
+    for concurrency in args.concurrency:
+        print(f"Running concurrency={concurrency} for {args.duration}s ...")
+        results[concurrency] = await run_level(
+            base_url, concurrency, args.duration, args.chat_ratio, pdfs, collection, args.seed
+        )
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="base URL of a running API; default starts a local stack")
+    parser.add_argument("--port", type=int, default=8765, help="port for the in-process API")
+    parser.add_argument("--concurrency", type=lambda v: [int(x) for x in v.split(",")], default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument("--chat-ratio", type=float, default=0.5, help="share of requests that are /chat")
+    parser.add_argument("--reports", type=int, default=8, help="distinct synthetic PDFs to upload")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--llm-latency-ms", type=float, default=600)
+    parser.add_argument("--llm-sigma", type=float, default=0.4)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--vector-latency-ms", type=float, default=40)
+    parser.add_argument("--vector-sigma", type=float, default=0.3)
+    parser.add_argument("--vector-error-rate", type=float, default=0.0)
+    parser.add_argument("--real-embeddings", action="store_true",
+                        help="use the sentence-transformers model instead of fake embeddings")
+    parser.add_argument("--json", type=Path, help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(main_async(args))
+    print_results(results)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,20 @@
-from typing import Optional, Union
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple, Union
+from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
-from utils.llm_utils import get_llm
+from utils.deadline import node_timeout, timed_out
+from utils.llm_utils import get_llm, invoke_llm
+from utils.metrics import EXTRACTION_METHOD
+from utils.prompt_registry import register_prompt
+from utils.structured_output import parse_structured
+from utils.reference_ranges import load_reference_ranges
+from nodes.validate_standardize import resolve_reference
+from utils.token_budget import fit_report_text, input_budget
+
+# Skip the LLM when the PDF layout yields at least this many recognised parameters
+LAYOUT_MIN_PARAMS = int(os.getenv("LAYOUT_MIN_PARAMS", "8"))
 
 class ExtractedValue(BaseModel):
     value: float = Field(description="The numeric value extracted.")
@@ -60,6 +74,192 @@ DEFAULT_UNITS = {
     "Absolute Basophils": "cumm",
 }
 
+# Printed labels seen on lab reports, in addition to the canonical names and
+# the aliases in configs/reference_ranges.json
+LABEL_ALIASES = {
+    "Hemoglobin": ["Haemoglobin", "Hb", "HGB"],
+    "Total RBC count": ["RBC", "RBC Count", "Red Blood Cell Count", "Red Cell Count", "Erythrocyte Count"],
+    "Packed Cell Volume": ["Haematocrit"],
+    "RDW": ["RDW-CV", "RDW CV"],
+    "Total WBC count": ["WBC", "WBC Count", "Total Leukocyte Count", "Total Leucocyte Count", "White Blood Cell Count"],
+    "Platelet Count": ["Platelet"],
+    "ESR": ["Erythrocyte Sedimentation Rate"],
+    "Absolute Neutrophils": ["Absolute Neutrophil Count"],
+    "Absolute Lymphocytes": ["Absolute Lymphocyte Count"],
+    "Absolute Eosinophils": ["Absolute Eosinophil Count", "AEC"],
+    "Absolute Monocytes": ["Absolute Monocyte Count"],
+    "Absolute Basophils": ["Absolute Basophil Count"],
+}
+
+
+def _normalize_label(label: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", label.lower()).strip()
+
+
+def _label_index() -> Dict[str, str]:
+    ranges = load_reference_ranges()
+    index = {}
+    for canonical, spec in ranges.items():
+        for name in [canonical] + spec.get("aliases", []) + LABEL_ALIASES.get(canonical, []):
+            index[_normalize_label(name)] = canonical
+    return index
+
+
+def _match_label(label: str, index: Dict[str, str]) -> Optional[str]:
+    candidates = [label, re.sub(r"\([^)]*\)", " ", label)] + re.findall(r"\(([^)]*)\)", label)
+    for candidate in candidates:
+        canonical = index.get(_normalize_label(candidate))
+        if canonical:
+            return canonical
+    return None
+
+
+# Count units: multiplier before the "/", e.g. "lakhs/cumm", "x10^3/uL"
+COUNT_MULTIPLIERS = {
+    "": 1, "cells": 1,
+    "thou": 1e3, "thousand": 1e3, "k": 1e3,
+    "lakh": 1e5, "lakhs": 1e5, "lac": 1e5, "lacs": 1e5,
+    "mill": 1e6, "million": 1e6, "millions": 1e6,
+}
+PER_MICROLITRE = {"cumm", "cmm", "ul", "mm3"}
+
+# Other units the layout path accepts, mapped to the factor to the default unit
+UNIT_FACTORS = {
+    "Hemoglobin": {"g/dl": 1, "gm/dl": 1, "gms/dl": 1, "g%": 1, "gm%": 1, "g/l": 0.1},
+    "MCHC": {"g/dl": 1, "gm/dl": 1, "gms/dl": 1, "%": 1, "g/l": 0.1},
+    "Packed Cell Volume": {"%": 1, "l/l": 100},
+    "MCV": {"fl": 1, "cu.micron": 1},
+    "MCH": {"pg": 1},
+    "ESR": {"mm/hr": 1, "mm/h": 1, "mm/1sthr": 1, "mm/1hr": 1},
+    "MPV": {"fl": 1},
+}
+
+_RANGE_RE = re.compile(r"(\d[\d,]*(?:\.\d+)?)\s*[-–]\s*(\d[\d,]*(?:\.\d+)?)")
+
+
+def _clean_unit(unit: str) -> str:
+    unit = unit.lower().replace(" ", "").replace("µ", "u").replace("μ", "u").replace("³", "3").replace("×", "x")
+    return unit.replace("cu.mm", "cumm").replace("mm^3", "mm3")
+
+
+def _count_scale(unit: str) -> Optional[float]:
+    """Cells per µL one unit of `unit` stands for ("lakhs/cumm" -> 1e5, "x10^9/L" -> 1e3), or None."""
+    unit = _clean_unit(unit)
+    multiplier, per = unit.rsplit("/", 1) if "/" in unit else ("", unit)
+    multiplier = multiplier.lstrip("x*")
+    power = re.fullmatch(r"10(?:\^|e)(\d+)", multiplier)
+    factor = 10.0 ** int(power.group(1)) if power else COUNT_MULTIPLIERS.get(multiplier)
+    if factor is None:
+        return None
+    if per in PER_MICROLITRE:
+        return factor
+    if per == "l":
+        return factor / 1e6
+    return None
+
+
+def _unit_factor(canonical: str, unit: str) -> Optional[float]:
+    """Factor from `unit` to the parameter's default unit, or None when the unit is not recognised."""
+    default = DEFAULT_UNITS.get(canonical)
+    if default and default != "%" and _count_scale(default) is not None:
+        scale = _count_scale(unit)
+        return None if scale is None else scale / _count_scale(default)
+    cleaned = _clean_unit(unit)
+    if default and cleaned == _clean_unit(default):
+        return 1.0
+    return UNIT_FACTORS.get(canonical, {}).get(cleaned)
+
+
+def _reference_factor(canonical: str, reference: Optional[str]) -> Optional[float]:
+    """
+    Power-of-ten scale between the row's printed reference range and ours
+    ("1.5 - 4.1" for platelets -> 1e5), or None when they don't line up.
+    """
+    match = _RANGE_RE.search(reference or "")
+    spec = load_reference_ranges().get(canonical)
+    if not match or not spec:
+        return None
+    row_low, row_high = (float(v.replace(",", "")) for v in match.groups())
+    low, high = resolve_reference(spec.get("reference"))
+    if not row_high or not high:
+        return None
+    factor = 10.0 ** round(math.log10(high / row_high))
+    if not 0.5 <= row_high * factor / high <= 2:
+        return None
+    if row_low and low and not 0.5 <= row_low * factor / low <= 2:
+        return None
+    return factor
+
+
+def params_from_rows(rows: List[Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """
+    Maps layout rows (see utils/pdf_layout.py) to canonical parameters without
+    an LLM. Differential rows reported as counts rather than % go to the
+    matching Absolute parameter. Values are converted to the default units
+    (lakhs/cumm, 10^3/uL, g/L, ...); when a unit is missing or unknown, the
+    row's reference range decides the scale.
+
+    Returns (params, unresolved): labels of rows whose scale could not be
+    determined, which the caller should not trust.
+    """
+    index = _label_index()
+    extracted = {}
+    unresolved = []
+    for row in rows:
+        canonical = _match_label(row["label"], index)
+        if not canonical:
+            continue
+        unit = row.get("unit")
+        absolute = f"Absolute {canonical}"
+        if unit and "%" not in unit and absolute in DEFAULT_UNITS:
+            canonical = absolute
+        val = _parse_float(row["value"])
+        # Keep the first occurrence; later pages sometimes repeat a summary
+        if val is None or canonical in extracted:
+            continue
+
+        factor = _unit_factor(canonical, unit) if unit else None
+        scaled_by = unit
+        if factor is None:
+            factor = _reference_factor(canonical, row.get("reference"))
+            scaled_by = "reference range"
+        if factor is None and unit:
+            unresolved.append(row["label"])
+            continue
+
+        note = "Read from PDF table layout"
+        if factor is not None and (factor != 1 or scaled_by != unit):
+            note += f" ({scaled_by} x {factor:g})"
+            unit = DEFAULT_UNITS.get(canonical)
+        extracted[canonical] = {
+            "raw_value": row["value"],
+            "value": round(val * factor, 6) if factor is not None else val,
+            "unit": unit or DEFAULT_UNITS.get(canonical),
+            "scale_note": note,
+        }
+    return extracted, unresolved
+
+
+def patient_info_from_text(text: str) -> Dict[str, str]:
+    """Patient name, age and gender from labelled fields ("Patient Name : ...", "Age/Sex : 34 Y / M")."""
+    info = {}
+    name = re.search(r"Patient\s*Name\s*[:\-]\s*([A-Za-z][A-Za-z .']*?)\s*(?:\||$|\bAge\b|\bGender\b|\bSex\b)", text, re.M | re.I)
+    if name:
+        info["Name"] = name.group(1).strip()
+
+    combined = re.search(r"Age\s*/\s*(?:Sex|Gender)\s*[:\-]?\s*(\d{1,3})\D{0,8}?/\s*(Male|Female|M|F)\b", text, re.I)
+    age = re.search(r"\bAge\s*[:\-]\s*(\d{1,3})", text, re.I)
+    gender = re.search(r"\b(?:Gender|Sex)\s*[:\-]\s*(Male|Female|M|F)\b", text, re.I)
+    age_value = combined.group(1) if combined else age.group(1) if age else None
+    gender_value = combined.group(2) if combined else gender.group(1) if gender else None
+
+    if age_value:
+        info["Age"] = age_value
+    if gender_value:
+        info["Gender"] = "Female" if gender_value.lower().startswith("f") else "Male"
+    return info
+
+
 def _parse_float(val: Union[float, str, None]) -> Optional[float]:
     if val is None:
         return None
@@ -77,21 +277,11 @@ def _parse_float(val: Union[float, str, None]) -> Optional[float]:
     except:
         return None
 
-def extract_parameters_node(state):
-    """
-    Refined extraction using LLM to parse complex tables.
-    Matches standard keys to state.extracted_params structure.
-    """
-    text = state.raw_text or ""
-    if not text.strip():
-        return {"extracted_params": {}, "errors": state.errors + ["No text to extract from."]}
+EXTRACTION_PARSER = PydanticOutputParser(pydantic_object=ExtractionOutput)
 
-    llm = get_llm()
-    # structured_llm = llm.with_structured_output(ExtractionOutput)
-    from langchain_core.output_parsers import PydanticOutputParser
-    parser = PydanticOutputParser(pydantic_object=ExtractionOutput)
-    
-    prompt = f"""
+# Static rules first, report text last: the system message is identical for
+# every report, so it can be served from the provider's prompt cache
+EXTRACTION_PROMPT = register_prompt("extract_parameters", version=2, system=f"""
         You are a medical data extraction engine specialized in CBC (Complete Blood Count) reports.
         Your task is STRICT STRUCTURED EXTRACTION — NOT interpretation, NOT diagnosis.
 
@@ -106,7 +296,7 @@ def extract_parameters_node(state):
         - Units in different formats
         - Percent and absolute values together
         - Regional number formats (Indian, US, EU)
-        {text}
+        The report text follows the rules, after "REPORT TEXT:".
 
         ====================
         GLOBAL EXTRACTION RULES (MANDATORY)
@@ -217,15 +407,48 @@ def extract_parameters_node(state):
         ====================
         FINAL OUTPUT FORMAT
         ====================
-        {parser.get_format_instructions()}
+        {EXTRACTION_PARSER.get_format_instructions()}
+    """, human="""
+        REPORT TEXT:
+        {text}
+    """)
+
+
+def extract_parameters_node(state):
     """
+    Refined extraction using LLM to parse complex tables.
+    Matches standard keys to state.extracted_params structure.
+    """
+    text = state.raw_text or ""
+    if not text.strip():
+        return {"extracted_params": {}, "errors": state.errors + ["No text to extract from."]}
+
+    # Digital PDFs with a clean results table don't need the LLM at all
+    if state.structured_rows:
+        from_layout, unresolved = params_from_rows(state.structured_rows)
+        if unresolved:
+            print(f"Unrecognised units in PDF layout for {', '.join(unresolved)}; using LLM extraction")
+        elif len(from_layout) >= LAYOUT_MIN_PARAMS:
+            print(f"Extracted {len(from_layout)} parameters from PDF layout; skipping LLM extraction")
+            EXTRACTION_METHOD.labels(method="layout").inc()
+            return {"extracted_params": from_layout, "patient_info": patient_info_from_text(text)}
+
+    EXTRACTION_METHOD.labels(method="llm").inc()
+    llm = get_llm("extract_parameters")
+    # structured_llm = llm.with_structured_output(ExtractionOutput)
+    parser = EXTRACTION_PARSER
     
     extracted = {}
     patient_info = {}
+    usage = []
     
     try:
-        response = llm.invoke(prompt)
-        res = parser.invoke(response)
+        # Trim the report text, not the instructions, when a token budget applies
+        budget = input_budget(state, "extract_parameters", EXTRACTION_PROMPT.text(text=""))
+        prompt = EXTRACTION_PROMPT.messages(text=fit_report_text(text, budget, "extract_parameters"))
+        response = invoke_llm(llm, prompt, node="extract_parameters", usage=usage,
+                              timeout=node_timeout(state, "extract_parameters"))
+        res = parse_structured(response, parser, "extract_parameters", llm=llm, usage=usage, state=state)
         
         # Map back to internal keys
         mapping = {
@@ -266,6 +489,12 @@ def extract_parameters_node(state):
 
     except Exception as e:
         # Fallback? Or just report error.
-        return {"extracted_params": {}, "errors": state.errors + [f"LLM Extraction failed: {str(e)}"]}
+        return {
+            "extracted_params": {},
+            "errors": state.errors + [f"LLM Extraction failed: {str(e)}"],
+            "failed_nodes": state.failed_nodes + ["extract_parameters"],
+            "llm_usage": state.llm_usage + usage,
+            **timed_out(state, "extract_parameters", e),
+        }
 
-    return {"extracted_params": extracted, "patient_info": patient_info}
\ No newline at end of file
+    return {"extracted_params": extracted, "patient_info": patient_info, "llm_usage": state.llm_usage + usage}
\ No newline at end of file
@@ -0,0 +1,111 @@
+import os
+import re
+
+# Reports with at most this many out-of-range parameters skip the LLM stages
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "1") == "1"
+FAST_PATH_MAX_ABNORMAL = int(os.getenv("FAST_PATH_MAX_ABNORMAL", "0"))
+
+GENERAL_RECOMMENDATIONS = [
+    "Keep up a balanced diet with iron-rich foods, leafy greens and adequate protein.",
+    "Stay well hydrated and maintain regular physical activity.",
+    "Repeat a routine blood count at your next annual check-up, or sooner if you develop symptoms such as fatigue, unusual bruising or frequent infections.",
+    "Discuss these results with your doctor, especially if you have ongoing symptoms or a known medical condition.",
+]
+
+SIGNATURE = """Sincerely,
+
+**J. Likith Sagar**
+Senior Medical Consultant"""
+
+
+def abnormal_params(state):
+    """Parameters model1_interpretation did not mark as normal (unknown counts as abnormal)."""
+    interpretation = state.param_interpretation or {}
+    return {name: info for name, info in interpretation.items() if info.get("status") != "normal"}
+
+
+def should_take_fast_path(state) -> bool:
+    if not FAST_PATH_ENABLED or state.force_full_analysis or not state.param_interpretation:
+        return False
+    return len(abnormal_params(state)) <= FAST_PATH_MAX_ABNORMAL
+
+
+def _describe(name, info):
+    ref = info.get("reference") or {}
+    unit = f" {info['unit']}" if info.get("unit") else ""
+    return (f"{name} is {info.get('status', 'unknown')} at {info.get('value')}{unit} "
+            f"(reference {ref.get('low')}–{ref.get('high')})")
+
+
+def _age_years(age):
+    match = re.search(r"\d{1,3}", str(age or ""))
+    return int(match.group(0)) if match else None
+
+
+def _context_analysis(patient, abnormal) -> str:
+    """Context sentence for the templated report; only claims what the patient details support."""
+    age = _age_years(patient.get("Age"))
+    gender = (patient.get("Gender") or "").strip().lower()
+    within = "mostly within" if abnormal else "within"
+    if age is None:
+        return (f"Results are {within} the adult reference ranges. The patient's age is not recorded, "
+                "so age-specific ranges could not be taken into account.")
+    if age < 18:
+        return (f"Results were compared with adult reference ranges. For a {age}-year-old, paediatric "
+                "reference ranges apply, so please confirm the interpretation with your doctor.")
+    subject = f"a {age}-year-old {gender}" if gender in ("male", "female") else f"a {age}-year-old adult"
+    return f"Results are {within} expected ranges for {subject}; age and gender do not change the interpretation here."
+
+
+def normal_report_node(state):
+    """
+    Templated replacement for patterns, context, synthesis and recommendations
+    when (nearly) every parameter is within its reference range.
+    """
+    abnormal = abnormal_params(state)
+    total = len(state.param_interpretation)
+    patient = state.patient_info or {}
+    name = patient.get("Name")
+
+    if abnormal:
+        findings = "; ".join(_describe(n, info) for n, info in sorted(abnormal.items()))
+        verb = "is" if total - len(abnormal) == 1 else "are"
+        normal_count = f"{total - len(abnormal)} of the {total} measured values {verb} within their reference ranges."
+        if len(abnormal) == 1:
+            rationale = [f"{total - 1} of {total} parameters are within reference ranges.",
+                         f"Minor deviation only: {findings}."]
+            overview = (f"{normal_count} The only finding outside the range is: {findings}. On its own, a small "
+                        "isolated deviation like this is often not clinically significant, but it is worth "
+                        "mentioning to your doctor.")
+        else:
+            rationale = [f"{total - len(abnormal)} of {total} parameters are within reference ranges.",
+                         f"Minor deviations only: {findings}."]
+            overview = (f"{normal_count} The {len(abnormal)} findings outside their ranges are: {findings}. "
+                        "Small deviations like these are often not clinically significant, but they are worth "
+                        "mentioning to your doctor.")
+    else:
+        rationale = [f"All {total} measured parameters are within reference ranges.",
+                     "No clinical pattern detected."]
+        overview = (f"All {total} measured values in this blood count are within their reference ranges. "
+                    "None of them show the changes usually seen with anaemia, infection or clotting problems.")
+
+    greeting = f"Dear {name},\n\n" if name else ""
+    synthesis = (
+        f"{greeting}**Summary**\n\n{overview}\n\n"
+        "**What this means**\n\nYour blood count does not point to any specific condition. "
+        "Lab results are one part of the picture, so please review them with your doctor together with "
+        "any symptoms or history.\n\n"
+        f"{SIGNATURE}"
+    )
+
+    return {
+        "patterns": [],
+        "risk_assessment": {"score": 2 if abnormal else 1, "rationale": rationale},
+        "context_analysis": {
+            "analysis": _context_analysis(patient, abnormal),
+            "adjusted_concerns": "None",
+        },
+        "synthesis_report": synthesis,
+        "recommendations": list(GENERAL_RECOMMENDATIONS),
+        "analysis_path": "fast",
+    }
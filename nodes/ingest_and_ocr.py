@@ -1,37 +1,62 @@
-from utils.ocr_utils import run_ocr
-import fitz  # PyMuPDF
+import os
 
-def extract_pdf_text(path: str) -> str:
+from utils import upload_store
+from utils.ocr_utils import run_ocr, is_pdf
+from utils.pdf_layout import extract_pdf_layout
+
+# Rebuild reading order and table rows from word coordinates (0 = plain page.get_text())
+PDF_LAYOUT_PARSING = os.getenv("PDF_LAYOUT_PARSING", "1") == "1"
+
+def extract_pdf_text(source):
     """
-    Attempt to extract raw text from a PDF without OCR.
+    Attempt to extract raw text from a PDF (file path or bytes) without OCR.
+    Returns (text, structured_rows); rows are empty when layout parsing is off.
     """
+    import fitz  # PyMuPDF
+
     try:
-        doc = fitz.open(path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        return text
+        if isinstance(source, (bytes, bytearray)):
+            doc = fitz.open(stream=source, filetype="pdf")
+        else:
+            doc = fitz.open(source)
+        with doc:
+            if PDF_LAYOUT_PARSING:
+                return extract_pdf_layout(doc)
+            return "".join(page.get_text() for page in doc), []
     except Exception:
-        return ""
+        return "", []
 
 def ingest_and_ocr_node(state):
     """
     Node input: state (ReportState)
     Node returns: dict to update state (langgraph expects node returns)
+
+    Reads the upload from memory (the run's entry in utils.upload_store) when
+    available, otherwise from raw_file_path.
     """
-    file_path = state.raw_file_path
+    source = upload_store.get(state.run_id)
+    if source is None:
+        source = state.raw_file_path
+    if source is None:
+        return {"errors": state.errors + ["No file provided (in-memory uploads are kept only while their run is in progress)."],
+                "failed_nodes": state.failed_nodes + ["ingest_and_ocr"]}
     text = ""
+    rows = []
     
     # 1. Try native PDF text extraction first (faster, cleaner if selectable text)
-    if file_path.lower().endswith(".pdf"):
-        text = extract_pdf_text(file_path)
+    if is_pdf(source, state.raw_file_name):
+        text, rows = extract_pdf_text(source)
 
     # 2. If no text found (scanned PDF or Image), use OCR
     if not text or len(text.strip()) < 50:
+        rows = []
         try:
-            text = run_ocr(file_path)
+            text = run_ocr(source, state.raw_file_name)
         except Exception as e:
             # Bubble up a clear, user-friendly error instead of crashing.
-            return {"errors": state.errors + [f"OCR failed: {str(e)}"]}
+            return {
+                "errors": state.errors + [f"OCR failed: {str(e)}"],
+                "failed_nodes": state.failed_nodes + ["ingest_and_ocr"],
+            }
 
-    return {"raw_text": text}
+    return {"raw_text": text, "structured_rows": rows}
@@ -1,59 +1,29 @@
 from typing import List
+from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
-from utils.llm_utils import get_llm
+from utils.deadline import node_timeout, timed_out
+from utils.llm_utils import get_llm, invoke_llm
+from utils.prompt_registry import register_prompt
+from utils.structured_output import parse_structured
+from utils.token_budget import ensure_within_budget
 
 class PatternOutput(BaseModel):
     patterns: List[str] = Field(description="List of identified clinical patterns (e.g., 'Microcytic Anemia', 'Leukocytosis')")
     risk_score: int = Field(description="Risk score from 1-10 (10 being highest risk)")
     risk_rationale: List[str] = Field(description="List of key reasons for the risk score (concise bullet points)")
 
-def model2_patterns_node(state):
-    """
-    Analyzes validated parameters to identify patterns and assess risk.
-    """
-    validated = state.validated_params
-    patient_info = state.patient_info or {}
-    
-    if not validated:
-        return {"patterns": [], "risk_assessment": {}}
+PATTERN_PARSER = PydanticOutputParser(pydantic_object=PatternOutput)
 
-    llm = get_llm()
-    # structured_llm = llm.with_structured_output(PatternOutput) # Fails on some models
-    
-    from langchain_core.output_parsers import PydanticOutputParser
-    parser = PydanticOutputParser(pydantic_object=PatternOutput)
-
-    # Use interpreted data from Model 1 if available
-    interpreted = state.param_interpretation or {}
-    
-    # Format input for LLM with explicit status (LOW/NORMAL/HIGH)
-    data_lines = []
-    if interpreted:
-        for k, v in interpreted.items():
-            status = v.get("status", "unknown").upper()
-            ref_str = f"[{v['reference'].get('low')}-{v['reference'].get('high')}]" if v.get('reference') else ""
-            data_lines.append(f"{k}: {v['value']} {v.get('unit','')} ({status}) {ref_str}")
-    else:
-        # Fallback to raw validated params if Model 1 failed (unlikely)
-        data_lines = [f"{k}: {v['value']} {v.get('unit','')}" for k, v in validated.items()]
-            
-    data_str = "\n".join(data_lines)
-    
-    # Prompt Augmentation
-    prompt = f"""
+# Static rules in the system message, patient data in the human message
+PATTERNS_PROMPT = register_prompt("model2_patterns", version=2, system=f"""
         You are an expert medical AI assistant specialized in hematology.
         You operate as a STRICT rule-based pattern recognition system.
         Do NOT infer beyond the rules below.
 
-        Patient Info:
-        Name: {patient_info.get('Name', 'Unknown')}
-        Age: {patient_info.get('Age', 'Unknown')}
-        Gender: {patient_info.get('Gender', 'Unknown')}
-
         Input:
         CBC blood test results (may include values, units, reference ranges,
-        and optional LOW/NORMAL/HIGH/BORDERLINE tags):
-        {data_str}
+        and optional LOW/NORMAL/HIGH/BORDERLINE tags), given after the rules
+        together with the patient's details.
 
         ====================
         CRITICAL INTERPRETATION RULES (NON-NEGOTIABLE)
@@ -164,19 +134,70 @@ def model2_patterns_node(state):
         ====================
         OUTPUT FORMAT (JSON ONLY)
         ====================
-        {parser.get_format_instructions()}
+        {PATTERN_PARSER.get_format_instructions()}
+    """, human="""
+        Patient Info:
+        Name: {name}
+        Age: {age}
+        Gender: {gender}
 
+        CBC results:
+        {data}
+    """)
+
+def model2_patterns_node(state):
     """
+    Analyzes validated parameters to identify patterns and assess risk.
+    """
+    validated = state.validated_params
+    patient_info = state.patient_info or {}
+    
+    if not validated:
+        return {"patterns": [], "risk_assessment": {}}
 
+    llm = get_llm("model2_patterns")
+    # structured_llm = llm.with_structured_output(PatternOutput) # Fails on some models
+    parser = PATTERN_PARSER
+
+    # Use interpreted data from Model 1 if available
+    interpreted = state.param_interpretation or {}
+    
+    # Format input for LLM with explicit status (LOW/NORMAL/HIGH)
+    data_lines = []
+    if interpreted:
+        for k, v in interpreted.items():
+            status = v.get("status", "unknown").upper()
+            ref_str = f"[{v['reference'].get('low')}-{v['reference'].get('high')}]" if v.get('reference') else ""
+            data_lines.append(f"{k}: {v['value']} {v.get('unit','')} ({status}) {ref_str}")
+    else:
+        # Fallback to raw validated params if Model 1 failed (unlikely)
+        data_lines = [f"{k}: {v['value']} {v.get('unit','')}" for k, v in validated.items()]
+            
+    prompt = PATTERNS_PROMPT.messages(
+        name=patient_info.get('Name', 'Unknown'),
+        age=patient_info.get('Age', 'Unknown'),
+        gender=patient_info.get('Gender', 'Unknown'),
+        data="\n        ".join(data_lines),
+    )
+
+    usage = []
     try:
-        response = llm.invoke(prompt)
-        parsed_response = parser.invoke(response)
+        ensure_within_budget(state, "model2_patterns", prompt)
+        response = invoke_llm(llm, prompt, node="model2_patterns", usage=usage,
+                              timeout=node_timeout(state, "model2_patterns"))
+        parsed_response = parse_structured(response, parser, "model2_patterns", llm=llm, usage=usage, state=state)
         return {
             "patterns": parsed_response.patterns,
             "risk_assessment": {
                 "score": parsed_response.risk_score,
                 "rationale": parsed_response.risk_rationale
-            }
+            },
+            "llm_usage": state.llm_usage + usage,
         }
     except Exception as e:
-        return {"errors": state.errors + [f"Model 2 (Patterns) failed: {str(e)}"]}
\ No newline at end of file
+        return {
+            "errors": state.errors + [f"Model 2 (Patterns) failed: {str(e)}"],
+            "failed_nodes": state.failed_nodes + ["model2_patterns"],
+            "llm_usage": state.llm_usage + usage,
+            **timed_out(state, "model2_patterns", e),
+        }
\ No newline at end of file
@@ -1,10 +1,40 @@
+from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
-from utils.llm_utils import get_llm
+from utils.deadline import node_timeout, should_skip, skip_stage, timed_out
+from utils.llm_utils import get_llm, invoke_llm
+from utils.prompt_registry import register_prompt
+from utils.structured_output import parse_structured
+from utils.token_budget import ensure_within_budget
 
 class ContextOutput(BaseModel):
     analysis: str = Field(description="Contextual analysis of the results considering age/gender/lifestyle")
     adjusted_concerns: str = Field(description="Any concerns that are amplified or mitigated by context")
 
+CONTEXT_PARSER = PydanticOutputParser(pydantic_object=ContextOutput)
+
+CONTEXT_PROMPT = register_prompt("model3_context", version=2, system=f"""
+    You are a medical AI assistant.
+    You are given the User Context, Lab Results and Identified Patterns of a blood report.
+    
+    Provide a brief contextual analysis. 
+    If age/gender is unknown, provide general guidance on how these factors usually influence interpretation for the identified patterns.
+    
+    IMPORTANT: Limit your analysis to 5-10 sentences max. Be extremely concise.
+    
+    {CONTEXT_PARSER.get_format_instructions()}
+    """, human="""
+    User Context:
+    Age: {age}
+    Gender: {gender}
+    Medical History: {history}
+    
+    Lab Results:
+    {data}
+    
+    Identified Patterns:
+    {patterns}
+    """)
+
 def model3_context_node(state):
     """
     Incorporates user context into the analysis.
@@ -22,44 +52,38 @@ def model3_context_node(state):
     
     if not validated:
         return {"context_analysis": {}}
+    if should_skip(state, "model3_context"):
+        return skip_stage(state, "model3_context")
 
-    llm = get_llm()
+    llm = get_llm("model3_context")
     # structured_llm = llm.with_structured_output(ContextOutput)
-    from langchain_core.output_parsers import PydanticOutputParser
-    parser = PydanticOutputParser(pydantic_object=ContextOutput)
-    
-    data_str = "\n".join([f"{k}: {v['value']} {v.get('unit','')}" for k, v in validated.items()])
-    patterns_str = ", ".join(patterns)
-
-    prompt = f"""
-    You are a medical AI assistant.
-    User Context:
-    Age: {user_context.get('Age')}
-    Gender: {user_context.get('Gender')}
-    Medical History: {user_context.get('History')}
-    
-    Lab Results:
-    {data_str}
-    
-    Identified Patterns:
-    {patterns_str}
+    parser = CONTEXT_PARSER
     
-    Provide a brief contextual analysis. 
-    If age/gender is unknown, provide general guidance on how these factors usually influence interpretation for the identified patterns.
-    
-    IMPORTANT: Limit your analysis to 5-10 sentences max. Be extremely concise.
-    
-    {parser.get_format_instructions()}
-    """
+    prompt = CONTEXT_PROMPT.messages(
+        age=user_context.get('Age'),
+        gender=user_context.get('Gender'),
+        history=user_context.get('History'),
+        data="\n    ".join([f"{k}: {v['value']} {v.get('unit','')}" for k, v in validated.items()]),
+        patterns=", ".join(patterns),
+    )
 
+    usage = []
     try:
-        response = llm.invoke(prompt)
-        parsed = parser.invoke(response)
+        ensure_within_budget(state, "model3_context", prompt)
+        response = invoke_llm(llm, prompt, node="model3_context", usage=usage,
+                              timeout=node_timeout(state, "model3_context"))
+        parsed = parse_structured(response, parser, "model3_context", llm=llm, usage=usage, state=state)
         return {
             "context_analysis": {
                 "analysis": parsed.analysis,
                 "adjusted_concerns": parsed.adjusted_concerns
-            }
+            },
+            "llm_usage": state.llm_usage + usage,
         }
     except Exception as e:
-         return {"errors": state.errors + [f"Model 3 (Context) failed: {str(e)}"]}
+        return {
+            "errors": state.errors + [f"Model 3 (Context) failed: {str(e)}"],
+            "failed_nodes": state.failed_nodes + ["model3_context"],
+            "llm_usage": state.llm_usage + usage,
+            **timed_out(state, "model3_context", e),
+        }
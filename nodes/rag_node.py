@@ -1,13 +1,23 @@
 from typing import List, Any, Dict, Tuple
 from graph.graph_state import ReportState
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+import threading
 import uuid
 import os
+import re
 from dotenv import load_dotenv
+from utils.report_digest import build_report_digest
+from utils.token_utils import estimate_tokens, truncate_to_tokens
+from utils.token_budget import usage_summary
+from utils.llm_utils import get_llm, invoke_llm
+from utils.deadline import should_skip, skip_stage
+from utils.llm_governor import INTERACTIVE
+from utils.prompt_registry import register_prompt
+from utils.metrics import RAG_CONTEXT_TOKENS, RAG_RETRIEVALS, VECTOR_STORE_DURATION, record_cache
+from utils import namespace_registry
+
+# NOTE: langchain_huggingface (sentence-transformers/torch), langchain_pinecone and
+# the text splitters are imported inside the functions that need them so that
+# importing the API stays fast; utils.warmup loads them in the background.
 
 # Ensure env vars are loaded
 load_dotenv()
@@ -15,8 +25,34 @@ load_dotenv()
 # Chat history storage (in-memory)
 chat_history_store: Dict[str, List[Tuple[str, str]]] = {}
 
+# Rolling summary of turns that fell out of the history window.
+# Maps session_id -> {"text": str, "folded": number of turns already folded}
+chat_summary_store: Dict[str, Dict[str, Any]] = {}
+
+# LLM usage records of each session's chat calls (same shape as ReportState.llm_usage)
+chat_usage_store: Dict[str, List[Dict[str, Any]]] = {}
+
+# History window sizing for chat prompts
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "3"))
+CHAT_HISTORY_MAX_TOKENS = int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "800"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+CHAT_TURN_MAX_TOKENS = 250
+
 # Embedding Model
-EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# Hub repo id or a local directory with the model files (offline images)
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+# "torch" (sentence-transformers) or "onnx" (ONNX Runtime, int8-quantised graph by default)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+
+# "structured": one chunk per parameter row plus patient details and notes;
+# "recursive": fixed-size text chunks (used anyway when no parameters were validated)
+RAG_CHUNKING = os.getenv("RAG_CHUNKING", "structured").lower()
+# Chunks retrieved per question when it names no specific parameter
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "5"))
+
+# Recursive chunking settings; part of the content hash, so changing them re-indexes
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
 
 # In-memory storage for analysis reports
 report_state_store: Dict[str, Any] = {}
@@ -29,55 +65,246 @@ def store_report_state(session_id: str, state: Any):
     if session_id:
         report_state_store[session_id] = state
 
+def _report_digest(report_context: Any) -> str:
+    """Returns the precomputed report digest, building it only for legacy contexts."""
+    if not report_context:
+        return ""
+    if isinstance(report_context, dict):
+        digest = report_context.get("report_digest")
+    else:
+        digest = getattr(report_context, "report_digest", None)
+    record_cache("report_digest", bool(digest))
+    return digest or build_report_digest(report_context)
+
+def _fold_turn(question: str, answer: str) -> str:
+    """Compresses a single chat turn into one summary line."""
+    answer = re.sub(r"[#*`>]+", "", answer)
+    answer = " ".join(answer.split())
+    first_sentence = re.split(r"(?<=[.!?])\s", answer, maxsplit=1)[0]
+    return f"- Q: {truncate_to_tokens(question, 40)} A: {truncate_to_tokens(first_sentence, 60)}"
+
+def _update_rolling_summary(session_id: str) -> None:
+    """Folds turns older than the history window into the session summary."""
+    history = chat_history_store.get(session_id, [])
+    summary = chat_summary_store.setdefault(session_id, {"text": "", "folded": 0})
+
+    lines = summary["text"].splitlines() if summary["text"] else []
+    while len(history) - summary["folded"] > CHAT_HISTORY_TURNS:
+        user_msg, assistant_msg = history[summary["folded"]]
+        lines.append(_fold_turn(user_msg, assistant_msg))
+        summary["folded"] += 1
+
+    # Keep the summary bounded by dropping the oldest lines first
+    while lines and estimate_tokens("\n".join(lines)) > CHAT_SUMMARY_MAX_TOKENS:
+        lines.pop(0)
+    summary["text"] = "\n".join(lines)
+
+def _build_history_context(session_id: str) -> str:
+    """
+    Builds the history section of the chat prompt: the rolling summary plus
+    the most recent turns, newest first, until CHAT_HISTORY_MAX_TOKENS is used up.
+    """
+    history = chat_history_store.get(session_id, [])
+    summary = chat_summary_store.get(session_id, {"text": "", "folded": 0})
+
+    window = history[summary["folded"]:]
+    budget = CHAT_HISTORY_MAX_TOKENS - estimate_tokens(summary["text"])
+    recent = []
+    while window:
+        user_msg, assistant_msg = window[-1]
+        turn = f"User: {user_msg}\nAssistant: {truncate_to_tokens(assistant_msg, CHAT_TURN_MAX_TOKENS)}\n"
+        cost = estimate_tokens(turn)
+        if cost > budget:
+            break
+        recent.insert(0, turn)
+        budget -= cost
+        window = window[:-1]
+
+    # Turns that did not fit verbatim still appear as one-line summaries
+    summary_lines = [summary["text"]] if summary["text"] else []
+    summary_lines += [_fold_turn(user_msg, assistant_msg) for user_msg, assistant_msg in window]
+
+    history_context = ""
+    if summary_lines:
+        history_context += "\nEarlier in this conversation (summary):\n" + "\n".join(summary_lines) + "\n"
+    if recent:
+        history_context += "\nPrevious conversation:\n" + "".join(recent)
+    return history_context
+
+# Micro-batching of embedding calls across concurrent requests (0 disables)
+EMBEDDING_BATCH_MAX = int(os.getenv("EMBEDDING_BATCH_MAX", "64"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+
+# Loaded once per process; building HuggingFaceEmbeddings reloads the model weights
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+# Optional replacement for the Pinecone store (load tests, local development)
+_vector_store_factory = None
+_index = None
+
+def _wrap_embeddings(base, queries_as_documents: bool = False, model_name: str = None):
+    from utils.embedding_cache import get_embedding_cache
+    from utils.embeddings import CachedEmbeddings, InstrumentedEmbeddings, MicroBatchingEmbeddings
+
+    if EMBEDDING_BATCH_MAX > 0:
+        base = MicroBatchingEmbeddings(
+            base, EMBEDDING_BATCH_MAX, EMBEDDING_BATCH_WAIT_MS, queries_as_documents=queries_as_documents
+        )
+    # Cached vectors are only valid for the model that produced them
+    cache = get_embedding_cache() if model_name else None
+    if cache is not None:
+        base = CachedEmbeddings(base, model_name, cache)
+    return InstrumentedEmbeddings(base)
+
+def set_embeddings_override(embeddings, model_name: str = None) -> None:
+    """
+    Replaces the embedding model for this process (None reloads the default on
+    next use). Chunk vectors are cached on disk only when `model_name` is given.
+    """
+    global _embeddings
+    _embeddings = _wrap_embeddings(embeddings, model_name=model_name) if embeddings is not None else None
+
+def set_vector_store_factory(factory) -> None:
+    """
+    Installs a callable (embeddings, namespace) -> VectorStore used instead of
+    Pinecone. Pass None to go back to Pinecone.
+    """
+    global _vector_store_factory
+    _vector_store_factory = factory
+
+def _load_embedding_model():
+    """The configured embedding backend and the key its vectors are cached under."""
+    batch_size = max(32, EMBEDDING_BATCH_MAX)
+    if EMBEDDING_BACKEND == "onnx":
+        from utils.onnx_embeddings import OnnxEmbeddings
+
+        base = OnnxEmbeddings(EMBEDDING_MODEL_NAME, batch_size=batch_size)
+        # Quantised vectors differ slightly from the reference ones; cache them separately
+        return base, f"{EMBEDDING_MODEL_NAME}@{base.onnx_file}"
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    base = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME, encode_kwargs={"batch_size": batch_size})
+    return base, EMBEDDING_MODEL_NAME
+
 def get_embeddings():
-    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    global _embeddings
+    record_cache("embedding_model", _embeddings is not None)
+    if _embeddings is None:
+        # The warm-up thread and the first request may race to load the model
+        with _embeddings_lock:
+            if _embeddings is None:
+                base, cache_key = _load_embedding_model()
+                # all-MiniLM encodes queries and documents the same way
+                _embeddings = _wrap_embeddings(base, queries_as_documents=True, model_name=cache_key)
+    return _embeddings
+
+def get_vector_store(namespace: str, embeddings=None):
+    """Returns the vector store for a report namespace."""
+    embeddings = embeddings or get_embeddings()
+    if _vector_store_factory is not None:
+        return _vector_store_factory(embeddings, namespace)
+    from langchain_pinecone import PineconeVectorStore
+
+    return PineconeVectorStore(
+        index_name=PINECONE_INDEX_NAME,
+        embedding=embeddings,
+        namespace=namespace
+    )
+
+def _pinecone_index():
+    """Raw Pinecone index handle, for operations that need no embeddings."""
+    global _index
+    if _index is None:
+        from pinecone import Pinecone
+
+        _index = Pinecone().Index(PINECONE_INDEX_NAME)
+    return _index
+
+def delete_namespace(namespace: str) -> None:
+    """
+    Removes every vector in a report namespace. Goes to the index directly,
+    so the namespace collector never loads the embedding model.
+    """
+    with VECTOR_STORE_DURATION.labels(operation="delete").time():
+        if _vector_store_factory is not None:
+            _vector_store_factory(_embeddings, namespace).delete(delete_all=True)
+        else:
+            _pinecone_index().delete(delete_all=True, namespace=namespace)
+
+def _build_documents(state: ReportState, metadata: Dict[str, Any]):
+    """
+    Chunks for the report namespace and the chunking mode used. In structured
+    mode there is one small chunk per parameter (tagged with its name and
+    status), one for patient details and a few for the remaining notes;
+    reports without validated parameters fall back to plain text splitting.
+    """
+    from langchain_core.documents import Document
+
+    if RAG_CHUNKING == "structured":
+        from utils.report_chunks import build_report_chunks
+
+        chunks = build_report_chunks(state)
+        if chunks:
+            return [Document(page_content=text, metadata={**metadata, **meta}) for text, meta in chunks], "structured"
+
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        add_start_index=True,
+    )
+    docs = [Document(page_content=text, metadata=metadata) for text in text_splitter.split_text(state.raw_text)]
+    return docs, f"recursive/{CHUNK_SIZE}/{CHUNK_OVERLAP}"
 
 def rag_indexing_node(state: ReportState) -> Dict[str, Any]:
     """
     Indexes the document content into Pinecone using Namespaces.
     Each report gets a unique ID which serves as the namespace in the single 'health-ai' index.
+    An upload whose chunks were already indexed reuses that namespace.
     """
     print("--- RAG INDEXING NODE (PINECONE) ---")
     
     raw_text = state.raw_text
-    file_path = state.raw_file_path
+    file_path = state.raw_file_path or state.raw_file_name
     
     if not raw_text:
         print("No text to index.")
         return {"errors": ["No text available for RAG indexing"]}
 
     try:
-        # Generate a unique namespace for this session/report
-        namespace = f"report_{uuid.uuid4().hex}"
-        
-        # Split text
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            add_start_index=True,
-        )
-        
-        # Metadata
-        metadata = {"source": file_path if file_path else "unknown"}
-        
-        docs = [Document(page_content=text, metadata=metadata) for text in text_splitter.split_text(raw_text)]
+        namespace_registry.start_collector(delete_namespace)
+        docs, mode = _build_documents(state, {"source": file_path if file_path else "unknown"})
         
         if not docs:
             print("No documents created from text splitter.")
             return {"errors": ["Text splitting failed"]}
 
-        embeddings = get_embeddings()
-        
+        digest = namespace_registry.content_hash(
+            "\x1e".join(doc.page_content for doc in docs), EMBEDDING_MODEL_NAME, mode
+        )
+        existing = namespace_registry.find_by_content(digest)
+        record_cache("rag_namespace", existing is not None)
+        if existing:
+            namespace_registry.touch(existing)
+            print(f"Identical report already indexed; reusing namespace: {existing}")
+            return {"rag_collection_name": existing}
+        # Embedding and upserting is what takes time; a reused namespace above is free
+        if should_skip(state, "rag_indexing"):
+            return skip_stage(state, "rag_indexing")
+
+        # Generate a unique namespace for this session/report
+        namespace = f"report_{uuid.uuid4().hex}"
+
         print(f"Indexing {len(docs)} chunks to Pinecone Index '{PINECONE_INDEX_NAME}' in Namespace '{namespace}'...")
         
-        # Create VectorStore from documents
+        # Add documents to the report's namespace
         # This assumes the index 'health-ai' ALREADY EXISTS.
-        PineconeVectorStore.from_documents(
-            documents=docs,
-            embedding=embeddings,
-            index_name=PINECONE_INDEX_NAME,
-            namespace=namespace
-        )
+        with VECTOR_STORE_DURATION.labels(operation="index").time():
+            get_vector_store(namespace).add_documents(docs)
+        namespace_registry.register(namespace, digest)
         
         print(f"Successfully indexed into namespace: {namespace}")
         
@@ -88,74 +315,29 @@ def rag_indexing_node(state: ReportState) -> Dict[str, Any]:
         print(f"Error in RAG node: {e}")
         return {"errors": [f"RAG Indexing Error: {str(e)}"]}
 
-def rag_retrieve_and_answer(question: str, collection_name: str, session_id: str = None, report_context: Any = None) -> str:
+def _retrieve(vector_store, question: str):
     """
-    Retrieves context and generates an answer using an LLM with chat history.
-    collection_name here refers to the Pinecone Namespace.
+    Chunks for a chat question. When the question names parameters, only their
+    rows (and the patient details) are fetched from a structured namespace;
+    namespaces indexed with plain text chunks return nothing for that filter
+    and get a regular top-k search instead.
     """
-    from langchain_groq import ChatGroq
-    from langchain_core.prompts import PromptTemplate
-    import json
-    
-    if session_id is None:
-        session_id = "default"
-    
-    # Initialize chat history
-    if session_id not in chat_history_store:
-        chat_history_store[session_id] = []
-    
-    try:
-        embeddings = get_embeddings()
-        
-        # Initialize VectorStore for retrieval
-        vector_store = PineconeVectorStore(
-            index_name=PINECONE_INDEX_NAME,
-            embedding=embeddings,
-            namespace=collection_name
-        )
-        
-        retriever = vector_store.as_retriever(search_kwargs={"k": 5})
-        
-        llm = ChatGroq(model="llama-3.3-70b-versatile", temperature=0)
-        
-        # Retrieve relevant documents
-        # Note: If namespace doesn't exist, Pinecone returns empty list, not error.
-        retrieved_docs = retriever.invoke(question)
-        
-        if not retrieved_docs:
-             print("Warning: No documents retrieved. Namespace might be empty or invalid.")
-        
-        context = "\n".join([doc.page_content for doc in retrieved_docs])
-        
-        # Build chat history context
-        history_context = ""
-        if chat_history_store[session_id]:
-            history_context = "\nPrevious conversation:\n"
-            for user_msg, assistant_msg in chat_history_store[session_id][-5:]:
-                history_context += f"User: {user_msg}\nAssistant: {assistant_msg}\n"
-
-        # Build Analysis Report Context
-        if report_context is None and session_id in report_state_store:
-            report_context = report_state_store[session_id]
-
-        report_context_str = ""
-        if report_context:
-            if hasattr(report_context, 'model_dump'):
-                ctx_data = report_context.model_dump()
-            elif hasattr(report_context, 'dict'):
-                ctx_data = report_context.dict()
-            else:
-                ctx_data = report_context if isinstance(report_context, dict) else {}
-            
-            if 'raw_text' in ctx_data and ctx_data['raw_text'] and len(ctx_data['raw_text']) > 5000:
-                 ctx_data['raw_text'] = ctx_data['raw_text'][:5000] + "... (truncated in context)"
-
-            report_context_str = json.dumps(ctx_data, indent=2, default=str)
-        
-        # Create prompt
-        prompt = PromptTemplate(
-            input_variables=["context", "question", "history", "report_context"],
-            template="""You are a dedicated AI medical assistant analyzing a specific patient's uploaded blood report.
+    from utils.report_chunks import params_in_question
+
+    params = params_in_question(question)
+    if params:
+        metadata_filter = {"$or": [{"param": {"$in": params}}, {"type": {"$eq": "demographics"}}]}
+        with VECTOR_STORE_DURATION.labels(operation="query").time():
+            docs = vector_store.similarity_search(question, k=len(params) + 1, filter=metadata_filter)
+        if docs:
+            RAG_RETRIEVALS.labels(mode="filtered").inc()
+            return docs
+    RAG_RETRIEVALS.labels(mode="top_k").inc()
+    with VECTOR_STORE_DURATION.labels(operation="query").time():
+        return vector_store.similarity_search(question, k=RAG_TOP_K)
+
+# Instructions as a fixed system message so every chat turn shares the cached prefix
+CHAT_PROMPT = register_prompt("rag_chat", version=2, system="""You are a dedicated AI medical assistant analyzing a specific patient's uploaded blood report.
 Your goal is to explain the report findings, clarify medical terms found in the report, and answer questions BASED STRICTLY on the provided context.
 
 CRITICAL INSTRUCTION:
@@ -163,14 +345,13 @@ If the user asks a question that is NOT related to the uploaded medical report,
 "Please talk about only the uploaded blood report."
 
 If the question is relevant to the report:
-1. Synthesize information from the 'FULL Analysis State' (which contains the deep analysis, patterns, and recommendations) and the 'Retrieved Text Context' (raw text from the report).
+1. Synthesize information from the 'Analysis Summary' (which contains the abnormal findings, patterns, risk and recommendations) and the 'Retrieved Text Context' (raw text from the report).
 2. Format your response professionally, similar to ChatGPT:
    - Use `### Subheadings` to structure your answer.
    - Use bullet points (`-`) for clarity.
    - Use **bold** text for key medical parameters or findings.
    - Keep the tone helpful, professional, and empathetic.
-
-FULL Analysis State (Synthesis, Patterns, Recommendations):
+""", human="""Analysis Summary (Abnormal Findings, Patterns, Risk, Recommendations):
 {report_context}
 
 Retrieved Text Context (Raw Report Excerpts):
@@ -181,22 +362,89 @@ Conversation History:
 
 User Question: {question}
 
-Answer:"""
-        )
+Answer:""")
+
+class ReportExpired(LookupError):
+    """The report's namespace was collected and cannot be rebuilt; the report must be analyzed again."""
+
+# Namespace a collected one was re-indexed into, so later chat turns go straight there
+_reindexed: Dict[str, str] = {}
+
+def _live_namespace(collection_name: str, session_id: str, report_context: Any = None) -> str:
+    """
+    The namespace to retrieve from. When `collection_name` has been collected,
+    the report is re-indexed from its stored state; ReportExpired is raised
+    when no state with the report text is available.
+    """
+    if namespace_registry.is_live(collection_name):
+        return collection_name
+    replacement = _reindexed.get(collection_name)
+    if replacement and namespace_registry.is_live(replacement):
+        return replacement
+
+    state = report_context if report_context is not None else report_state_store.get(session_id)
+    if isinstance(state, ReportState) and state.raw_text:
+        print(f"Namespace '{collection_name}' was collected; re-indexing the report")
+        # The analysis deadline is long gone; indexing must not be skipped for it
+        update = rag_indexing_node(state.model_copy(update={"deadline": None}))
+        namespace = update.get("rag_collection_name")
+        if namespace:
+            _reindexed[collection_name] = namespace
+            state.rag_collection_name = namespace
+            return namespace
+    raise ReportExpired("This report has expired from the chat index; please analyze it again.")
+
+def rag_retrieve_and_answer(question: str, collection_name: str, session_id: str = None, report_context: Any = None) -> str:
+    """
+    Retrieves context and generates an answer using an LLM with chat history.
+    collection_name here refers to the Pinecone Namespace. Raises
+    ReportExpired when the namespace was collected and cannot be rebuilt.
+    """
+    if session_id is None:
+        session_id = "default"
+    if report_context is None and session_id in report_state_store:
+        report_context = report_state_store[session_id]
+    collection_name = _live_namespace(collection_name, session_id, report_context)
+    
+    # Initialize chat history
+    if session_id not in chat_history_store:
+        chat_history_store[session_id] = []
+    
+    try:
+        # Initialize VectorStore for retrieval
+        vector_store = get_vector_store(collection_name)
         
-        # Chain
-        chain = prompt | llm
+        llm = get_llm("rag_chat")
+        
+        # Retrieve relevant documents
+        # Note: If namespace doesn't exist, Pinecone returns empty list, not error.
+        retrieved_docs = _retrieve(vector_store, question)
         
-        result = chain.invoke({
-            "context": context,
-            "question": question,
-            "history": history_context,
-            "report_context": report_context_str
-        })
+        if not retrieved_docs:
+             print("Warning: No documents retrieved. Namespace might be empty or invalid.")
+        # Chatting keeps the namespace alive
+        namespace_registry.touch(collection_name, session_id=session_id, chat=True)
+        
+        context = "\n".join([doc.page_content for doc in retrieved_docs])
+        RAG_CONTEXT_TOKENS.observe(estimate_tokens(context))
+        
+        # Build chat history context (rolling summary + recent turns)
+        history_context = _build_history_context(session_id)
+
+        # Build Analysis Report Context from the precomputed digest
+        report_context_str = _report_digest(report_context)
+        
+        result = invoke_llm(llm, CHAT_PROMPT.messages(
+            context=context,
+            question=question,
+            history=history_context,
+            report_context=report_context_str
+        ), node="rag_chat", priority=INTERACTIVE, usage=chat_usage_store.setdefault(session_id, []))
         
         answer = result.content.strip() if hasattr(result, 'content') else str(result).strip()
         
         chat_history_store[session_id].append((question, answer))
+        _update_rolling_summary(session_id)
         
         return answer
         
@@ -210,12 +458,23 @@ def get_chat_history(session_id: str = None) -> List[Tuple[str, str]]:
         session_id = "default"
     return chat_history_store.get(session_id, [])
 
+def get_chat_usage(session_id: str = None) -> Dict[str, Any]:
+    """Token usage of a session's chat calls, summarised like /analyze's usage block."""
+    if session_id is None:
+        session_id = "default"
+    calls = chat_usage_store.get(session_id, [])
+    return {**usage_summary(calls), "per_call": calls}
+
 def clear_chat_history(session_id: str = None) -> None:
     if session_id is None:
         session_id = "default"
     if session_id in chat_history_store:
         chat_history_store[session_id] = []
+    chat_summary_store.pop(session_id, None)
+    chat_usage_store.pop(session_id, None)
 
 def clear_all_chat_history() -> None:
-    global chat_history_store
+    global chat_history_store, chat_summary_store, chat_usage_store
     chat_history_store = {}
+    chat_summary_store = {}
+    chat_usage_store = {}
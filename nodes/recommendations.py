@@ -1,37 +1,56 @@
 from typing import List
+from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
-from utils.llm_utils import get_llm
+from utils.deadline import node_timeout, should_skip, skip_stage, timed_out
+from utils.llm_utils import get_llm, invoke_llm
+from utils.prompt_registry import register_prompt
+from utils.structured_output import parse_structured
+from utils.token_budget import fit_text, input_budget
 
 class RecsOutput(BaseModel):
     recommendations: List[str] = Field(description="List of actionable health recommendations")
 
+RECS_PARSER = PydanticOutputParser(pydantic_object=RecsOutput)
+
+RECS_PROMPT = register_prompt("recommendations", version=2, system=f"""
+    You will be given a medical report summary.
+    
+    Provide 3-5 actionable health, diet, or lifestyle recommendations.
+    Be specific but safe (always advise consulting a doctor).
+    
+    {RECS_PARSER.get_format_instructions()}
+    """, human="""
+    Medical report summary:
+    
+    "{summary}"
+    """)
+
 def recommendations_node(state):
     """
     Generates personalized recommendations based on the synthesized findings.
     """
+    if should_skip(state, "recommendations"):
+        return skip_stage(state, "recommendations")
     synthesis = state.synthesis_report
     if not synthesis:
         return {"recommendations": []}
 
-    llm = get_llm()
+    llm = get_llm("recommendations")
     # structured_llm = llm.with_structured_output(RecsOutput)
-    from langchain_core.output_parsers import PydanticOutputParser
-    parser = PydanticOutputParser(pydantic_object=RecsOutput)
-    
-    prompt = f"""
-    Based on the following medical report summary:
-    
-    "{synthesis}"
-    
-    Provide 3-5 actionable health, diet, or lifestyle recommendations.
-    Be specific but safe (always advise consulting a doctor).
-    
-    {parser.get_format_instructions()}
-    """
+    parser = RECS_PARSER
     
+    usage = []
     try:
-        response = llm.invoke(prompt)
-        parsed = parser.invoke(response)
-        return {"recommendations": parsed.recommendations}
+        budget = input_budget(state, "recommendations", RECS_PROMPT.text(summary=""))
+        prompt = RECS_PROMPT.messages(summary=fit_text(synthesis, budget, "recommendations"))
+        response = invoke_llm(llm, prompt, node="recommendations", usage=usage,
+                              timeout=node_timeout(state, "recommendations"))
+        parsed = parse_structured(response, parser, "recommendations", llm=llm, usage=usage, state=state)
+        return {"recommendations": parsed.recommendations, "llm_usage": state.llm_usage + usage}
     except Exception as e:
-        return {"errors": state.errors + [f"Recommendations Node failed: {str(e)}"]}
+        return {
+            "errors": state.errors + [f"Recommendations Node failed: {str(e)}"],
+            "failed_nodes": state.failed_nodes + ["recommendations"],
+            "llm_usage": state.llm_usage + usage,
+            **timed_out(state, "recommendations", e),
+        }
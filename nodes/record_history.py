@@ -0,0 +1,22 @@
+from datetime import date
+
+from utils.longitudinal_store import record_values
+
+
+def record_history_node(state):
+    """
+    Appends this report's validated values to the patient's history so trends
+    can be queried without re-running old reports. Skipped when the caller
+    did not supply a patient_id.
+    """
+    if not state.patient_id or not state.validated_params:
+        return {}
+
+    report_date = state.report_date or date.today().isoformat()
+    try:
+        count = record_values(state.patient_id, report_date, state.run_id or "unknown", state.validated_params)
+        print(f"Recorded {count} values for patient {state.patient_id} on {report_date}")
+    except Exception as e:
+        # History is a side feature; never fail the analysis over it
+        return {"errors": state.errors + [f"Recording patient history failed: {str(e)}"]}
+    return {"report_date": report_date}
@@ -1,41 +1,11 @@
-from utils.llm_utils import get_llm
+from utils.deadline import node_timeout, should_skip, skip_stage, timed_out
+from utils.llm_utils import get_llm, invoke_llm
+from utils.prompt_registry import register_prompt
+from utils.token_budget import ensure_within_budget
 
-def synthesis_node(state):
-    """
-    Aggregates findings from Parameter Extraction, Pattern Recognition, and Contextual Analysis
-    into a coherent summary.
-    """
-    validated = state.validated_params
-    patterns = state.patterns
-    risk = state.risk_assessment
-    context = state.context_analysis
-    patient_info = state.patient_info or {}
-    
-    if not validated:
-        return {"synthesis_report": "No data available to synthesize."}
-
-    llm = get_llm()
-    
-    # Prepare prompt inputs
-    prompt = f"""
-    You are a senior medical consultant. Synthesize a comprehensive report based on the following:
-    
-    PATIENT: {patient_info.get('Name', 'Unknown')} | {patient_info.get('Age', 'Unknown')} | {patient_info.get('Gender', 'Unknown')}
-    
-    1. ABNORMAL FINDINGS (Validated Data):
-    {
-        ", ".join([f"{k}: {v['value']}" for k,v in validated.items() if state.param_interpretation.get(k, {}).get("status") != "normal"])
-    }
-    
-    2. DETECTED PATTERNS:
-    {", ".join(patterns)}
-    
-    3. RISK ASSESSMENT:
-    Score: {risk.get('score')}
-    Rationale: {risk.get('rationale')}
-    
-    4. CONTEXTUAL ANALYSIS:
-    {context.get('analysis')}
+SYNTHESIS_PROMPT = register_prompt("synthesis", version=2, system="""
+    You are a senior medical consultant. Synthesize a comprehensive report based on the findings that follow
+    (patient, abnormal findings, detected patterns, risk assessment and contextual analysis).
     
     Write a clear, professional summary for the patient (layperson friendly but medically accurate).
     
@@ -51,10 +21,63 @@ def synthesis_node(state):
     
     **J. Likith Sagar**
     Senior Medical Consultant
+    """, human="""
+    PATIENT: {name} | {age} | {gender}
+    
+    1. ABNORMAL FINDINGS (Validated Data):
+    {abnormal}
+    
+    2. DETECTED PATTERNS:
+    {patterns}
+    
+    3. RISK ASSESSMENT:
+    Score: {risk_score}
+    Rationale: {risk_rationale}
+    
+    4. CONTEXTUAL ANALYSIS:
+    {context}
+    """)
+
+def synthesis_node(state):
+    """
+    Aggregates findings from Parameter Extraction, Pattern Recognition, and Contextual Analysis
+    into a coherent summary.
     """
+    validated = state.validated_params
+    patterns = state.patterns
+    risk = state.risk_assessment
+    context = state.context_analysis
+    patient_info = state.patient_info or {}
+    
+    if not validated:
+        return {"synthesis_report": "No data available to synthesize."}
+    if should_skip(state, "synthesis"):
+        return skip_stage(state, "synthesis")
+
+    llm = get_llm("synthesis")
+    
+    # Prepare prompt inputs
+    prompt = SYNTHESIS_PROMPT.messages(
+        name=patient_info.get('Name', 'Unknown'),
+        age=patient_info.get('Age', 'Unknown'),
+        gender=patient_info.get('Gender', 'Unknown'),
+        abnormal=", ".join([f"{k}: {v['value']}" for k,v in validated.items() if state.param_interpretation.get(k, {}).get("status") != "normal"]),
+        patterns=", ".join(patterns),
+        risk_score=risk.get('score'),
+        risk_rationale=risk.get('rationale'),
+        context=context.get('analysis'),
+    )
     
+    usage = []
     try:
-        response = llm.invoke(prompt)
-        return {"synthesis_report": response.content}
+        ensure_within_budget(state, "synthesis", prompt)
+        response = invoke_llm(llm, prompt, node="synthesis", usage=usage,
+                              timeout=node_timeout(state, "synthesis"))
+        return {"synthesis_report": response.content, "llm_usage": state.llm_usage + usage}
     except Exception as e:
-        return {"errors": state.errors + [f"Synthesis Node failed: {str(e)}"]}
\ No newline at end of file
+        return {
+            "errors": state.errors + [f"Synthesis Node failed: {str(e)}"],
+            "failed_nodes": state.failed_nodes + ["synthesis"],
+            "llm_usage": state.llm_usage + usage,
+            **timed_out(state, "synthesis", e),
+        }
\ No newline at end of file
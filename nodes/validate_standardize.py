@@ -30,12 +30,13 @@ def normalize_scale(param, value):
     return value
 
 
-def resolve_reference(ref):
+def resolve_reference(ref, gender=None):
     """
     Resolve reference range deterministically.
     Supports:
     - {"low": x, "high": y}
     - {"adult_male": {...}, "adult_female": {...}}
+    The patient's gender picks the matching adult range when known.
     """
     if not isinstance(ref, dict):
         return None, None
@@ -43,8 +44,12 @@ def resolve_reference(ref):
     if "low" in ref and "high" in ref:
         return ref["low"], ref["high"]
 
+    order = ("adult_male", "adult_female", "adult")
+    if gender and str(gender).strip().lower().startswith("f"):
+        order = ("adult_female", "adult_male", "adult")
+
     # deterministic fallback order
-    for key in ("adult_male", "adult_female", "adult"):
+    for key in order:
         if key in ref and isinstance(ref[key], dict):
             return ref[key].get("low"), ref[key].get("high")
 
@@ -67,6 +72,7 @@ def validate_and_standardize(state):
     errors = list(getattr(state, "errors", []) or [])
 
     extracted = getattr(state, "extracted_params", {}) or {}
+    gender = (getattr(state, "patient_info", {}) or {}).get("Gender")
 
     for param, info in extracted.items():
         raw_val = info.get("value")
@@ -89,7 +95,7 @@ def validate_and_standardize(state):
         value = normalize_scale(param, value)
 
         ref = ranges[param].get("reference")
-        low, high = resolve_reference(ref)
+        low, high = resolve_reference(ref, gender)
 
         if low is None or high is None:
             errors.append(f"{param}: invalid reference range")
@@ -6,4 +6,6 @@ __all__ = [
     "reference_ranges",
     "mapping",
     "unit_conversion",
+    "token_utils",
+    "report_digest",
 ]
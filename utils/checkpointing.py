@@ -0,0 +1,132 @@
+"""
+Checkpointer for the analysis graph.
+
+Every node's output is persisted per run (LangGraph thread_id = run_id), so a
+failed run can be resumed from the failing node and a corrected run can be
+replayed from any earlier step without redoing OCR or extraction.
+
+CHECKPOINTER selects the backend: "sqlite" (default, CHECKPOINT_DB_PATH),
+"memory" (per process, lost on restart) or "none" (resume/patch disabled).
+
+Checkpoints hold the report text and results, so runs are pruned: a run
+unused for CHECKPOINT_TTL_HOURS is deleted, and only the CHECKPOINT_MAX_RUNS
+most recently used runs are kept (0 disables either limit).
+"""
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+CHECKPOINTER = os.getenv("CHECKPOINTER", "sqlite").lower()
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", "brain_storage/checkpoints.sqlite")
+CHECKPOINT_TTL_HOURS = float(os.getenv("CHECKPOINT_TTL_HOURS", "72"))
+CHECKPOINT_MAX_RUNS = int(os.getenv("CHECKPOINT_MAX_RUNS", "1000"))
+# Pruning runs at most this often, on the back of record_run()
+CHECKPOINT_PRUNE_INTERVAL_S = float(os.getenv("CHECKPOINT_PRUNE_INTERVAL_S", "600"))
+
+_checkpointer = None
+_lock = threading.Lock()
+# run_id -> last use (memory backend; the sqlite backend keeps this in the run_index table)
+_memory_runs: Dict[str, float] = {}
+_last_prune = 0.0
+
+
+def _serializer():
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+    # The graph input is a ReportState; allow it explicitly instead of any pickled type
+    return JsonPlusSerializer(allowed_msgpack_modules=[("graph.graph_state", "ReportState")])
+
+
+def _build_checkpointer():
+    if CHECKPOINTER == "none":
+        return None
+    if CHECKPOINTER == "memory":
+        from langgraph.checkpoint.memory import InMemorySaver
+
+        return InMemorySaver(serde=_serializer())
+
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    Path(CHECKPOINT_DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+    # SqliteSaver serialises access with its own lock, so one shared connection is enough
+    conn = sqlite3.connect(CHECKPOINT_DB_PATH, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    saver = SqliteSaver(conn, serde=_serializer())
+    saver.setup()
+    with saver.lock:
+        conn.execute("CREATE TABLE IF NOT EXISTS run_index (thread_id TEXT PRIMARY KEY, last_used REAL NOT NULL)")
+        conn.commit()
+    return saver
+
+
+def get_checkpointer():
+    """Process-wide checkpointer, or None when checkpointing is disabled."""
+    global _checkpointer
+    if _checkpointer is None and CHECKPOINTER != "none":
+        with _lock:
+            if _checkpointer is None:
+                _checkpointer = _build_checkpointer()
+    return _checkpointer
+
+
+def run_config(run_id: str) -> dict:
+    return {"configurable": {"thread_id": run_id}}
+
+
+def _expired_runs(saver, now: float, ttl_s: float, max_runs: int) -> List[str]:
+    if CHECKPOINTER == "memory":
+        with _lock:
+            runs = sorted(_memory_runs.items(), key=lambda item: item[1], reverse=True)
+    else:
+        with saver.lock:
+            runs = saver.conn.execute("SELECT thread_id, last_used FROM run_index ORDER BY last_used DESC").fetchall()
+    expired = [run_id for run_id, last_used in runs if ttl_s and last_used < now - ttl_s]
+    if max_runs:
+        expired += [run_id for run_id, _ in runs[max_runs:] if run_id not in expired]
+    return expired
+
+
+def prune_checkpoints(ttl_s: float = CHECKPOINT_TTL_HOURS * 3600, max_runs: int = CHECKPOINT_MAX_RUNS) -> int:
+    """Deletes the checkpoints of expired runs; returns how many runs were deleted."""
+    saver = get_checkpointer()
+    if saver is None:
+        return 0
+    expired = _expired_runs(saver, time.time(), ttl_s, max_runs)
+    for run_id in expired:
+        saver.delete_thread(run_id)
+        if CHECKPOINTER == "memory":
+            with _lock:
+                _memory_runs.pop(run_id, None)
+        else:
+            with saver.lock:
+                saver.conn.execute("DELETE FROM run_index WHERE thread_id = ?", (run_id,))
+                saver.conn.commit()
+    if expired:
+        print(f"Pruned checkpoints of {len(expired)} expired run(s)")
+    return len(expired)
+
+
+def record_run(run_id: str) -> None:
+    """Marks a run as used now (keeps it from expiring) and prunes old runs now and then."""
+    global _last_prune
+    saver = get_checkpointer()
+    if saver is None:
+        return
+    now = time.time()
+    if CHECKPOINTER == "memory":
+        with _lock:
+            _memory_runs[run_id] = now
+    else:
+        with saver.lock:
+            saver.conn.execute(
+                "INSERT INTO run_index (thread_id, last_used) VALUES (?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET last_used = excluded.last_used",
+                (run_id, now),
+            )
+            saver.conn.commit()
+    if now - _last_prune >= CHECKPOINT_PRUNE_INTERVAL_S:
+        _last_prune = now
+        prune_checkpoints()
@@ -0,0 +1,82 @@
+"""
+Per-request deadlines for the analysis pipeline.
+
+A run gets a wall-clock deadline (ReportState.deadline, epoch seconds) when
+it starts: ANALYSIS_DEADLINE_S, or the client's `deadline_s`. Every LLM node
+bounds its call, including retries, rate-limit waits and hedges, by the time
+left minus DEADLINE_INDEXING_RESERVE_S, which is kept for RAG indexing.
+
+The late stages (context, synthesis, recommendations, RAG indexing) are not
+started when too little time is left. They are skipped instead: the run is
+marked `partial`, the stage is listed in `skipped_nodes`, and the LLM stages
+are also added to `failed_nodes`, so POST /runs/{run_id}/resume can complete
+them later. A stage whose LLM call times out against the deadline is
+recorded the same way (timed_out()).
+"""
+import os
+import time
+from typing import Optional
+
+from utils.metrics import DEADLINE_SKIPPED_STAGES
+
+# Wall-clock budget of one analysis request, in seconds (0 = no deadline)
+ANALYSIS_DEADLINE_S = float(os.getenv("ANALYSIS_DEADLINE_S", "120"))
+# Late LLM stages are skipped rather than started with less time than this
+DEADLINE_STAGE_MIN_S = float(os.getenv("DEADLINE_STAGE_MIN_S", "5"))
+# Time RAG indexing needs at the end of the run; the LLM stages leave it free
+DEADLINE_INDEXING_RESERVE_S = float(os.getenv("DEADLINE_INDEXING_RESERVE_S", "3"))
+
+LATE_STAGES = ("model3_context", "synthesis", "recommendations", "rag_indexing")
+
+
+def request_deadline(seconds: Optional[float] = None) -> Optional[float]:
+    """Deadline for a run starting now; `seconds` overrides ANALYSIS_DEADLINE_S."""
+    seconds = ANALYSIS_DEADLINE_S if seconds is None else seconds
+    return time.time() + seconds if seconds and seconds > 0 else None
+
+
+def remaining(state) -> Optional[float]:
+    deadline = getattr(state, "deadline", None)
+    return None if deadline is None else deadline - time.time()
+
+
+def node_timeout(state, node: str) -> Optional[float]:
+    """Seconds `node` may spend, or None without a deadline."""
+    left = remaining(state)
+    if left is None:
+        return None
+    if node != "rag_indexing":
+        left -= DEADLINE_INDEXING_RESERVE_S
+    return max(left, 0.0)
+
+
+def should_skip(state, node: str) -> bool:
+    if node not in LATE_STAGES:
+        return False
+    timeout = node_timeout(state, node)
+    needed = DEADLINE_INDEXING_RESERVE_S if node == "rag_indexing" else DEADLINE_STAGE_MIN_S
+    return timeout is not None and timeout < needed
+
+
+def skip_stage(state, node: str) -> dict:
+    """State update for a late stage skipped because the deadline is close."""
+    DEADLINE_SKIPPED_STAGES.labels(node=node).inc()
+    print(f"Skipping {node}: {max(remaining(state), 0.0):.1f}s left before the request deadline")
+    update = {"partial": True, "skipped_nodes": state.skipped_nodes + [node]}
+    if node != "rag_indexing":
+        update["failed_nodes"] = state.failed_nodes + [node]
+    return update
+
+
+def timed_out(state, node: str, error: Exception) -> dict:
+    """
+    Extra state update for a stage that failed with `error`: when the stage
+    ran out of time against the request deadline, the run is marked partial
+    and the stage listed in skipped_nodes, as if it had been skipped.
+    """
+    if getattr(state, "deadline", None) is None:
+        return {}
+    if not (isinstance(error, TimeoutError) or "Timeout" in type(error).__name__):
+        return {}
+    DEADLINE_SKIPPED_STAGES.labels(node=node).inc()
+    return {"partial": True, "skipped_nodes": state.skipped_nodes + [node]}
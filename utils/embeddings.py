@@ -0,0 +1,160 @@
+"""
+Embedding model wrappers used by the RAG layer.
+
+Kept separate from nodes/rag_node.py so that importing the API does not pull
+in langchain_core's embedding machinery until embeddings are actually needed.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+from utils.embedding_cache import text_hash
+from utils.metrics import EMBEDDING_BATCH_SIZE, EMBEDDING_CACHE_TEXTS, EMBEDDING_DURATION, EMBEDDING_TEXTS
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """Thin wrapper around a LangChain Embeddings object that times every call."""
+
+    def __init__(self, base):
+        self.base = base
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        EMBEDDING_TEXTS.labels(operation="documents").inc(len(texts))
+        with EMBEDDING_DURATION.labels(operation="documents").time():
+            return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        EMBEDDING_TEXTS.labels(operation="query").inc()
+        with EMBEDDING_DURATION.labels(operation="query").time():
+            return self.base.embed_query(text)
+
+    def __getattr__(self, name):
+        if name == "base":
+            raise AttributeError(name)
+        return getattr(self.base, name)
+
+
+class _PendingEmbedding:
+    __slots__ = ("texts", "future")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """
+    Coalesces embedding requests from concurrent threads into one forward pass.
+
+    Callers block on a future while a single worker thread per kind
+    (documents / query) collects requests for up to `max_wait_ms` or until
+    `max_batch` texts are queued, encodes them with one embed_documents()
+    call and hands each caller its own slice of the vectors. Under no load the
+    extra latency is at most `max_wait_ms`.
+    """
+
+    def __init__(self, base: Embeddings, max_batch: int = 64, max_wait_ms: float = 5.0,
+                 queries_as_documents: bool = False):
+        self.base = base
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        # Symmetric models (no query instruction) can encode a batch of queries in one pass
+        self.queries_as_documents = queries_as_documents
+        self._queues = {"documents": queue.Queue(), "query": queue.Queue()}
+        for kind, q in self._queues.items():
+            threading.Thread(target=self._worker, args=(kind, q), name=f"embed-batcher-{kind}", daemon=True).start()
+
+    def _encode(self, kind: str, texts: List[str]) -> List[List[float]]:
+        if kind == "query" and not self.queries_as_documents:
+            return [self.base.embed_query(t) for t in texts]
+        return self.base.embed_documents(texts)
+
+    def _worker(self, kind: str, q: "queue.Queue[_PendingEmbedding]") -> None:
+        while True:
+            batch = [q.get()]
+            size = len(batch[0].texts)
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item.texts)
+
+            texts = [t for item in batch for t in item.texts]
+            EMBEDDING_BATCH_SIZE.labels(operation=kind).observe(len(texts))
+            try:
+                vectors = self._encode(kind, texts)
+            except Exception as e:
+                for item in batch:
+                    item.future.set_exception(e)
+                continue
+            offset = 0
+            for item in batch:
+                item.future.set_result(vectors[offset:offset + len(item.texts)])
+                offset += len(item.texts)
+
+    def _submit(self, kind: str, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        pending = _PendingEmbedding(list(texts))
+        self._queues[kind].put(pending)
+        return pending.future.result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._submit("documents", texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit("query", [text])[0]
+
+    def __getattr__(self, name):
+        if name == "base":
+            raise AttributeError(name)
+        return getattr(self.base, name)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Looks document chunks up in the on-disk EmbeddingCache before embedding,
+    so only unseen chunk texts reach the model. Queries are not cached.
+    """
+
+    def __init__(self, base: Embeddings, model_name: str, cache):
+        self.base = base
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        hashes = [text_hash(t) for t in texts]
+        cached = self.cache.get_many(self.model_name, hashes)
+        EMBEDDING_CACHE_TEXTS.labels(result="hit").inc(sum(1 for h in hashes if h in cached))
+
+        missing: Dict[bytes, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        if missing:
+            EMBEDDING_CACHE_TEXTS.labels(result="miss").inc(len(missing))
+            vectors = self.base.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing, vectors))
+            self.cache.put_many(self.model_name, fresh)
+            cached.update(fresh)
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
+
+    def __getattr__(self, name):
+        if name == "base":
+            raise AttributeError(name)
+        return getattr(self.base, name)
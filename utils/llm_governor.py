@@ -0,0 +1,208 @@
+"""
+Process-wide governor for LLM calls.
+
+Every call made through utils.llm_utils.invoke_llm() acquires a slot here
+first. The governor enforces:
+
+- a global concurrency limit (LLM_MAX_CONCURRENCY),
+- per-model requests-per-minute and tokens-per-minute buckets (LLM_RPM,
+  LLM_TPM; 0 disables a bucket), scaled by LLM_QUOTA_HEADROOM so sustained
+  traffic stays just under the provider quota,
+- priority ordering, so interactive chat is admitted before bulk analysis;
+  each model has its own queue, so a model that is paused or out of quota
+  does not hold up calls to other models (e.g. the fallback model),
+- a shared pause when the provider answers 429 with retry-after, so one
+  rate-limit response backs off every caller instead of each retrying blindly.
+"""
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+from utils.metrics import LLM_GOVERNOR_WAIT, LLM_IN_FLIGHT
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+LLM_QUOTA_HEADROOM = float(os.getenv("LLM_QUOTA_HEADROOM", "0.9"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "1.0"))
+LLM_BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "30"))
+
+
+class TokenBucket:
+    """Continuous-refill bucket; capacity equals one minute of quota."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (0 if available now)."""
+        self._refill(now)
+        # Requests larger than the whole bucket would never fit; let them through on a full bucket
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        """Corrects a reservation once the real usage is known (may go negative)."""
+        self.level = min(self.capacity, self.level - delta)
+
+
+class LLMGovernor:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, rpm: float = LLM_RPM,
+                 tpm: float = LLM_TPM, headroom: float = LLM_QUOTA_HEADROOM):
+        self.max_concurrency = max(1, max_concurrency)
+        self.rpm = rpm * headroom
+        self.tpm = tpm * headroom
+        self._cond = threading.Condition()
+        self._waiting: Dict[str, list] = {}  # per model: heap of (priority, seq, est_tokens)
+        self._seq = itertools.count()
+        self._active = 0
+        self._rpm_buckets: Dict[str, TokenBucket] = {}
+        self._tpm_buckets: Dict[str, TokenBucket] = {}
+        self._paused_until: Dict[str, float] = {}
+
+    def _buckets(self, model: str):
+        rpm = self._rpm_buckets.get(model)
+        if rpm is None and self.rpm > 0:
+            rpm = self._rpm_buckets[model] = TokenBucket(self.rpm)
+        tpm = self._tpm_buckets.get(model)
+        if tpm is None and self.tpm > 0:
+            tpm = self._tpm_buckets[model] = TokenBucket(self.tpm)
+        return rpm, tpm
+
+    def _quota_wait(self, model: str, est_tokens: int, now: float) -> float:
+        """Seconds until `model` may take a call of `est_tokens` (pause, RPM and TPM buckets)."""
+        rpm, tpm = self._buckets(model)
+        return max(
+            self._paused_until.get(model, 0.0) - now,
+            rpm.wait_time(1, now) if rpm else 0.0,
+            tpm.wait_time(est_tokens, now) if tpm else 0.0,
+        )
+
+    def _earlier_ready(self, model: str, ticket: tuple, now: float) -> bool:
+        """True if another model's queue head is ahead of `ticket` and could go now."""
+        for other, queue in self._waiting.items():
+            if other != model and queue and queue[0][:2] < ticket[:2]:
+                if self._quota_wait(other, queue[0][2], now) <= 0:
+                    return True
+        return False
+
+    def acquire(self, model: str, est_tokens: int, priority: int = BULK, timeout: Optional[float] = None) -> None:
+        """
+        Blocks until this call may be sent to the provider. Raises TimeoutError
+        if that takes longer than `timeout` seconds.
+        """
+        ticket = (priority, next(self._seq), est_tokens)
+        start = time.monotonic()
+        with self._cond:
+            queue = self._waiting.setdefault(model, [])
+            heapq.heappush(queue, ticket)
+            admitted = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    if timeout is not None and now - start >= timeout:
+                        raise TimeoutError(f"Timed out after {timeout:.1f}s waiting for an LLM slot ({model})")
+                    wait = None
+                    if queue[0] == ticket and self._active < self.max_concurrency:
+                        wait = self._quota_wait(model, est_tokens, now)
+                        # Concurrency slots go to the earliest call whose model can take it
+                        if wait <= 0 and not self._earlier_ready(model, ticket, now):
+                            rpm, tpm = self._buckets(model)
+                            if rpm:
+                                rpm.take(1)
+                            if tpm:
+                                tpm.take(est_tokens)
+                            heapq.heappop(queue)
+                            self._active += 1
+                            admitted = True
+                            break
+                        wait = wait if wait > 0 else None
+                    if timeout is not None:
+                        left = timeout - (now - start)
+                        wait = left if wait is None else min(wait, left)
+                    self._cond.wait(timeout=wait)
+            finally:
+                if not admitted:
+                    # Timed out or interrupted: don't leave the ticket blocking the queue
+                    queue.remove(ticket)
+                    heapq.heapify(queue)
+                # The next waiter may now be at the head of a queue
+                self._cond.notify_all()
+        LLM_GOVERNOR_WAIT.labels(priority=PRIORITY_NAMES.get(priority, str(priority))).observe(time.monotonic() - start)
+        LLM_IN_FLIGHT.inc()
+
+    def release(self, model: str, est_tokens: int, actual_tokens: Optional[int] = None) -> None:
+        with self._cond:
+            self._active -= 1
+            if actual_tokens is not None:
+                _, tpm = self._buckets(model)
+                if tpm:
+                    tpm.adjust(actual_tokens - est_tokens)
+            self._cond.notify_all()
+        LLM_IN_FLIGHT.dec()
+
+    def pause(self, model: str, seconds: float) -> None:
+        """Holds back every new call to `model` for `seconds` (provider asked us to back off)."""
+        with self._cond:
+            until = time.monotonic() + seconds
+            self._paused_until[model] = max(self._paused_until.get(model, 0.0), until)
+            self._cond.notify_all()
+
+
+def retry_after_seconds(exc: Exception) -> Optional[float]:
+    """Reads retry-after from a provider error response, if present."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def is_rate_limited(exc: Exception) -> bool:
+    return getattr(exc, "status_code", None) == 429
+
+
+def is_retryable(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Exponential backoff with full jitter, never shorter than the provider's retry-after."""
+    ceiling = min(LLM_BACKOFF_MAX_S, LLM_BACKOFF_BASE_S * (2 ** attempt))
+    jitter = random.uniform(0, ceiling)
+    return (retry_after or 0.0) + jitter
+
+
+_governor = LLMGovernor()
+
+
+def get_governor() -> LLMGovernor:
+    return _governor
@@ -1,24 +1,332 @@
+import json
 import os
-from langchain_groq import ChatGroq
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+from utils.llm_governor import (
+    BULK, LLM_MAX_CONCURRENCY, LLM_MAX_RETRIES, backoff_delay, get_governor, is_rate_limited, is_retryable, retry_after_seconds,
+)
+from utils.metrics import (
+    LLM_ABANDONED_CALLS, LLM_CALL_DURATION, LLM_CALL_ERRORS, LLM_HEDGES, LLM_RETRIES, record_llm_usage,
+)
+from utils.token_utils import estimate_tokens
 
-def get_llm():
+# Completion size assumed when reserving tokens-per-minute budget before a call
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "600"))
+# Upper bound on a single provider request, for calls made without a deadline (0 = none)
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+
+# Set by benchmarks/tests to run the graph against a local fake model
+_llm_override = None
+
+
+def set_llm_override(llm) -> None:
+    """Makes get_llm() return `llm` instead of a ChatGroq client (None restores the default)."""
+    global _llm_override
+    _llm_override = llm
+
+
+@lru_cache(maxsize=1)
+def load_llm_config() -> dict:
+    """
+    Per-node model tiering and hedging settings from configs/llm_models.json.
+    LLM_MODEL_<NODE> (e.g. LLM_MODEL_RECOMMENDATIONS) overrides a node's model
+    and LLM_HEDGING=1/0 overrides hedging.enabled.
+    """
+    p = Path(__file__).resolve().parents[1] / "configs" / "llm_models.json"
+    config = json.loads(p.read_text()) if p.exists() else {}
+    config.setdefault("default", "openai/gpt-oss-120b")
+    config.setdefault("nodes", {})
+    config.setdefault("fallbacks", {})
+    config.setdefault("hedging", {})
+    if os.getenv("LLM_HEDGING") is not None:
+        config["hedging"]["enabled"] = os.getenv("LLM_HEDGING") == "1"
+    return config
+
+
+def model_for_node(node: Optional[str]) -> str:
+    config = load_llm_config()
+    if node:
+        env_model = os.getenv(f"LLM_MODEL_{node.upper()}")
+        if env_model:
+            return env_model
+        return config["nodes"].get(node, config["default"])
+    return config["default"]
+
+
+@lru_cache(maxsize=None)
+def _chat_model(model: str):
+    """One ChatGroq client per model, shared across requests (keeps HTTP connections warm)."""
+    from langchain_groq import ChatGroq
+
+    return ChatGroq(
+        model=model,
+        temperature=0,
+        max_tokens=None,
+        timeout=LLM_TIMEOUT_S or None,
+        # Retries are handled by invoke_llm() so they respect the shared rate limits
+        max_retries=0,
+    )
+
+
+def get_llm(node: Optional[str] = None):
     """
-    Returns a configured ChatGroq instance.
-    Defaults to 'openai/gpt-oss-120b' or similar high-performing model on Groq.
+    Returns the ChatGroq client configured for `node` (see configs/llm_models.json).
+    Without a node, returns the default 'openai/gpt-oss-120b' model.
     """
+    if _llm_override is not None:
+        return _llm_override
+
     api_key = os.environ.get("GROQ_API_KEY")
     if not api_key:
         # Fallback for dev/demo if key is missing, though this will likely fail execution if called.
         # We'll allow it to return None or raise handling upstream, 
         # but for now let's assume the user will provide it.
         pass
-    
-    return ChatGroq(
-        # User requested "openai/gpt-oss-120b", mapping to strongest available OSS model on Groq: openai/gpt-oss-120b
-        model="openai/gpt-oss-120b",
-        temperature=0,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2,
-        # other params...
-    )
+
+    return _chat_model(model_for_node(node))
+
+
+def get_fallback_llm(llm):
+    """Model to hedge `llm` with: the configured fallback, or the same model."""
+    config = load_llm_config()
+    if _llm_override is not None or not config["hedging"].get("use_fallback_model", True):
+        return llm
+    fallback = config["fallbacks"].get(getattr(llm, "model_name", None))
+    return _chat_model(fallback) if fallback else llm
+
+
+def _prompt_text(prompt) -> str:
+    if isinstance(prompt, str):
+        return prompt
+    if isinstance(prompt, (list, tuple)):
+        return "\n".join(str(getattr(m, "content", m)) for m in prompt)
+    return str(prompt)
+
+
+def _total_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage_metadata", None) or {}
+    return usage.get("total_tokens")
+
+
+def _usage_record(model: str, node: str, prompt, response, elapsed: float) -> dict:
+    """One entry of ReportState.llm_usage; falls back to estimates when the provider reports no usage."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens")
+    completion_tokens = usage.get("output_tokens")
+    estimated = prompt_tokens is None or completion_tokens is None
+    if prompt_tokens is None:
+        prompt_tokens = estimate_tokens(_prompt_text(prompt))
+    if completion_tokens is None:
+        completion_tokens = estimate_tokens(getattr(response, "content", response))
+    # Prompt tokens the provider served from its prefix cache, when it reports them
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read") or 0
+    print(f"LLM call {node} ({model}): {prompt_tokens} prompt ({cached_tokens} cached) + {completion_tokens} "
+          f"completion tokens in {elapsed:.2f}s{' (estimated)' if estimated else ''}")
+    return {
+        "node": node, "model": model, "prompt": getattr(prompt, "key", None), "prompt_tokens": prompt_tokens,
+        "cached_prompt_tokens": cached_tokens, "completion_tokens": completion_tokens,
+        "latency_s": round(elapsed, 3), "estimated": estimated,
+    }
+
+
+def _abandon(future, call_usage: list, usage: Optional[list], model: str, node: str, prompt, started: float) -> None:
+    """
+    Accounts for a call whose answer will not be used (a hedge loser, a call
+    past its deadline). Its prompt was sent, so it still costs tokens: its
+    usage records, or an estimate while it is still running, are added to
+    `usage` flagged "abandoned", so llm_usage and the token budget include them.
+    """
+    if future.done() and future.exception() is not None:
+        return
+    LLM_ABANDONED_CALLS.labels(model=model, node=node).inc()
+    if usage is None:
+        return
+    if future.done():
+        records = [dict(record, abandoned=True) for record in call_usage]
+    else:
+        records = [{
+            "node": node, "model": model, "prompt": getattr(prompt, "key", None),
+            "prompt_tokens": estimate_tokens(_prompt_text(prompt)), "cached_prompt_tokens": 0,
+            "completion_tokens": LLM_EXPECTED_COMPLETION_TOKENS,
+            "latency_s": round(time.perf_counter() - started, 3), "estimated": True, "abandoned": True,
+        }]
+    print(f"Abandoned LLM call {node} ({model}): counting "
+          f"{sum(r['prompt_tokens'] + r['completion_tokens'] for r in records)} tokens")
+    usage.extend(records)
+
+
+class _LatencyTracker:
+    """Rolling window of successful call latencies per model, used to pick hedge deadlines."""
+
+    def __init__(self, window: int = 200):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[model].append(seconds)
+
+    def quantile(self, model: str, q: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples[model])
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+_latencies = _LatencyTracker()
+_hedge_pool = ThreadPoolExecutor(max_workers=max(4, LLM_MAX_CONCURRENCY * 2), thread_name_prefix="llm-hedge")
+
+
+def _hedge_delay(model: str) -> float:
+    hedging = load_llm_config()["hedging"]
+    observed = _latencies.quantile(model, hedging.get("quantile", 0.95), hedging.get("min_samples", 20))
+    delay = observed if observed is not None else hedging.get("default_delay_s", 15.0)
+    return min(max(delay, hedging.get("min_delay_s", 2.0)), hedging.get("max_delay_s", 45.0))
+
+
+def _time_left(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _invoke_with_retries(llm, prompt, node: str, priority: int, usage: Optional[list] = None,
+                         deadline: Optional[float] = None):
+    model = getattr(llm, "model_name", None) or type(llm).__name__
+    governor = get_governor()
+    est_tokens = estimate_tokens(_prompt_text(prompt)) + LLM_EXPECTED_COMPLETION_TOKENS
+
+    attempt = 0
+    while True:
+        left = _time_left(deadline)
+        if left is not None and left <= 0:
+            raise TimeoutError(f"LLM call for {node} ran out of time")
+        governor.acquire(model, est_tokens, priority, timeout=left)
+        start = time.perf_counter()
+        try:
+            left = _time_left(deadline)
+            # The provider request may only use what is left of the deadline
+            response = llm.invoke(prompt) if left is None else llm.invoke(prompt, timeout=max(left, 0.1))
+        except Exception as e:
+            LLM_CALL_DURATION.labels(model=model, node=node).observe(time.perf_counter() - start)
+            LLM_CALL_ERRORS.labels(model=model, node=node).inc()
+            governor.release(model, est_tokens)
+            if attempt >= LLM_MAX_RETRIES or not is_retryable(e):
+                raise
+            retry_after = retry_after_seconds(e)
+            delay = backoff_delay(attempt, retry_after)
+            left = _time_left(deadline)
+            if left is not None and delay >= left:
+                raise
+            if is_rate_limited(e):
+                # Everyone backs off, not just this caller
+                governor.pause(model, retry_after if retry_after is not None else delay)
+            LLM_RETRIES.labels(model=model, reason=str(getattr(e, "status_code", None) or type(e).__name__)).inc()
+            attempt += 1
+            time.sleep(delay)
+            continue
+
+        elapsed = time.perf_counter() - start
+        LLM_CALL_DURATION.labels(model=model, node=node).observe(elapsed)
+        _latencies.observe(model, elapsed)
+        governor.release(model, est_tokens, _total_tokens(response))
+        record_llm_usage(model, node, response)
+        if usage is not None:
+            usage.append(_usage_record(model, node, prompt, response, elapsed))
+        return response
+
+
+def _invoke_hedged(llm, prompt, node: str, priority: int, usage: Optional[list] = None,
+                   deadline: Optional[float] = None):
+    """
+    Sends the call, and if it hasn't returned by the model's p95-based deadline
+    sends a second one (to the fallback model if configured). The first
+    successful response wins; the straggler finishes in the background and
+    is discarded.
+    """
+    model = getattr(llm, "model_name", None) or type(llm).__name__
+    started = time.perf_counter()
+    # Each call records into its own list; the caller's usage gets the winner's
+    # records, and the others are accounted for by _abandon()
+    primary_usage, hedge_usage = [], []
+    primary = _hedge_pool.submit(_invoke_with_retries, llm, prompt, node, priority, primary_usage, deadline)
+    hedge_delay = _hedge_delay(model)
+    left = _time_left(deadline)
+    done, _ = wait([primary], timeout=hedge_delay if left is None else min(hedge_delay, left))
+    if done:
+        if usage is not None:
+            usage.extend(primary_usage)
+        return primary.result()
+    if left is not None and left <= hedge_delay:
+        _abandon(primary, primary_usage, usage, model, node, prompt, started)
+        raise TimeoutError(f"LLM call for {node} ran out of time")
+
+    hedge_llm = get_fallback_llm(llm)
+    hedge_model = getattr(hedge_llm, "model_name", None) or type(hedge_llm).__name__
+    LLM_HEDGES.labels(model=hedge_model, outcome="launched").inc()
+    hedge = _hedge_pool.submit(_invoke_with_retries, hedge_llm, prompt, node, priority, hedge_usage, deadline)
+
+    calls = {primary: (model, primary_usage), hedge: (hedge_model, hedge_usage)}
+    pending = set(calls)
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=_time_left(deadline), return_when=FIRST_COMPLETED)
+        if not done:
+            for future in pending:
+                _abandon(future, calls[future][1], usage, calls[future][0], node, prompt, started)
+            raise TimeoutError(f"LLM call for {node} ran out of time")
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    LLM_HEDGES.labels(model=hedge_model, outcome="won").inc()
+                for other, (other_model, other_usage) in calls.items():
+                    if other is not future:
+                        _abandon(other, other_usage, usage, other_model, node, prompt, started)
+                if usage is not None:
+                    usage.extend(calls[future][1])
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def invoke_llm(llm, prompt, node: str = "unknown", priority: int = BULK, usage: Optional[list] = None,
+               timeout: Optional[float] = None):
+    """
+    Invokes the LLM through the process-wide governor and records latency and
+    token usage for the calling node. All LLM calls should go through here so
+    that rate limits are respected and /metrics sees them.
+
+    Retryable provider errors (429, 5xx, timeouts) are retried here with
+    jittered exponential backoff that honours retry-after; the clients
+    themselves are built with max_retries=0. With hedging enabled in
+    configs/llm_models.json, slow calls are hedged (see _invoke_hedged).
+
+    Pass a list as `usage` to get one record (node, model, tokens, latency)
+    appended per completed call; nodes return these as ReportState.llm_usage.
+    Calls whose answer is not used (hedge losers, calls cut off by `timeout`)
+    are added too, flagged "abandoned".
+
+    `timeout` bounds the whole call in seconds, including waits for the
+    governor, retries and hedges; TimeoutError is raised when it runs out.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    if load_llm_config()["hedging"].get("enabled"):
+        return _invoke_hedged(llm, prompt, node, priority, usage, deadline)
+    if deadline is None:
+        return _invoke_with_retries(llm, prompt, node, priority, usage)
+    # Enforced here too, in case the client does not honour its timeout argument
+    started = time.perf_counter()
+    call_usage = []
+    future = _hedge_pool.submit(_invoke_with_retries, llm, prompt, node, priority, call_usage, deadline)
+    done, _ = wait([future], timeout=max(timeout, 0.0))
+    if not done:
+        model = getattr(llm, "model_name", None) or type(llm).__name__
+        _abandon(future, call_usage, usage, model, node, prompt, started)
+        raise TimeoutError(f"LLM call for {node} ran out of time")
+    if usage is not None:
+        usage.extend(call_usage)
+    return future.result()
@@ -0,0 +1,91 @@
+"""
+Per-patient history of validated parameter values.
+
+One row per (patient, parameter, report date, run) in a SQLite table
+clustered on (patient_id, param, report_date), so a patient's time series for
+any parameter is a single index range scan. Rows for a run are replaced when
+that run is recomputed (e.g. after a correction), never duplicated.
+"""
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+LONGITUDINAL_DB_PATH = os.getenv("LONGITUDINAL_DB_PATH", "brain_storage/longitudinal.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS param_values (
+    patient_id  TEXT NOT NULL,
+    param       TEXT NOT NULL,
+    report_date TEXT NOT NULL,
+    run_id      TEXT NOT NULL,
+    value       REAL,
+    unit        TEXT,
+    flag        TEXT,
+    PRIMARY KEY (patient_id, param, report_date, run_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS param_values_run ON param_values (run_id);
+"""
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _connection() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        Path(LONGITUDINAL_DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(LONGITUDINAL_DB_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _conn = conn
+    return _conn
+
+
+def record_values(patient_id: str, report_date: str, run_id: str, validated_params: Dict[str, Dict[str, Any]]) -> int:
+    """Stores (or replaces) one report's validated values; returns the number of rows written."""
+    rows = [
+        (patient_id, name, report_date, run_id, info.get("value"), info.get("unit"), info.get("flag"))
+        for name, info in validated_params.items()
+    ]
+    with _lock:
+        conn = _connection()
+        with conn:
+            conn.execute("DELETE FROM param_values WHERE run_id = ?", (run_id,))
+            conn.executemany("INSERT INTO param_values VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    return len(rows)
+
+
+def get_trends(patient_id: str, params: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Time series per parameter for a patient, oldest first. Each point carries
+    the change from the previous report; each series carries the change from
+    the first to the latest report.
+    """
+    query = "SELECT param, report_date, run_id, value, unit, flag FROM param_values WHERE patient_id = ?"
+    args: List[Any] = [patient_id]
+    params = list(params or [])
+    if params:
+        query += f" AND param IN ({', '.join('?' * len(params))})"
+        args += params
+    query += " ORDER BY param, report_date, run_id"
+
+    with _lock:
+        rows = _connection().execute(query, args).fetchall()
+
+    trends: Dict[str, Dict[str, Any]] = {}
+    for param, report_date, run_id, value, unit, flag in rows:
+        series = trends.setdefault(param, {"points": []})["points"]
+        previous = series[-1]["value"] if series else None
+        delta = round(value - previous, 4) if value is not None and previous is not None else None
+        series.append({
+            "date": report_date, "run_id": run_id, "value": value, "unit": unit, "flag": flag, "delta": delta,
+        })
+
+    for trend in trends.values():
+        points = trend["points"]
+        first, last = points[0]["value"], points[-1]["value"]
+        trend["latest"] = last
+        trend["change"] = round(last - first, 4) if first is not None and last is not None else None
+    return trends
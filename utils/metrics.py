@@ -0,0 +1,201 @@
+"""
+Prometheus metrics shared by the API, the graph nodes and the RAG layer.
+
+Everything is registered on the default prometheus_client registry and
+exposed by the FastAPI app at /metrics.
+"""
+import functools
+from typing import Any, Callable
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# LLM calls and graph nodes take seconds, not milliseconds, so the default
+# prometheus buckets are too fine at the low end and too short at the top.
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120, float("inf"))
+FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+NODE_DURATION = Histogram(
+    "graph_node_duration_seconds",
+    "Time spent in each LangGraph node",
+    ["node"],
+    buckets=SLOW_BUCKETS,
+)
+PIPELINE_DURATION = Histogram(
+    "pipeline_duration_seconds",
+    "End-to-end time of run_full_pipeline (analysis + RAG indexing)",
+    buckets=SLOW_BUCKETS,
+)
+
+LLM_CALL_DURATION = Histogram(
+    "llm_call_duration_seconds",
+    "Latency of individual LLM calls",
+    ["model", "node"],
+    buckets=SLOW_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens reported by the LLM provider",
+    ["model", "node", "kind"],
+)
+LLM_INPUT_TRIMMED = Counter(
+    "llm_input_trimmed_total",
+    "LLM inputs trimmed to fit a per-node or per-request token budget",
+    ["node"],
+)
+DEADLINE_SKIPPED_STAGES = Counter(
+    "deadline_skipped_stages_total",
+    "Pipeline stages skipped or cut off because of the request deadline",
+    ["node"],
+)
+STRUCTURED_OUTPUT_PARSES = Counter(
+    "structured_output_parses_total",
+    "Structured LLM outputs by parse result (clean/repaired/truncated/llm_fixed/failed)",
+    ["node", "result"],
+)
+LLM_CALL_ERRORS = Counter(
+    "llm_call_errors_total",
+    "LLM calls that raised an exception",
+    ["model", "node"],
+)
+LLM_RETRIES = Counter(
+    "llm_retries_total",
+    "LLM calls retried by the governor, by reason",
+    ["model", "reason"],
+)
+LLM_HEDGES = Counter(
+    "llm_hedged_requests_total",
+    "Hedge requests launched for slow LLM calls, and how many of them won",
+    ["model", "outcome"],
+)
+LLM_ABANDONED_CALLS = Counter(
+    "llm_abandoned_calls_total",
+    "LLM calls whose answer was not used (hedge losers, calls past their deadline)",
+    ["model", "node"],
+)
+LLM_GOVERNOR_WAIT = Histogram(
+    "llm_governor_wait_seconds",
+    "Time LLM calls waited for a concurrency slot / rate-limit budget",
+    ["priority"],
+    buckets=FAST_BUCKETS,
+)
+LLM_IN_FLIGHT = Gauge("llm_requests_in_flight", "LLM calls currently sent to the provider")
+
+OCR_PAGES = Counter("ocr_pages_total", "Pages (or images) sent through OCR")
+OCR_DURATION = Histogram(
+    "ocr_duration_seconds",
+    "Time spent in OCR per document, including image preprocessing",
+    buckets=SLOW_BUCKETS,
+)
+OCR_TILES = Counter("ocr_tiles_total", "Strips OCR'd separately because the page exceeded OCR_TILE_PIXELS")
+OCR_REFINED_WORDS = Counter(
+    "ocr_refined_words_total",
+    "Low-confidence OCR words re-read from an upscaled crop, by outcome (replaced/kept)",
+    ["outcome"],
+)
+
+EMBEDDING_DURATION = Histogram(
+    "embedding_duration_seconds",
+    "Time spent computing embeddings",
+    ["operation"],
+    buckets=FAST_BUCKETS,
+)
+EMBEDDING_TEXTS = Counter("embedding_texts_total", "Texts embedded", ["operation"])
+EMBEDDING_CACHE_TEXTS = Counter(
+    "embedding_cache_texts_total",
+    "Document chunks looked up in the on-disk embedding cache, by result (hit/miss)",
+    ["result"],
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "embedding_batch_size",
+    "Texts per forward pass of the embedding model (after micro-batching)",
+    ["operation"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, float("inf")),
+)
+VECTOR_NAMESPACES = Gauge(
+    "vector_store_namespaces",
+    "Report namespaces currently registered in the vector store",
+)
+NAMESPACE_GC_DELETED = Counter(
+    "vector_store_namespaces_deleted_total",
+    "Expired report namespaces deleted by the background collector",
+)
+VECTOR_STORE_DURATION = Histogram(
+    "vector_store_duration_seconds",
+    "Vector store operations (index = embed + upsert, query = embed + search)",
+    ["operation"],
+    buckets=FAST_BUCKETS,
+)
+
+EXTRACTION_METHOD = Counter("extraction_method_total", "Parameter extractions by method (layout/llm)", ["method"])
+ANALYSIS_PATH = Counter("analysis_path_total", "Reports routed to the fast (templated) or full LLM path", ["path"])
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache lookups by cache and result (hit/miss)",
+    ["cache", "result"],
+)
+
+RAG_RETRIEVALS = Counter(
+    "rag_retrievals_total",
+    "Chat retrievals by mode (filtered to named parameters, or plain top-k)",
+    ["mode"],
+)
+RAG_CONTEXT_TOKENS = Histogram(
+    "rag_context_tokens",
+    "Estimated tokens of retrieved report text added to each chat prompt",
+    buckets=[50, 100, 200, 400, 800, 1600, 3200],
+)
+
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests currently being handled",
+    ["path"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency",
+    ["method", "path", "status"],
+    buckets=SLOW_BUCKETS,
+)
+REQUEST_PEAK_MEMORY = Histogram(
+    "http_request_peak_rss_bytes",
+    "Peak process RSS while handling document-processing requests",
+    ["path"],
+    buckets=[mb * 1024 * 1024 for mb in (128, 256, 384, 512, 768, 1024, 1536, 2048, 4096)],
+)
+
+
+def timed_node(name: str, fn: Callable) -> Callable:
+    """Wraps a graph node so its duration is recorded under `name`."""
+    @functools.wraps(fn)
+    def wrapper(state):
+        with NODE_DURATION.labels(node=name).time():
+            return fn(state)
+    return wrapper
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def record_llm_usage(model: str, node: str, response: Any) -> None:
+    """Records prompt/completion tokens from a LangChain chat response, if reported."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens")
+    completion_tokens = usage.get("output_tokens")
+
+    if prompt_tokens is None:
+        # Older langchain-groq versions only fill response_metadata
+        token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+        prompt_tokens = token_usage.get("prompt_tokens")
+        completion_tokens = token_usage.get("completion_tokens")
+
+    if prompt_tokens:
+        LLM_TOKENS.labels(model=model, node=node, kind="prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(model=model, node=node, kind="completion").inc(completion_tokens)
+
+
+def render_metrics():
+    """Returns (body, content_type) for the /metrics endpoint."""
+    return generate_latest(), CONTENT_TYPE_LATEST
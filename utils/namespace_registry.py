@@ -0,0 +1,224 @@
+"""
+Local registry of the vector-store namespaces created for reports.
+
+Every indexed report gets a namespace in the shared Pinecone index. The
+registry (SQLite, NAMESPACE_DB_PATH) records when each one was created, when
+it was last chatted with, the session it belongs to and a hash of the indexed
+content, so that:
+
+- an identical upload reuses the existing namespace instead of re-embedding,
+- a background collector deletes namespaces idle for longer than
+  NAMESPACE_TTL_HOURS, NAMESPACE_GC_BATCH at a time every
+  NAMESPACE_GC_INTERVAL_S seconds.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from utils.metrics import NAMESPACE_GC_DELETED, VECTOR_NAMESPACES
+
+NAMESPACE_DB_PATH = os.getenv("NAMESPACE_DB_PATH", "brain_storage/namespaces.sqlite")
+NAMESPACE_TTL_HOURS = float(os.getenv("NAMESPACE_TTL_HOURS", "24"))
+NAMESPACE_GC_INTERVAL_S = float(os.getenv("NAMESPACE_GC_INTERVAL_S", "600"))
+NAMESPACE_GC_BATCH = int(os.getenv("NAMESPACE_GC_BATCH", "50"))
+NAMESPACE_REUSE = os.getenv("NAMESPACE_REUSE", "1") == "1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS namespaces (
+    namespace    TEXT PRIMARY KEY,
+    content_hash TEXT,
+    session_id   TEXT,
+    created_at   REAL NOT NULL,
+    last_chat_at REAL,
+    last_used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS namespaces_content ON namespaces (content_hash);
+CREATE INDEX IF NOT EXISTS namespaces_last_used ON namespaces (last_used_at);
+"""
+
+_conn = None
+_lock = threading.Lock()
+_collector = None
+
+
+def _connection() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        Path(NAMESPACE_DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(NAMESPACE_DB_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _conn = conn
+        VECTOR_NAMESPACES.set(conn.execute("SELECT COUNT(*) FROM namespaces").fetchone()[0])
+    return _conn
+
+
+def content_hash(text: str, *salt: str) -> str:
+    """Hash of the indexed text plus anything else that changes the vectors (model, chunking)."""
+    digest = hashlib.sha256()
+    for part in (*salt, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def find_by_content(content_hash: str) -> Optional[str]:
+    """
+    Most recently used live namespace holding this content, or None. The
+    namespace is marked as used in the same locked transaction, so the
+    collector cannot delete it between the lookup and its reuse.
+    """
+    if not NAMESPACE_REUSE:
+        return None
+    with _lock:
+        conn = _connection()
+        with conn:
+            row = conn.execute(
+                "SELECT namespace FROM namespaces WHERE content_hash = ? ORDER BY last_used_at DESC LIMIT 1",
+                (content_hash,),
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE namespaces SET last_used_at = ? WHERE namespace = ?", (time.time(), row[0]))
+    return row[0] if row else None
+
+
+def register(namespace: str, content_hash: Optional[str] = None, session_id: Optional[str] = None) -> None:
+    now = time.time()
+    with _lock:
+        conn = _connection()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO namespaces (namespace, content_hash, session_id, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (namespace, content_hash, session_id, now, now),
+            )
+        VECTOR_NAMESPACES.set(conn.execute("SELECT COUNT(*) FROM namespaces").fetchone()[0])
+
+
+def touch(namespace: str, session_id: Optional[str] = None, chat: bool = False) -> None:
+    """Marks a namespace as in use (re-uploaded, attached to a session or chatted with), resetting its TTL."""
+    if not namespace:
+        return
+    now = time.time()
+    with _lock:
+        conn = _connection()
+        with conn:
+            conn.execute(
+                "UPDATE namespaces SET last_used_at = ?, session_id = COALESCE(?, session_id), "
+                "last_chat_at = CASE WHEN ? THEN ? ELSE last_chat_at END WHERE namespace = ?",
+                (now, session_id, chat, now, namespace),
+            )
+
+
+def is_live(namespace: str) -> bool:
+    with _lock:
+        row = _connection().execute("SELECT 1 FROM namespaces WHERE namespace = ?", (namespace,)).fetchone()
+    return row is not None
+
+
+def expired(ttl_s: float, limit: int) -> List[str]:
+    """Oldest namespaces idle for longer than ttl_s, at most `limit`."""
+    with _lock:
+        rows = _connection().execute(
+            "SELECT namespace FROM namespaces WHERE last_used_at < ? ORDER BY last_used_at LIMIT ?",
+            (time.time() - ttl_s, limit),
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def _claim(namespace: str, cutoff: float) -> Optional[tuple]:
+    """
+    Removes a namespace from the registry if it is still idle since before
+    `cutoff` (it may have been reused since it was listed). Returns the row,
+    for _restore() if the vector store deletion fails, or None if it is in use.
+    """
+    with _lock:
+        conn = _connection()
+        with conn:
+            row = conn.execute(
+                "SELECT namespace, content_hash, session_id, created_at, last_chat_at, last_used_at "
+                "FROM namespaces WHERE namespace = ? AND last_used_at < ?",
+                (namespace, cutoff),
+            ).fetchone()
+            if row:
+                conn.execute("DELETE FROM namespaces WHERE namespace = ?", (namespace,))
+    return row
+
+
+def _restore(row: tuple) -> None:
+    with _lock:
+        conn = _connection()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO namespaces (namespace, content_hash, session_id, created_at, last_chat_at, "
+                "last_used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                row,
+            )
+
+
+def forget(namespaces: List[str]) -> None:
+    if not namespaces:
+        return
+    with _lock:
+        conn = _connection()
+        with conn:
+            conn.executemany("DELETE FROM namespaces WHERE namespace = ?", [(ns,) for ns in namespaces])
+        VECTOR_NAMESPACES.set(conn.execute("SELECT COUNT(*) FROM namespaces").fetchone()[0])
+
+
+def collect_expired(delete_namespace: Callable[[str], None], ttl_s: Optional[float] = None,
+                    batch: int = NAMESPACE_GC_BATCH) -> int:
+    """
+    Deletes one batch of expired namespaces from the vector store and the
+    registry. Each namespace is taken out of the registry first, and only if
+    it is still idle, so a concurrent reuse (find_by_content, touch) is never
+    deleted. Namespaces whose deletion fails are registered again and retried
+    on the next pass. Returns how many were deleted.
+    """
+    ttl_s = NAMESPACE_TTL_HOURS * 3600 if ttl_s is None else ttl_s
+    cutoff = time.time() - ttl_s
+    deleted = []
+    for namespace in expired(ttl_s, batch):
+        row = _claim(namespace, cutoff)
+        if row is None:
+            continue
+        try:
+            delete_namespace(namespace)
+            deleted.append(namespace)
+        except Exception as e:
+            _restore(row)
+            print(f"Namespace GC: could not delete '{namespace}': {e}")
+    with _lock:
+        VECTOR_NAMESPACES.set(_connection().execute("SELECT COUNT(*) FROM namespaces").fetchone()[0])
+    NAMESPACE_GC_DELETED.inc(len(deleted))
+    if deleted:
+        print(f"Namespace GC: deleted {len(deleted)} expired namespace(s)")
+    return len(deleted)
+
+
+def _collect_forever(delete_namespace: Callable[[str], None]) -> None:
+    while True:
+        try:
+            # Drain a backlog in consecutive batches, then sleep
+            while collect_expired(delete_namespace) == NAMESPACE_GC_BATCH:
+                pass
+        except Exception as e:
+            print(f"Namespace GC failed: {e}")
+        time.sleep(NAMESPACE_GC_INTERVAL_S)
+
+
+def start_collector(delete_namespace: Callable[[str], None]) -> None:
+    """Starts the background collector once per process (NAMESPACE_TTL_HOURS=0 disables it)."""
+    global _collector
+    if NAMESPACE_TTL_HOURS <= 0 or _collector is not None:
+        return
+    with _lock:
+        if _collector is None:
+            _collector = threading.Thread(
+                target=_collect_forever, args=(delete_namespace,), name="namespace-gc", daemon=True
+            )
+            _collector.start()
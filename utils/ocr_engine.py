@@ -0,0 +1,230 @@
+"""
+Tesseract OCR engine, detected and configured once per process.
+
+Two backends, chosen at first use:
+
+- "tesserocr": a pool of OCR_WORKERS long-lived in-process Tesseract API
+  instances (tesserocr releases the GIL while recognising, so threads run in
+  parallel). No process spawn and no temp files per page.
+- "cli": the tesseract binary, resolved once. Images are piped through
+  stdin/stdout as uncompressed PNM, so there are no temp files. Concurrent
+  calls are capped at OCR_WORKERS.
+
+Configuration: OCR_LANG (e.g. "eng+hin"), OCR_PSM, OCR_OEM, and OCR_MODEL
+("fast", "best" or "default"), which picks TESSDATA_FAST_DIR /
+TESSDATA_BEST_DIR. OCR_TESSDATA_DIR overrides the model directory.
+OCR_ENGINE forces "tesserocr" or "cli".
+"""
+import csv
+import io
+import os
+import queue
+import shutil
+import subprocess
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto").lower()
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_PSM = int(os.getenv("OCR_PSM", "3"))
+OCR_OEM = int(os.getenv("OCR_OEM", "3"))
+OCR_MODEL = os.getenv("OCR_MODEL", "default").lower()
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+OCR_TIMEOUT_S = float(os.getenv("OCR_TIMEOUT_S", "120"))
+
+WINDOWS_TESSERACT_PATH = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+
+
+def parse_tsv(tsv: str) -> List[Dict[str, Any]]:
+    """Word rows (level 5) of Tesseract's TSV output, in reading order."""
+    words = []
+    reader = csv.DictReader(io.StringIO(tsv), delimiter="\t", quoting=csv.QUOTE_NONE)
+    for row in reader:
+        if row.get("level") != "5" or not (row.get("text") or "").strip():
+            continue
+        words.append({
+            "block": int(row["block_num"]), "par": int(row["par_num"]), "line": int(row["line_num"]),
+            "left": int(row["left"]), "top": int(row["top"]),
+            "width": int(row["width"]), "height": int(row["height"]),
+            "conf": float(row["conf"]), "text": row["text"],
+        })
+    return words
+
+
+def words_to_text(words: List[Dict[str, Any]]) -> str:
+    """Rebuilds page text from TSV words: one line per Tesseract line, a blank line between blocks."""
+    lines: List[str] = []
+    current = None
+    for word in words:
+        key = (word["block"], word["par"], word["line"])
+        if key != current:
+            if current is not None and key[:2] != current[:2]:
+                lines.append("")
+            lines.append(word["text"])
+            current = key
+        else:
+            lines[-1] += " " + word["text"]
+    return "\n".join(lines) + "\n"
+
+
+def tessdata_dir() -> Optional[str]:
+    """Model directory for the configured OCR_MODEL, or None for Tesseract's default."""
+    explicit = os.getenv("OCR_TESSDATA_DIR")
+    if explicit:
+        return explicit
+    if OCR_MODEL == "fast":
+        return os.getenv("TESSDATA_FAST_DIR")
+    if OCR_MODEL == "best":
+        return os.getenv("TESSDATA_BEST_DIR")
+    return None
+
+
+class TesserocrEngine:
+    name = "tesserocr"
+
+    def __init__(self, workers: int = OCR_WORKERS):
+        import tesserocr
+
+        self.version = tesserocr.tesseract_version().splitlines()[0]
+        self._pool: "queue.Queue" = queue.Queue()
+        kwargs = {"lang": OCR_LANG, "psm": OCR_PSM, "oem": OCR_OEM}
+        path = tessdata_dir()
+        if path:
+            kwargs["path"] = path
+        for _ in range(max(1, workers)):
+            self._pool.put(tesserocr.PyTessBaseAPI(**kwargs))
+
+    @contextmanager
+    def _api(self):
+        api = self._pool.get()
+        try:
+            yield api
+        finally:
+            api.Clear()
+            self._pool.put(api)
+
+    @contextmanager
+    def _configured(self, psm: Optional[int], whitelist: Optional[str]):
+        with self._api() as api:
+            if psm is not None:
+                api.SetPageSegMode(psm)
+            if whitelist:
+                api.SetVariable("tessedit_char_whitelist", whitelist)
+            try:
+                yield api
+            finally:
+                # Instances are shared; restore the defaults
+                api.SetPageSegMode(OCR_PSM)
+                if whitelist:
+                    api.SetVariable("tessedit_char_whitelist", "")
+
+    def image_to_string(self, img: Image.Image, psm: Optional[int] = None, whitelist: Optional[str] = None) -> str:
+        with self._configured(psm, whitelist) as api:
+            api.SetImage(img)
+            return api.GetUTF8Text()
+
+    def image_to_data(self, img: Image.Image, psm: Optional[int] = None,
+                      whitelist: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._configured(psm, whitelist) as api:
+            api.SetImage(img)
+            api.Recognize()
+            header = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n"
+            return parse_tsv(header + api.GetTSVText(0))
+
+
+class CliEngine:
+    name = "cli"
+
+    def __init__(self, cmd: str, workers: int = OCR_WORKERS):
+        self.cmd = cmd
+        out = subprocess.run([cmd, "--version"], capture_output=True, text=True, timeout=30)
+        # Older builds print the version on stderr
+        self.version = (out.stdout or out.stderr).splitlines()[0].strip()
+        self._slots = threading.BoundedSemaphore(max(1, workers))
+
+    def _args(self, psm: Optional[int], whitelist: Optional[str], tsv: bool):
+        args = [self.cmd, "stdin", "stdout", "-l", OCR_LANG,
+                "--psm", str(OCR_PSM if psm is None else psm), "--oem", str(OCR_OEM)]
+        path = tessdata_dir()
+        if path:
+            args += ["--tessdata-dir", path]
+        if whitelist:
+            args += ["-c", f"tessedit_char_whitelist={whitelist}"]
+        if tsv:
+            args.append("tsv")
+        return args
+
+    def _run(self, img: Image.Image, psm: Optional[int] = None, whitelist: Optional[str] = None,
+             tsv: bool = False) -> str:
+        buf = io.BytesIO()
+        # PNM needs no compression, so encoding is nearly free compared to PNG
+        img.save(buf, format="PPM")
+        with self._slots:
+            out = subprocess.run(self._args(psm, whitelist, tsv), input=buf.getvalue(),
+                                 capture_output=True, timeout=OCR_TIMEOUT_S)
+        if out.returncode != 0:
+            raise RuntimeError(f"Tesseract failed: {out.stderr.decode(errors='replace').strip()}")
+        return out.stdout.decode("utf-8", errors="replace")
+
+    def image_to_string(self, img: Image.Image, psm: Optional[int] = None, whitelist: Optional[str] = None) -> str:
+        return self._run(img, psm, whitelist)
+
+    def image_to_data(self, img: Image.Image, psm: Optional[int] = None,
+                      whitelist: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Words with bounding boxes and confidences (0-100)."""
+        return parse_tsv(self._run(img, psm, whitelist, tsv=True))
+
+
+def _find_tesseract_cmd() -> Optional[str]:
+    # Allow user to point directly to tesseract executable via env
+    custom_cmd = os.getenv("TESSERACT_CMD")
+    if custom_cmd:
+        return custom_cmd
+    found = shutil.which("tesseract")
+    if found:
+        return found
+    # Try common Windows install path as a fallback
+    if os.path.exists(WINDOWS_TESSERACT_PATH):
+        return WINDOWS_TESSERACT_PATH
+    return None
+
+
+def _detect_engine():
+    if OCR_ENGINE in ("auto", "tesserocr"):
+        try:
+            return TesserocrEngine()
+        except ImportError:
+            if OCR_ENGINE == "tesserocr":
+                raise
+        except RuntimeError as e:
+            # tesserocr is installed but could not load the language data
+            print(f"tesserocr unavailable ({e}); falling back to the tesseract CLI")
+    cmd = _find_tesseract_cmd()
+    if not cmd:
+        return None
+    try:
+        return CliEngine(cmd)
+    except (OSError, subprocess.SubprocessError, IndexError):
+        return None
+
+
+_engine = None
+_detected = False
+_lock = threading.Lock()
+
+
+def get_ocr_engine():
+    """The process-wide OCR engine, or None when Tesseract is not available. Detection runs once."""
+    global _engine, _detected
+    if not _detected:
+        with _lock:
+            if not _detected:
+                _engine = _detect_engine()
+                _detected = True
+                if _engine:
+                    print(f"OCR engine: {_engine.name} ({_engine.version}), lang={OCR_LANG} "
+                          f"psm={OCR_PSM} oem={OCR_OEM} model={OCR_MODEL}")
+    return _engine
@@ -1,64 +1,275 @@
 from PIL import Image, ImageOps
-import pytesseract
-from pytesseract import TesseractNotFoundError
+import io
+import math
 import os
+import re
+import threading
+from typing import Any, Dict, List, Union
+from utils.metrics import OCR_DURATION, OCR_PAGES, OCR_REFINED_WORDS, OCR_TILES
+from utils.ocr_engine import OCR_WORKERS, get_ocr_engine, words_to_text
 
+# Memory for one page in flight: decoded grayscale image, its preprocessed
+# copy, the buffer handed to Tesseract and Tesseract's own working set come
+# to roughly OCR_BYTES_PER_PIXEL bytes per pixel.
+OCR_MEMORY_BUDGET_MB = float(os.getenv("OCR_MEMORY_BUDGET_MB", "256"))
+OCR_BYTES_PER_PIXEL = float(os.getenv("OCR_BYTES_PER_PIXEL", "6"))
+# Beyond ~300 DPI for an A4 page extra pixels don't help Tesseract
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", str(12_000_000)))
+# Pages larger than this are OCR'd in horizontal strips
+OCR_TILE_PIXELS = int(os.getenv("OCR_TILE_PIXELS", str(6_000_000)))
+OCR_TILE_HEIGHT = int(os.getenv("OCR_TILE_HEIGHT", "1200"))
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "120"))
+PDF_OCR_DPI = 300
 
-def _load_image(path: str) -> Image.Image:
+# Bounds how many documents are decoded and OCR'd at once, so worker memory stays
+# near OCR_WORKERS x OCR_MEMORY_BUDGET_MB however many uploads arrive together
+_ocr_slots = threading.BoundedSemaphore(max(1, OCR_WORKERS))
+
+# Second pass over low-confidence numeric words (0 disables; one plain pass like before)
+OCR_REFINE = os.getenv("OCR_REFINE", "1") == "1"
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "75"))
+OCR_REFINE_SCALE = float(os.getenv("OCR_REFINE_SCALE", "2.5"))
+OCR_MAX_REFINE_WORDS = int(os.getenv("OCR_MAX_REFINE_WORDS", "40"))
+
+NUMERIC_WORD_RE = re.compile(r"^([<>(]?)([\d.,]+)([)%]?)$")
+# Includes the qualifiers NUMERIC_WORD_RE allows, so "<0.5" can be re-read as such
+DIGIT_WHITELIST = "0123456789.,<>()%"
+
+
+def is_pdf(source: Union[str, bytes], filename: str = None) -> bool:
     """
-    Load an image from a file path. If a PDF is provided, render the first
-    page to an image so OCR can proceed.
+    True if the source is a PDF, judged by the %PDF- magic bytes (which may
+    follow a little junk, as readers allow). The file name is only used when
+    the content cannot be read.
     """
-    if path.lower().endswith(".pdf"):
-        import fitz  # PyMuPDF
+    if isinstance(source, (bytes, bytearray)):
+        head = bytes(source[:1024])
+    else:
+        try:
+            with open(source, "rb") as f:
+                head = f.read(1024)
+        except OSError:
+            head = b""
+        filename = filename or source
+    if head:
+        return b"%PDF-" in head
+    return bool(filename) and filename.lower().endswith(".pdf")
+
 
-        doc = fitz.open(path)
+def max_ocr_pixels() -> int:
+    """Largest page (in pixels) processed at full size under the memory budget."""
+    return int(min(OCR_MAX_PIXELS, OCR_MEMORY_BUDGET_MB * 1024 * 1024 / OCR_BYTES_PER_PIXEL))
+
+
+def _render_pdf_page(source: Union[str, bytes], max_pixels: int) -> Image.Image:
+    import fitz  # PyMuPDF
+
+    if isinstance(source, (bytes, bytearray)):
+        doc = fitz.open(stream=source, filetype="pdf")
+    else:
+        doc = fitz.open(source)
+    with doc:
         page = doc.load_page(0)
-        pix = page.get_pixmap(dpi=300)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        # Lower the DPI for oversized pages instead of rendering big and shrinking afterwards
+        pixels_at_300 = (page.rect.width / 72 * PDF_OCR_DPI) * (page.rect.height / 72 * PDF_OCR_DPI)
+        dpi = PDF_OCR_DPI * min(1.0, math.sqrt(max_pixels / pixels_at_300))
+        pix = page.get_pixmap(dpi=int(dpi), colorspace=fitz.csGRAY)
+        return Image.frombytes("L", [pix.width, pix.height], pix.samples)
+
+
+def _decode_image(source: Union[str, bytes], max_pixels: int) -> Image.Image:
+    img = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    pixels = img.width * img.height
+    if pixels > max_pixels:
+        scale = math.sqrt(max_pixels / pixels)
+        target = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        # JPEG (phone photos): decode straight to grayscale at 1/2, 1/4 or 1/8 scale,
+        # never materialising the full-resolution RGB frame
+        img.draft("L", target)
+        img = img.convert("L")
+        if img.width * img.height > max_pixels:
+            img = img.resize(target, Image.BOX)
+        return img
+    return img.convert("L")
+
+
+def _load_image(source: Union[str, bytes], filename: str = None) -> Image.Image:
+    """
+    Load an image from a file path or from in-memory bytes. If a PDF is
+    provided, render the first page to an image so OCR can proceed.
+    Large inputs are downscaled while decoding to stay within max_ocr_pixels().
+    """
+    max_pixels = max_ocr_pixels()
+    if is_pdf(source, filename):
+        img = _render_pdf_page(source, max_pixels)
     else:
-        img = Image.open(path)
+        img = _decode_image(source, max_pixels)
 
     # Basic enhancement to improve OCR accuracy on scanned reports.
-    img = img.convert("L")  # grayscale
     img = ImageOps.autocontrast(img)
     # Upscale small images to help OCR detect characters
     if min(img.size) < 1500:
-        scale = 1500 / min(img.size)
-        new_size = (int(img.width * scale), int(img.height * scale))
-        img = img.resize(new_size)
+        scale = min(1500 / min(img.size), math.sqrt(max_pixels / (img.width * img.height)))
+        if scale > 1:
+            new_size = (int(img.width * scale), int(img.height * scale))
+            img = img.resize(new_size)
 
     return img
 
 
+def _ocr_words(engine, img: Image.Image) -> List[Dict[str, Any]]:
+    """
+    Word boxes for the page. Large pages are read in overlapping horizontal
+    strips so Tesseract never holds the whole page; each word is kept from
+    the strip whose core region (outside the overlap) contains its centre.
+    """
+    if img.width * img.height <= OCR_TILE_PIXELS:
+        return engine.image_to_data(img)
+
+    step = max(OCR_TILE_HEIGHT - OCR_TILE_OVERLAP, 1)
+    half = OCR_TILE_OVERLAP // 2
+    words: List[Dict[str, Any]] = []
+    for index, top in enumerate(range(0, img.height, step)):
+        bottom = min(img.height, top + OCR_TILE_HEIGHT)
+        core_top = top + half if top > 0 else 0
+        core_bottom = bottom - half if bottom < img.height else bottom
+        OCR_TILES.inc()
+        for word in engine.image_to_data(img.crop((0, top, img.width, bottom))):
+            centre = top + word["top"] + word["height"] / 2
+            if not core_top <= centre < core_bottom:
+                continue
+            word["top"] += top
+            # Keep blocks from different strips apart when rebuilding lines
+            word["block"] += index * 10_000
+            words.append(word)
+        if bottom == img.height:
+            break
+    return words
+
+
 def _ensure_tesseract_installed():
-    try:
-        # Allow user to point directly to tesseract executable via env
-        custom_cmd = os.getenv("TESSERACT_CMD")
-        if custom_cmd:
-            pytesseract.pytesseract.tesseract_cmd = custom_cmd
-        else:
-            # Try common Windows install path as a fallback
-            default_win_path = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-            if os.path.exists(default_win_path):
-                pytesseract.pytesseract.tesseract_cmd = default_win_path
-        pytesseract.get_tesseract_version()
-        return True
-    except (TesseractNotFoundError, FileNotFoundError):
-        return False
+    """True if an OCR engine is available; detection happens once per process."""
+    return get_ocr_engine() is not None
 
 
-def run_ocr(path: str) -> str:
+def run_ocr(source: Union[str, bytes], filename: str = None) -> str:
     """
-    Run OCR using Tesseract. Raises a RuntimeError with a friendly message
-    if the Tesseract binary is not available on the system.
+    Run OCR using Tesseract on a file path or raw file bytes. Raises a
+    RuntimeError with a friendly message if the Tesseract binary is not
+    available on the system.
     """
-    if not _ensure_tesseract_installed():
+    engine = get_ocr_engine()
+    if engine is None:
         raise RuntimeError(
             "Tesseract is not installed or not in PATH. "
             "Install it from https://github.com/tesseract-ocr/tesseract and "
             "ensure the binary is on your system PATH."
         )
 
-    img = _load_image(path)
-    return pytesseract.image_to_string(img)
+    with _ocr_slots, OCR_DURATION.time():
+        img = _load_image(source, filename)
+        OCR_PAGES.inc()
+        if not OCR_REFINE and img.width * img.height <= OCR_TILE_PIXELS:
+            return engine.image_to_string(img)
+        words = _ocr_words(engine, img)
+        if OCR_REFINE:
+            refine_low_confidence(engine, img, words)
+        return words_to_text(words)
+
+
+def _crop_word(img: Image.Image, word: Dict[str, Any]) -> Image.Image:
+    pad = max(4, word["height"] // 3)
+    box = (
+        max(0, word["left"] - pad),
+        max(0, word["top"] - pad),
+        min(img.width, word["left"] + word["width"] + pad),
+        min(img.height, word["top"] + word["height"] + pad),
+    )
+    crop = img.crop(box)
+    size = (int(crop.width * OCR_REFINE_SCALE), int(crop.height * OCR_REFINE_SCALE))
+    return crop.resize(size, Image.LANCZOS)
+
+
+def _keep_qualifiers(original: str, reread: str) -> str:
+    """Re-attaches the "<", ">", "(" prefix or ")", "%" suffix of `original` if the re-read dropped it."""
+    before, after = NUMERIC_WORD_RE.match(original), NUMERIC_WORD_RE.match(reread)
+    if not (before and after):
+        return reread
+    prefix = after.group(1) or before.group(1)
+    suffix = after.group(3) or before.group(3)
+    return f"{prefix}{after.group(2)}{suffix}"
+
+
+def _read_crops_one_by_one(engine, crops: List[Image.Image], whitelist) -> List[List[Dict[str, Any]]]:
+    return [engine.image_to_data(crop, psm=7, whitelist=whitelist) for crop in crops]
+
+
+def _read_crops_as_sheet(engine, crops: List[Image.Image], whitelist) -> List[List[Dict[str, Any]]]:
+    """
+    Reads all crops with one OCR call: they are stacked one per row on a white
+    sheet, and the words found are mapped back to their row by position.
+    Used with the CLI engine, where every call spawns a tesseract process.
+    """
+    if not crops:
+        return []
+    gap = max(crop.height for crop in crops) // 2
+    width = max(crop.width for crop in crops) + 2 * gap
+    offsets, top = [], gap
+    for crop in crops:
+        offsets.append(top)
+        top += crop.height + gap
+    sheet = Image.new(crops[0].mode, (width, top), "white")
+    for crop, offset in zip(crops, offsets):
+        sheet.paste(crop, (gap, offset))
+
+    rows: List[List[Dict[str, Any]]] = [[] for _ in crops]
+    for word in engine.image_to_data(sheet, psm=6, whitelist=whitelist):
+        centre = word["top"] + word["height"] / 2
+        for index, (crop, offset) in enumerate(zip(crops, offsets)):
+            if offset - gap / 2 <= centre < offset + crop.height + gap / 2:
+                rows[index].append(word)
+                break
+    return [sorted(row, key=lambda w: w["left"]) for row in rows]
+
+
+def refine_low_confidence(engine, img: Image.Image, words: List[Dict[str, Any]]) -> int:
+    """
+    Re-reads low-confidence words containing digits (results, ranges) from an
+    upscaled crop as a single text line, digits-only when the word is purely
+    numeric. A re-read replaces the original only if Tesseract is more
+    confident in it. Updates `words` in place; returns the number replaced.
+
+    With the CLI engine all crops of a kind (numeric or not) are read in one
+    call, instead of spawning a tesseract process per word.
+    """
+    candidates = [w for w in words if w["conf"] < OCR_MIN_CONFIDENCE and any(c.isdigit() for c in w["text"])]
+    candidates.sort(key=lambda w: w["conf"])
+    candidates = candidates[:OCR_MAX_REFINE_WORDS]
+
+    read_crops = _read_crops_as_sheet if engine.name == "cli" else _read_crops_one_by_one
+    rereads = {}
+    for numeric in (True, False):
+        group = [w for w in candidates if bool(NUMERIC_WORD_RE.match(w["text"])) == numeric]
+        if group:
+            results = read_crops(engine, [_crop_word(img, w) for w in group], DIGIT_WHITELIST if numeric else None)
+            rereads.update((id(word), result) for word, result in zip(group, results))
+
+    replaced = 0
+    for word in candidates:
+        numeric = bool(NUMERIC_WORD_RE.match(word["text"]))
+        reread = rereads[id(word)]
+        if not reread:
+            OCR_REFINED_WORDS.labels(outcome="kept").inc()
+            continue
+        text = " ".join(w["text"] for w in reread)
+        conf = min(w["conf"] for w in reread)
+        if numeric:
+            text = _keep_qualifiers(word["text"], text)
+        if conf > word["conf"] and text != word["text"]:
+            print(f"OCR re-read '{word['text']}' ({word['conf']:.0f}) as '{text}' ({conf:.0f})")
+            word["text"], word["conf"] = text, conf
+            replaced += 1
+            OCR_REFINED_WORDS.labels(outcome="replaced").inc()
+        else:
+            OCR_REFINED_WORDS.labels(outcome="kept").inc()
+    return replaced
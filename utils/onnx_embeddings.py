@@ -0,0 +1,95 @@
+"""
+Sentence-transformer embeddings on ONNX Runtime, without PyTorch.
+
+The sentence-transformers model repos on the Hugging Face Hub ship exported
+ONNX graphs next to the PyTorch weights, including int8-quantised ones
+(e.g. onnx/model_quint8_avx2.onnx for all-MiniLM-L6-v2). This backend loads
+such a graph plus the fast tokenizer and reproduces the sentence-transformers
+pipeline: tokenize, run the encoder, mean-pool over the attention mask and
+L2-normalise. It needs only `onnxruntime` and `tokenizers`, which load in a
+fraction of the time and memory of torch.
+"""
+import os
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+# 0 lets ONNX Runtime pick (one thread per physical core)
+EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))
+# sentence-transformers truncates all-MiniLM-L6-v2 inputs at 256 word pieces
+EMBEDDING_MAX_SEQ_LENGTH = int(os.getenv("EMBEDDING_MAX_SEQ_LENGTH", "256"))
+
+
+def _resolve(model_name: str, filename: str) -> str:
+    """Local path of a model file; `model_name` may be a Hub repo id or a local directory."""
+    if os.path.isdir(model_name):
+        return os.path.join(model_name, filename)
+    from huggingface_hub import hf_hub_download
+
+    return hf_hub_download(model_name, filename)
+
+
+class OnnxEmbeddings(Embeddings):
+    def __init__(self, model_name: str, onnx_file: str = EMBEDDING_ONNX_FILE, batch_size: int = 32,
+                 max_seq_length: int = EMBEDDING_MAX_SEQ_LENGTH, threads: int = EMBEDDING_ONNX_THREADS,
+                 normalize: bool = True):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        self.onnx_file = onnx_file
+        self.batch_size = max(1, batch_size)
+        self.normalize = normalize
+
+        self.tokenizer = Tokenizer.from_file(_resolve(model_name, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id("[PAD]") or 0)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            _resolve(model_name, onnx_file), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        hidden = self.session.run(None, feeds)[0]
+        weights = mask[:, :, None].astype(hidden.dtype)
+        pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # Batch texts of similar length together so little compute is spent on padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._encode_batch([texts[i] for i in batch])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def cosine_agreement(candidate: List[List[float]], reference: List[List[float]]) -> dict:
+    """Per-text cosine similarity between two backends' vectors for the same texts."""
+    a = np.asarray(candidate, dtype=np.float32)
+    b = np.asarray(reference, dtype=np.float32)
+    cos = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {"min": float(cos.min()), "mean": float(cos.mean()), "texts": int(len(cos))}
@@ -0,0 +1,103 @@
+"""
+Layout-aware text extraction for native (digital) PDFs.
+
+page.get_text() returns text objects in content-stream order, which on many
+lab PDFs puts every table cell on its own line, or whole columns one after
+another. Here words are regrouped by their coordinates into visual lines,
+lines are split into cells at wide horizontal gaps, and lines that look
+like result rows (label, numeric result, unit, reference range) are
+returned as structured rows.
+"""
+import re
+from statistics import median
+from typing import Any, Dict, List, Optional, Tuple
+
+# Words closer than this fraction of the line height belong to the same cell
+CELL_GAP_RATIO = 0.6
+# Word centres within this fraction of the line height are on the same line
+LINE_TOLERANCE_RATIO = 0.5
+
+NUMBER_RE = re.compile(r"^[<>]?\s*\d[\d,]*(?:\.\d+)?")
+RANGE_RE = re.compile(
+    r"^(?:\d[\d,]*(?:\.\d+)?\s*[-–]\s*\d[\d,]*(?:\.\d+)?|[<>≤≥]=?\s*\d[\d,]*(?:\.\d+)?|up\s*to\s*\d[\d,]*(?:\.\d+)?)",
+    re.I,
+)
+FLAG_TOKENS = {"h", "l", "high", "low", "*", "**", "abnormal", "critical", "normal", "borderline"}
+
+
+def _group_lines(words: List[Tuple]) -> List[List[Tuple]]:
+    """Groups PyMuPDF word tuples into visual lines, top to bottom, each sorted left to right."""
+    lines: List[List[Tuple]] = []
+    centres: List[float] = []
+    for word in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        centre = (word[1] + word[3]) / 2
+        height = word[3] - word[1]
+        if lines and abs(centre - centres[-1]) <= height * LINE_TOLERANCE_RATIO:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+            centres.append(centre)
+    return [sorted(line, key=lambda w: w[0]) for line in lines]
+
+
+def _split_cells(line: List[Tuple]) -> List[str]:
+    height = median(w[3] - w[1] for w in line)
+    cells = [[line[0][4]]]
+    for prev, word in zip(line, line[1:]):
+        if word[0] - prev[2] > height * CELL_GAP_RATIO:
+            cells.append([])
+        cells[-1].append(word[4])
+    return [" ".join(cell) for cell in cells]
+
+
+def parse_row(cells: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Reads (label, result, unit, reference) from a line's cells, or None when
+    the line is not a result row (headers, notes, patient details).
+    """
+    value_index = next((i for i, cell in enumerate(cells) if i > 0 and NUMBER_RE.match(cell)), None)
+    if value_index is None:
+        return None
+    label = " ".join(cells[:value_index]).strip()
+    if not label or NUMBER_RE.match(label) or label.endswith(":"):
+        return None
+
+    value_cell = cells[value_index]
+    if RANGE_RE.match(value_cell) and "-" in value_cell:
+        # A range in the first numeric column means there is no result on this line
+        return None
+    value = NUMBER_RE.match(value_cell).group(0).replace(" ", "")
+    # Result and unit in one cell, e.g. "13.2 g/dL"
+    unit = value_cell[len(NUMBER_RE.match(value_cell).group(0)):].strip() or None
+
+    reference = None
+    flag = None
+    for cell in cells[value_index + 1:]:
+        if cell.strip().lower() in FLAG_TOKENS:
+            flag = cell.strip()
+        elif RANGE_RE.match(cell):
+            reference = cell
+        elif unit is None and reference is None:
+            unit = cell
+    return {"label": label, "value": value, "unit": unit, "reference": reference, "flag": flag}
+
+
+def extract_pdf_layout(doc) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Returns (text, rows) for an open PyMuPDF document. `text` has one visual
+    line per line with cells separated by " | "; `rows` are the lines that
+    parse as result rows, tagged with their page number.
+    """
+    text_lines: List[str] = []
+    rows: List[Dict[str, Any]] = []
+    for page_number, page in enumerate(doc, start=1):
+        words = page.get_text("words")
+        for line in _group_lines(words):
+            cells = _split_cells(line)
+            text_lines.append(" | ".join(cells))
+            row = parse_row(cells)
+            if row:
+                row["page"] = page_number
+                rows.append(row)
+        text_lines.append("")
+    return "\n".join(text_lines), rows
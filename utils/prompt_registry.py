@@ -0,0 +1,64 @@
+"""
+Versioned prompt templates, compiled once at import.
+
+Each template is split into a static system message (role, rules, output
+format instructions) and a short human message holding the per-request data.
+The system message is byte-identical across calls, so providers that cache
+prompt prefixes (Groq, OpenAI) can reuse it, and nothing but the small
+suffix is formatted per call.
+
+Templates are registered by the node modules that use them. The key
+"<name>:v<version>:<fingerprint>" changes whenever the static text changes,
+even if the version was not bumped; it is recorded with each LLM call's usage.
+"""
+import hashlib
+from typing import Dict, List
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from utils.token_utils import estimate_tokens
+
+
+class PromptMessages(list):
+    """Message list for invoke_llm(), tagged with the template key it was rendered from."""
+
+    def __init__(self, messages, key: str):
+        super().__init__(messages)
+        self.key = key
+
+
+class PromptTemplate:
+    def __init__(self, name: str, version: int, system: str, human: str):
+        self.name = name
+        self.version = version
+        self.system = system.strip()
+        self.human = human.strip()
+        self._system_message = SystemMessage(content=self.system)
+        fingerprint = hashlib.sha256(f"{self.system}\0{self.human}".encode("utf-8")).hexdigest()[:8]
+        self.key = f"{name}:v{version}:{fingerprint}"
+        self.static_tokens = estimate_tokens(self.system)
+
+    def messages(self, **values) -> PromptMessages:
+        return PromptMessages([self._system_message, HumanMessage(content=self.human.format(**values))], self.key)
+
+    def text(self, **values) -> str:
+        """The rendered prompt as one string, for token estimates."""
+        return f"{self.system}\n{self.human.format(**values)}"
+
+
+_registry: Dict[str, PromptTemplate] = {}
+
+
+def register_prompt(name: str, version: int, system: str, human: str) -> PromptTemplate:
+    template = PromptTemplate(name, version, system, human)
+    _registry[name] = template
+    return template
+
+
+def get_prompt(name: str) -> PromptTemplate:
+    return _registry[name]
+
+
+def prompt_versions() -> List[str]:
+    """Keys of every registered template."""
+    return sorted(template.key for template in _registry.values())
@@ -0,0 +1,110 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from nodes.extract_parameters import _label_index, _match_label, _normalize_label
+
+# Leading label of a report line, e.g. "Haemoglobin (Hb)" in "Haemoglobin (Hb) | 11.2 | g/dL"
+LINE_LABEL_RE = re.compile(r"^\s*([A-Za-z][^0-9|:]*)")
+# Report lines that are neither parameter rows nor patient details are packed into chunks this long
+NOTES_CHUNK_CHARS = 400
+DEMOGRAPHIC_FIELDS = ("Name", "Age", "Gender")
+
+
+def _line_param(line: str, index: Dict[str, str]) -> Optional[str]:
+    """Canonical parameter a report line is a result row for, if it has a known label and a number."""
+    match = LINE_LABEL_RE.match(line)
+    if not match or not re.search(r"\d", line):
+        return None
+    return _match_label(match.group(1).strip(" -|"), index)
+
+
+def _parameter_text(name: str, info: Dict[str, Any], report_line: Optional[str]) -> str:
+    unit = f" {info['unit']}" if info.get("unit") else ""
+    ref = info.get("reference") or {}
+    status = (info.get("status") or info.get("flag") or "unknown").upper()
+    text = f"{name}: {info.get('value')}{unit} — {status} (reference {ref.get('low')}–{ref.get('high')}{unit})"
+    if report_line:
+        text += f"\nAs printed in the report: {report_line}"
+    return text
+
+
+def _pack_notes(lines: List[str]) -> List[str]:
+    chunks: List[str] = []
+    current = ""
+    for line in lines:
+        if current and len(current) + len(line) + 1 > NOTES_CHUNK_CHARS:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def build_report_chunks(state: Any) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Splits an analysed report into (text, metadata) chunks for the vector store:
+    one per parameter (metadata: type, param, status), one with the patient's
+    details and a few packed chunks with the remaining report text (method
+    notes, comments, disclaimers). Returns [] when no parameters were
+    validated, so callers can fall back to plain text splitting.
+    """
+    params = getattr(state, "param_interpretation", None) or getattr(state, "validated_params", None) or {}
+    if not params:
+        return []
+
+    index = _label_index()
+    report_lines: Dict[str, str] = {}
+    notes: List[str] = []
+    patient_info = getattr(state, "patient_info", None) or {}
+    for raw_line in (getattr(state, "raw_text", None) or "").splitlines():
+        line = " ".join(raw_line.split())
+        if not line:
+            continue
+        param = _line_param(line, index)
+        if param:
+            report_lines.setdefault(param, line)
+        elif not any(line.lower().startswith(field.lower()) for field in DEMOGRAPHIC_FIELDS):
+            notes.append(line)
+
+    chunks: List[Tuple[str, Dict[str, Any]]] = []
+    for name, info in sorted(params.items()):
+        status = (info.get("status") or info.get("flag") or "unknown").lower()
+        chunks.append((
+            _parameter_text(name, info, report_lines.get(name)),
+            {"type": "parameter", "param": name, "status": status},
+        ))
+
+    details = [f"{field}: {patient_info[field]}" for field in DEMOGRAPHIC_FIELDS if patient_info.get(field)]
+    report_date = getattr(state, "report_date", None)
+    if report_date:
+        details.append(f"Report date: {report_date}")
+    if details:
+        chunks.append(("Patient details: " + "; ".join(details), {"type": "demographics"}))
+
+    for text in _pack_notes(notes):
+        chunks.append((text, {"type": "notes"}))
+    return chunks
+
+
+def params_in_question(question: str) -> List[str]:
+    """
+    Canonical parameters mentioned in a chat question, by name or alias
+    ("hb", "platelets", "WBC count"). Mentioning a differential (e.g.
+    "neutrophils") also selects its absolute count.
+    """
+    text = f" {_normalize_label(question)} "
+    index = _label_index()
+    found = []
+    for alias, canonical in index.items():
+        if canonical in found:
+            continue
+        # Tolerate a plural/singular difference ("platelets", "neutrophil")
+        variants = {alias, alias + "s", alias[:-1] if alias.endswith("s") else alias}
+        if any(f" {variant} " in text for variant in variants):
+            found.append(canonical)
+    for canonical in list(found):
+        absolute = f"Absolute {canonical}"
+        if absolute in set(index.values()) and absolute not in found:
+            found.append(absolute)
+    return found
@@ -0,0 +1,89 @@
+from typing import Any, Dict
+
+from utils.token_utils import truncate_to_tokens
+
+# Upper bound for the synthesis part of the digest; the synthesis report is
+# by far the longest free-text field in the state.
+SYNTHESIS_MAX_TOKENS = 250
+CONTEXT_MAX_TOKENS = 120
+
+
+def _as_dict(state: Any) -> Dict[str, Any]:
+    if state is None:
+        return {}
+    if isinstance(state, dict):
+        return state
+    # Read attributes directly instead of model_dump() so we never copy raw_text.
+    fields = (
+        "patient_info", "param_interpretation", "validated_params", "patterns",
+        "risk_assessment", "context_analysis", "synthesis_report", "recommendations",
+    )
+    return {f: getattr(state, f, None) for f in fields}
+
+
+def _format_param(name: str, info: Dict[str, Any]) -> str:
+    status = (info.get("status") or info.get("flag") or "unknown").upper()
+    ref = info.get("reference") or {}
+    unit = f" {info['unit']}" if info.get("unit") else ""
+    ref_str = f", ref {ref.get('low')}-{ref.get('high')}" if ref else ""
+    return f"{name} {info.get('value')}{unit} ({status}{ref_str})"
+
+
+def build_report_digest(state: Any) -> str:
+    """
+    Builds a compact, prompt-ready summary of an analysed report.
+
+    Only abnormal parameters are listed in full; normal ones are reduced to
+    their names. Raw OCR text and the near-duplicate extracted/validated
+    parameter dicts are left out on purpose, the chat retriever supplies
+    raw excerpts when they are needed.
+    """
+    data = _as_dict(state)
+    lines = []
+
+    patient_info = data.get("patient_info") or {}
+    if patient_info:
+        lines.append(
+            f"Patient: {patient_info.get('Name', 'Unknown')} | "
+            f"Age {patient_info.get('Age', 'Unknown')} | {patient_info.get('Gender', 'Unknown')}"
+        )
+
+    params = data.get("param_interpretation") or data.get("validated_params") or {}
+    abnormal, normal = [], []
+    for name, info in sorted(params.items()):
+        status = (info.get("status") or info.get("flag") or "").lower()
+        if status == "normal":
+            normal.append(name)
+        else:
+            abnormal.append(_format_param(name, info))
+
+    lines.append("Abnormal parameters: " + ("; ".join(abnormal) if abnormal else "none"))
+    if normal:
+        lines.append("Normal parameters: " + ", ".join(normal))
+
+    patterns = data.get("patterns") or []
+    if patterns:
+        lines.append("Patterns: " + "; ".join(patterns))
+
+    risk = data.get("risk_assessment") or {}
+    if risk:
+        rationale = risk.get("rationale")
+        if isinstance(rationale, list):
+            rationale = "; ".join(rationale)
+        lines.append(f"Risk score: {risk.get('score')}/10" + (f" - {rationale}" if rationale else ""))
+
+    context = data.get("context_analysis") or {}
+    if context.get("analysis"):
+        lines.append("Context: " + truncate_to_tokens(context["analysis"], CONTEXT_MAX_TOKENS))
+
+    synthesis = data.get("synthesis_report")
+    if synthesis:
+        # The signature block adds nothing for the chat model.
+        synthesis = synthesis.split("Sincerely,")[0].strip()
+        lines.append("Summary: " + truncate_to_tokens(synthesis, SYNTHESIS_MAX_TOKENS))
+
+    recommendations = data.get("recommendations") or []
+    if recommendations:
+        lines.append("Recommendations: " + "; ".join(recommendations))
+
+    return "\n".join(lines)
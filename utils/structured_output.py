@@ -0,0 +1,275 @@
+"""
+Tolerant parsing of the JSON the LLM nodes ask for.
+
+PydanticOutputParser fails on a lot of output that is easy to fix
+locally: code fences, prose around the JSON, trailing commas, Python
+literals, single quotes, quoted or annotated numbers ("7/10"), a string
+where a list was asked for, or an answer cut off mid-object. In that case
+parse_structured() repairs the output here first. It makes a short
+"fix this JSON" LLM call only when local repair fails, and then only with
+the broken output and a compact field list, not the original prompt.
+
+structured_output_parses_total{node, result} counts outcomes: clean, repaired
+(locally), truncated (cut off; recovered without the incomplete last
+value), llm_fixed and failed.
+"""
+import ast
+import json
+import os
+import re
+import types
+import typing
+from typing import Any, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from utils.metrics import STRUCTURED_OUTPUT_PARSES
+from utils.prompt_registry import register_prompt
+from utils.token_utils import truncate_to_tokens
+
+STRUCTURED_OUTPUT_LLM_FIX = os.getenv("STRUCTURED_OUTPUT_LLM_FIX", "1") == "1"
+# The broken output sent to the fix-up call is cut to this many tokens
+STRUCTURED_OUTPUT_FIX_MAX_TOKENS = int(os.getenv("STRUCTURED_OUTPUT_FIX_MAX_TOKENS", "1500"))
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.S)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+_NULL_STRINGS = {"", "null", "none", "n/a", "na", "nil", "-", "not found", "not available", "unknown"}
+
+JSON_FIX_PROMPT = register_prompt("json_repair", version=1, system="""
+You repair malformed JSON produced by another model.
+Return ONLY one valid JSON object with the fields listed, using the values found in the broken output.
+Use null for values that are missing. Do not add explanations, comments, code fences or extra fields.
+""", human="""
+Fields:
+{fields}
+
+Parse error:
+{error}
+
+Broken output:
+{output}
+""")
+
+
+def _json_span(text: str, start: int) -> Tuple[str, bool]:
+    """
+    The JSON value opening at text[start], and whether the output was cut off.
+    Brackets inside strings are ignored.
+
+    A cut-off value is closed after its last complete member: the member
+    being written when the output stopped is dropped, since "1500" may be
+    the start of 150000 and "1" the start of 12.5.
+    """
+    stack, in_string, escaped = [], False, False
+    # Last point where every member so far was complete, and the brackets open there
+    cut, cut_stack = start, []
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            cut, cut_stack = i + 1, list(stack)
+        elif char in "}]":
+            if stack and stack[-1] == char:
+                stack.pop()
+            if not stack:
+                return text[start:i + 1], False
+            cut, cut_stack = i + 1, list(stack)
+        elif char == ",":
+            cut, cut_stack = i, list(stack)
+
+    return text[start:cut] + "".join(reversed(cut_stack)), True
+
+
+def truncated_json(text: str) -> bool:
+    """True when the JSON in an LLM answer was cut off before its closing bracket."""
+    fenced = _FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    return bool(starts) and _json_span(text, starts[0])[1]
+
+
+def _loads_lenient(span: str) -> Any:
+    # strict=False: raw newlines and tabs inside strings are common in LLM output
+    try:
+        return json.loads(span, strict=False)
+    except json.JSONDecodeError:
+        pass
+    fixed = span.replace("“", '"').replace("”", '"').replace("‘", "'").replace("’", "'")
+    fixed = _TRAILING_COMMA_RE.sub(r"\1", fixed)
+    fixed = re.sub(r"\bNone\b", "null", fixed)
+    fixed = re.sub(r"\bTrue\b", "true", re.sub(r"\bFalse\b", "false", fixed))
+    try:
+        return json.loads(fixed, strict=False)
+    except json.JSONDecodeError:
+        pass
+    # Python dict syntax (single quotes, None/True/False)
+    try:
+        return ast.literal_eval(_TRAILING_COMMA_RE.sub(r"\1", span))
+    except (ValueError, SyntaxError):
+        raise ValueError("output is not valid JSON, even after repair")
+
+
+def extract_json(text: str) -> Any:
+    """Decodes the JSON in an LLM answer, tolerating fences, surrounding prose and common syntax slips."""
+    fenced = _FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    # Objects first: a "[" in the prose before the JSON is more likely than a top-level array
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise ValueError("no JSON object in output")
+    error = None
+    for start in starts:
+        try:
+            return _loads_lenient(_json_span(text, start)[0])
+        except ValueError as e:
+            error = e
+    raise error
+
+
+def _norm_key(key: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(key).lower())
+
+
+def _coerce_value(value: Any, annotation: Any) -> Any:
+    origin = typing.get_origin(annotation)
+    args = [a for a in typing.get_args(annotation) if a is not type(None)]
+    if origin in (typing.Union, types.UnionType):
+        if isinstance(value, str) and value.strip().lower() in _NULL_STRINGS:
+            return None
+        if isinstance(value, dict) and "value" in value:
+            # {"value": 12.5, "unit": "g/dL"} where a bare value was asked for
+            value = value["value"]
+        if len(args) == 1:
+            return _coerce_value(value, args[0])
+        return value
+    if origin is list:
+        item_type = args[0] if args else Any
+        if value is None:
+            return []
+        if isinstance(value, str):
+            value = [line.strip(" -•*\t") for line in value.splitlines() if line.strip(" -•*\t")] or [value]
+        if isinstance(value, dict):
+            value = list(value.values())
+        return [_coerce_value(item, item_type) for item in value]
+    if annotation is str:
+        if isinstance(value, list):
+            return "\n".join(str(item) for item in value)
+        if isinstance(value, dict):
+            return "; ".join(f"{k}: {v}" for k, v in value.items())
+        return value if value is None else str(value)
+    if annotation in (int, float) and isinstance(value, str):
+        number = _NUMBER_RE.search(value.replace(",", ""))
+        if number:
+            value = float(number.group(0))
+    if annotation is int and isinstance(value, float):
+        return int(round(value))
+    return value
+
+
+def coerce_to_schema(data: Any, model: Type[BaseModel]) -> BaseModel:
+    """
+    Validates decoded JSON against `model` after matching keys loosely
+    ("risk score" -> risk_score) and coercing values to the field types.
+    """
+    fields = model.model_fields
+    if isinstance(data, list) and len(fields) == 1:
+        data = {next(iter(fields)): data}
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object for {model.__name__}")
+    # Unwrap {"ModelName": {...}} / {"properties": {...}}
+    if len(data) == 1 and isinstance(next(iter(data.values())), dict) and next(iter(data)) not in fields:
+        data = next(iter(data.values()))
+
+    names = {_norm_key(name): name for name in fields}
+    values = {}
+    for key, value in data.items():
+        name = names.get(_norm_key(key))
+        if name and name not in values:
+            values[name] = _coerce_value(value, fields[name].annotation)
+    return model.model_validate(values)
+
+
+def repair(text: str, model: Type[BaseModel]) -> BaseModel:
+    return coerce_to_schema(extract_json(text), model)
+
+
+def _field_list(model: Type[BaseModel]) -> str:
+    lines = []
+    for name, field in model.model_fields.items():
+        type_name = str(field.annotation).replace("typing.", "").replace("<class '", "").replace("'>", "")
+        lines.append(f"- {name}: {type_name}")
+    return "\n".join(lines)
+
+
+def parse_structured(response: Any, parser, node: str, llm=None, usage: Optional[list] = None,
+                     state=None) -> BaseModel:
+    """
+    Parses an LLM response with `parser` (a PydanticOutputParser), repairing
+    it locally if needed and, failing that, with one short fix-up call to
+    `llm`. Raises ValueError when the output cannot be recovered.
+    """
+    from utils.deadline import node_timeout
+    from utils.llm_utils import invoke_llm
+    from utils.token_budget import ensure_within_budget
+
+    text = getattr(response, "content", response)
+    if not isinstance(text, str):
+        text = str(text)
+    model = parser.pydantic_object
+    # The parser itself accepts cut-off JSON, keeping a partial last value
+    truncated = truncated_json(text)
+    error = ValueError("output was cut off")
+    if not truncated:
+        try:
+            parsed = parser.parse(text)
+            STRUCTURED_OUTPUT_PARSES.labels(node=node, result="clean").inc()
+            return parsed
+        except Exception as e:
+            error = e
+
+    try:
+        parsed = repair(text, model)
+        STRUCTURED_OUTPUT_PARSES.labels(node=node, result="truncated" if truncated else "repaired").inc()
+        if truncated:
+            print(f"Recovered cut-off {node} output, without its incomplete last value")
+        else:
+            print(f"Repaired {node} output locally ({type(error).__name__})")
+        return parsed
+    except (ValueError, ValidationError) as e:
+        error = e
+
+    if llm is not None and STRUCTURED_OUTPUT_LLM_FIX:
+        prompt = JSON_FIX_PROMPT.messages(
+            fields=_field_list(model),
+            error=str(error).splitlines()[0][:300],
+            output=truncate_to_tokens(text, STRUCTURED_OUTPUT_FIX_MAX_TOKENS),
+        )
+        try:
+            if state is not None:
+                ensure_within_budget(state, node, prompt)
+            timeout = node_timeout(state, node) if state is not None else None
+            fixed = invoke_llm(llm, prompt, node=node, usage=usage, timeout=timeout)
+            parsed = repair(getattr(fixed, "content", str(fixed)), model)
+            STRUCTURED_OUTPUT_PARSES.labels(node=node, result="llm_fixed").inc()
+            print(f"Fixed {node} output with a repair call")
+            return parsed
+        except TimeoutError:
+            STRUCTURED_OUTPUT_PARSES.labels(node=node, result="failed").inc()
+            raise
+        except Exception as e:
+            error = e
+
+    STRUCTURED_OUTPUT_PARSES.labels(node=node, result="failed").inc()
+    raise ValueError(f"Could not parse {model.__name__} output: {str(error).splitlines()[0]}")
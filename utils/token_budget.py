@@ -0,0 +1,136 @@
+"""
+Per-request LLM token accounting and budgets.
+
+Every LLM call made for a report is recorded in ReportState.llm_usage (node,
+model, prompt/completion tokens, latency). Before a call, nodes ask how many
+tokens their variable input may use:
+
+- a per-node prompt budget from configs/llm_models.json ("prompt_budgets"),
+  overridable with LLM_PROMPT_BUDGET_<NODE>;
+- a per-request budget (prompt + completion across all calls) from
+  ReportState.token_budget or LLM_REQUEST_TOKEN_BUDGET, minus what earlier
+  calls already used and the expected completion.
+
+Inputs are trimmed to fit; when an input must be trimmed to less than
+MIN_INPUT_TOKENS, the call is skipped with TokenBudgetExceeded.
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from utils.metrics import LLM_INPUT_TRIMMED
+from utils.token_utils import estimate_tokens, truncate_to_tokens
+
+# 0 = no per-request limit
+LLM_REQUEST_TOKEN_BUDGET = int(os.getenv("LLM_REQUEST_TOKEN_BUDGET", "0"))
+# Below this there is not enough input left for a useful answer
+MIN_INPUT_TOKENS = 200
+
+# Report lines worth keeping even without numbers
+_DEMOGRAPHIC_LINE_RE = re.compile(r"\b(name|age|sex|gender)\b", re.I)
+
+
+class TokenBudgetExceeded(RuntimeError):
+    pass
+
+
+def usage_summary(usage: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Totals across calls, and per node."""
+    summary = {"calls": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0,
+               "total_tokens": 0, "abandoned_calls": 0, "abandoned_tokens": 0, "latency_s": 0.0,
+               "estimated": False, "by_node": {}}
+    for call in usage:
+        node = summary["by_node"].setdefault(
+            call["node"], {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency_s": 0.0}
+        )
+        for target in (summary, node):
+            target["calls"] += 1
+            target["prompt_tokens"] += call["prompt_tokens"]
+            target["completion_tokens"] += call["completion_tokens"]
+            target["latency_s"] = round(target["latency_s"] + call["latency_s"], 3)
+        summary["cached_prompt_tokens"] += call.get("cached_prompt_tokens", 0)
+        if call.get("abandoned"):
+            summary["abandoned_calls"] += 1
+            summary["abandoned_tokens"] += call["prompt_tokens"] + call["completion_tokens"]
+        summary["estimated"] |= call.get("estimated", False)
+    summary["total_tokens"] = summary["prompt_tokens"] + summary["completion_tokens"]
+    return summary
+
+
+def tokens_used(state) -> int:
+    return sum(call["prompt_tokens"] + call["completion_tokens"] for call in (state.llm_usage or []))
+
+
+def node_prompt_budget(node: str) -> Optional[int]:
+    from utils.llm_utils import load_llm_config
+
+    env = os.getenv(f"LLM_PROMPT_BUDGET_{node.upper()}")
+    budget = int(env) if env else load_llm_config().get("prompt_budgets", {}).get(node)
+    return budget or None
+
+
+def input_budget(state, node: str, template: str) -> Optional[int]:
+    """
+    Tokens the variable part of a prompt may use, given the rest of the prompt
+    (`template`). None when no budget applies.
+    """
+    from utils.llm_utils import LLM_EXPECTED_COMPLETION_TOKENS
+
+    overhead = estimate_tokens(template)
+    limits = []
+    node_budget = node_prompt_budget(node)
+    if node_budget:
+        limits.append(node_budget - overhead)
+    request_budget = getattr(state, "token_budget", None) or LLM_REQUEST_TOKEN_BUDGET
+    if request_budget:
+        limits.append(request_budget - tokens_used(state) - LLM_EXPECTED_COMPLETION_TOKENS - overhead)
+    return min(limits) if limits else None
+
+
+def _check(node: str, max_tokens: Optional[int]) -> None:
+    if max_tokens is not None and max_tokens < MIN_INPUT_TOKENS:
+        raise TokenBudgetExceeded(f"Token budget exhausted before {node} ({max(max_tokens, 0)} tokens left for input)")
+
+
+def fit_text(text: str, max_tokens: Optional[int], node: str) -> str:
+    """Truncates free text (e.g. a summary) to the input budget."""
+    if max_tokens is None or estimate_tokens(text) <= max_tokens:
+        return text
+    _check(node, max_tokens)
+    LLM_INPUT_TRIMMED.labels(node=node).inc()
+    print(f"Trimmed {node} input from ~{estimate_tokens(text)} to {max_tokens} tokens (budget)")
+    return truncate_to_tokens(text, max_tokens)
+
+
+def fit_report_text(text: str, max_tokens: Optional[int], node: str) -> str:
+    """
+    Trims OCR/report text to the input budget, dropping the least useful parts
+    first: blank lines and runs of whitespace, then lines without any digits
+    (letterheads, method notes, disclaimers; patient details are kept), and
+    only then the tail of the report.
+    """
+    if max_tokens is None or estimate_tokens(text) <= max_tokens:
+        return text
+    _check(node, max_tokens)
+    original = estimate_tokens(text)
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    trimmed = "\n".join(lines)
+    if estimate_tokens(trimmed) > max_tokens:
+        lines = [line for line in lines if re.search(r"\d", line) or _DEMOGRAPHIC_LINE_RE.search(line)]
+        trimmed = "\n".join(lines)
+    trimmed = truncate_to_tokens(trimmed, max_tokens)
+    LLM_INPUT_TRIMMED.labels(node=node).inc()
+    print(f"Trimmed {node} input from ~{original} to ~{estimate_tokens(trimmed)} tokens (budget)")
+    return trimmed
+
+
+def ensure_within_budget(state, node: str, prompt) -> None:
+    """For prompts without a trimmable part: skip the call if it cannot fit the request budget."""
+    if not isinstance(prompt, str):
+        prompt = "\n".join(message.content for message in prompt)
+    budget = input_budget(state, node, "")
+    if budget is not None and estimate_tokens(prompt) > budget:
+        raise TokenBudgetExceeded(
+            f"Token budget exhausted before {node} (prompt ~{estimate_tokens(prompt)} tokens, {max(budget, 0)} left)"
+        )
@@ -0,0 +1,26 @@
+"""
+Cheap token estimation helpers.
+
+Provider tokenizers are not available locally, so prompt sizes are estimated
+with the usual ~4 characters per token heuristic. This is good enough for
+budgeting prompt sections; it is not meant for billing.
+"""
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text) -> int:
+    """Rough token count for a string (or anything str()-able)."""
+    if not text:
+        return 0
+    return max(1, len(str(text)) // CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = "...") -> str:
+    """Trim text so that its estimated size stays within max_tokens."""
+    if not text or max_tokens <= 0:
+        return ""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[: max(0, max_chars - len(marker))].rstrip() + marker
@@ -0,0 +1,30 @@
+"""
+Run-scoped, in-memory handle for uploaded files.
+
+Uploads are patient data, so they are kept out of ReportState: anything in
+the state is written to every checkpoint. run_full_pipeline() puts the bytes
+here under the run id for the duration of the run and discards them when
+the graph finishes; the ingest node reads them by run id.
+"""
+import threading
+from typing import Dict, Optional
+
+_uploads: Dict[str, bytes] = {}
+_lock = threading.Lock()
+
+
+def put(run_id: str, data: bytes) -> None:
+    with _lock:
+        _uploads[run_id] = data
+
+
+def get(run_id: Optional[str]) -> Optional[bytes]:
+    if run_id is None:
+        return None
+    with _lock:
+        return _uploads.get(run_id)
+
+
+def discard(run_id: str) -> None:
+    with _lock:
+        _uploads.pop(run_id, None)
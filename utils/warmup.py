@@ -0,0 +1,128 @@
+"""
+Background warm-up of heavy dependencies and readiness tracking.
+
+The API module only imports FastAPI and a few light helpers so that uvicorn
+can answer liveness probes immediately. Everything slow (PyMuPDF, the
+compiled LangGraph graphs, the Groq client, sentence-transformers/torch, the
+Pinecone client) is loaded here in a daemon thread, and /readyz reports
+which subsystems are warm.
+"""
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+# Subsystems that must be warm before the pod reports ready
+REQUIRED_SUBSYSTEMS = [
+    s.strip()
+    for s in os.getenv("READINESS_REQUIRED", "graphs,llm_client,embedding_model").split(",")
+    if s.strip()
+]
+
+_status: Dict[str, Dict[str, Any]] = {}
+_import_times: Dict[str, float] = {}
+_lock = threading.Lock()
+_thread = None
+
+
+def _warm_pdf_engine():
+    import fitz  # noqa: F401  (PyMuPDF)
+
+
+def _warm_ocr_binary():
+    from utils.ocr_utils import _ensure_tesseract_installed
+
+    if not _ensure_tesseract_installed():
+        raise RuntimeError("Tesseract binary not found")
+
+
+def _warm_llm_client():
+    from utils.llm_utils import get_llm
+
+    get_llm()
+
+
+def _warm_graphs():
+    from graph.run_pipeline import get_analysis_graph, get_rag_graph
+
+    get_analysis_graph()
+    get_rag_graph()
+
+
+def _warm_vector_store():
+    import langchain_pinecone  # noqa: F401
+
+
+def _warm_embedding_model():
+    from nodes.rag_node import get_embeddings
+
+    # One real forward pass so the first chat doesn't pay for lazy weight loading
+    get_embeddings().embed_query("warm-up")
+
+
+WARMUP_STEPS: List[Tuple[str, Callable[[], None]]] = [
+    ("pdf_engine", _warm_pdf_engine),
+    ("ocr_binary", _warm_ocr_binary),
+    ("llm_client", _warm_llm_client),
+    ("graphs", _warm_graphs),
+    ("vector_store", _warm_vector_store),
+    ("embedding_model", _warm_embedding_model),
+]
+
+
+def record_import_time(module: str, seconds: float) -> None:
+    _import_times[module] = round(seconds, 3)
+
+
+def _run_step(name: str, fn: Callable[[], None]) -> None:
+    modules_before = len(sys.modules)
+    start = time.perf_counter()
+    entry: Dict[str, Any] = {"ready": False}
+    try:
+        fn()
+        entry["ready"] = True
+    except Exception as e:
+        entry["error"] = str(e)
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    entry["modules_loaded"] = len(sys.modules) - modules_before
+    with _lock:
+        _status[name] = entry
+    print(f"Warm-up {name}: {'ready' if entry['ready'] else 'failed'} in {entry['seconds']}s"
+          + (f" ({entry['error']})" if "error" in entry else ""))
+
+
+def run_warmup() -> None:
+    """Warms every subsystem in order (blocking)."""
+    for name, fn in WARMUP_STEPS:
+        with _lock:
+            _status[name] = {"ready": False, "warming": True}
+        _run_step(name, fn)
+
+
+def start_warmup() -> None:
+    """Starts the warm-up in a daemon thread; calling it again is a no-op."""
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=run_warmup, name="warmup", daemon=True)
+    _thread.start()
+
+
+def readiness() -> Tuple[bool, Dict[str, Any]]:
+    """
+    Returns (ready, details) for the readiness endpoint. Without a warm-up
+    (WARMUP_ON_STARTUP=0) dependencies load on first use, so the process is
+    ready as soon as it serves HTTP.
+    """
+    with _lock:
+        subsystems = {name: dict(info) for name, info in _status.items()}
+        warmup_started = _thread is not None or bool(_status)
+    ready = not warmup_started or all(subsystems.get(name, {}).get("ready") for name in REQUIRED_SUBSYSTEMS)
+    return ready, {
+        "warmup": "started" if warmup_started else "disabled",
+        "required": REQUIRED_SUBSYSTEMS,
+        "subsystems": subsystems,
+        "import_seconds": dict(_import_times),
+    }